@@ -4,554 +4,4946 @@ This script connects to Twitch chat via IRC protocol and displays messages
 in a real-time GUI window with sound notifications and user color support.
 """
 
+import argparse
+import asyncio
 import base64
+import bisect
+import codecs
+import concurrent.futures
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
 import json
+import logging
+import math
+import mmap
 import os
+import queue
+import random
 import re
+import shutil
 import signal
 import socket
+import sqlite3
 import ssl
+import struct
+import subprocess
 import sys
+import tempfile
 import threading
-import webbrowser
+import time
+import zlib
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
 
-import tkinter as tk
-from tkinter import BooleanVar, Checkbutton, scrolledtext, messagebox, simpledialog
-import winsound
+# tkinter is imported by _import_tk() in GUI mode only, so headless mode
+# works on machines without a display or Tk installed. webbrowser, urllib,
+# http.server and multiprocessing are imported where they are used, since
+# only optional features need them and together they add about 40 ms to
+# every launch.
+tk = None
+
+log = logging.getLogger('BetterTwitchChat')
 
 # Configuration constants
 TWITCH_SERVER = 'irc.chat.twitch.tv'
 TWITCH_PORT = 6667
+TWITCH_TLS_PORT = 6697
 TOKEN = 'oauth:__CHANGEME__'  # This will be updated by the token dialog
 SOUND_FILE = 'notification.wav'
 SETTINGS_FILE = 'chat_settings.json'
+SETTINGS_DEBOUNCE = 0.5
+WINDOW_WIDTH = 600
+WINDOW_HEIGHT = 500
+RECV_BUFFER_SIZE = 16384
+MAX_LINE_LENGTH = 65536
+RENDER_FPS = 30
+RENDER_QUEUE_SIZE = 5000
+RENDER_MAX_BATCH = 500
+OVERFLOW_POLICIES = ('drop_oldest', 'collapse')
+SCROLLBACK_LINES = 5000
+REPEAT_WINDOW = 30.0
+REPEAT_MAX_ENTRIES = 5000
+STATS_TOP_CAPACITY = 1000
+STATS_TOP_SHOWN = 10
+STATS_HLL_PRECISION = 12
+STATS_BUCKET_SECONDS = 10.0
+STATS_BUCKETS = 90
+STATS_REDRAW_INTERVAL = 1.0
+MODERATION_DISPLAYS = ('strike', 'hide')
+EMOTE_URL = 'https://static-cdn.jtvnw.net/emoticons/v2/{id}/static/dark/1.0'
+EMOTE_MEMORY_CACHE = 2000
+EMOTE_WORKERS = 4
+EMOTE_FETCH_TIMEOUT = 10.0
+EMOTE_RETRY_INTERVAL = 300.0
+CHAT_BACKGROUND = '#2d2d2d'
+COLOR_TAG_POOL_SIZE = 512
+MIN_NAME_CONTRAST = 4.5
+SOUND_INTERVAL = 0.25
+AUDIO_BACKENDS = ('auto', 'winsound', 'linux', 'null')
+MAX_CONNECTIONS = 3
+JOIN_RATE_LIMIT = 20
+JOIN_RATE_WINDOW = 10.0
+SEND_RATE_LIMIT = 20
+SEND_RATE_LIMIT_MOD = 100
+SEND_RATE_WINDOW = 30.0
+SEND_RATE_SLACK = 0.5
+SEND_QUEUE_SIZE = 100
+INGEST_RING_SLOTS = 8192
+INGEST_SLOT_SIZE = 2048
+INGEST_MAX_BATCH = 2000
+INGEST_RESTART_DELAY = 1.0
+INGEST_KINDS = ('status', 'system', 'PRIVMSG', 'USERNOTICE', 'CLEARCHAT', 'CLEARMSG')
+INGEST_TAGS = frozenset(('badges', 'ban-duration', 'color', 'display-name', 'emotes', 'id', 'login',
+                         'msg-id', 'system-msg', 'target-msg-id', 'tmi-sent-ts'))
+PING_INTERVAL = 60.0
+PONG_TIMEOUT = 10.0
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+BACKOFF_RESET = 10.0
+ARCHIVED_COMMANDS = frozenset(('PRIVMSG', 'USERNOTICE', 'CLEARCHAT', 'CLEARMSG', 'NOTICE'))
+JSONL_BUFFER_SIZE = 1 << 16
+JSONL_FLUSH_INTERVAL = 1.0
+FAKE_SERVER_PORT = 6667
+FAKE_SERVER_TICK = 0.01
+RECORD_FLUSH_INTERVAL = 5.0
+GZIP_READ_SIZE = 1 << 20
+GZIP_HOLD_LIMIT = 4 << 20
+ANALYZE_CHUNK_SIZE = 32 * 1024 * 1024
+HISTORY_BATCH_SIZE = 500
+HISTORY_BATCH_INTERVAL = 0.5
+HISTORY_SEARCH_LIMIT = 200
+METRICS_BUCKETS = tuple(m * 10.0 ** e for e in range(-6, 1) for m in (1, 2.5, 5)) + (10.0,)
+METRICS_READOUT_INTERVAL = 1.0
+OVERLAY_PORT = 8765
+OVERLAY_CLIENT_BUFFER = 500
+OVERLAY_DRAIN_TIMEOUT = 10.0
+OVERLAY_KEEPALIVE = 15.0
 
 
-class SoundManager:
-    """Manages sound playback with thread limiting to prevent audio chaos."""
+def _import_tk():
+    """Import tkinter and its submodules into module globals on first use."""
+    global tk, BooleanVar, Checkbutton, scrolledtext, messagebox, simpledialog, ttk
+    import tkinter as tk
+    from tkinter import BooleanVar, Checkbutton, scrolledtext, messagebox, simpledialog, ttk
+
+
+def settings_path():
+    """Return the path of the settings file next to this script."""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), SETTINGS_FILE)
+
+
+def read_settings(path=None):
+    """Read the settings file.
+    
+    Returns:
+        The settings dict, or an empty dict if the file does not exist.
+    """
+    path = path or settings_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+class SettingsStore:
+    """Settings kept in memory and written to disk in the background.
+    
+    update() only changes the in-memory dict; a writer thread saves it
+    once no change has arrived for `debounce` seconds, so a burst of
+    updates (typing a channel name) costs one write. Each write goes to
+    a temporary file that is fsynced and renamed over the settings file,
+    so a crash never leaves a truncated file behind. flush() and close()
+    write synchronously, for shutdown.
+    """
+    
+    def __init__(self, path=None, debounce=SETTINGS_DEBOUNCE):
+        self.path = path or settings_path()
+        self.debounce = debounce
+        self.writes = 0
+        try:
+            self.data = read_settings(self.path)
+        except Exception as e:
+            log.warning("Could not load settings: %s", e)
+            self.data = {}
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._dirty = False
+        self._changed_at = 0.0
+        self._closed = False
+        self._thread = None
+    
+    def update(self, changes, remove=()):
+        """Merge changes into the settings and schedule a write."""
+        with self._cond:
+            for key in remove:
+                self.data.pop(key, None)
+            self.data.update(changes)
+            self._dirty = True
+            self._changed_at = time.monotonic()
+            if self._thread is None and not self._closed:
+                self._thread = threading.Thread(target=self._run, name="settings-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed:
+                    if not self._dirty:
+                        self._cond.wait()
+                        continue
+                    remaining = self._changed_at + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+            self.flush()
+    
+    def flush(self):
+        """Write pending changes now, on the calling thread."""
+        # Held across snapshot and write so an older snapshot can never
+        # land on disk after a newer one
+        with self._write_lock:
+            with self._cond:
+                if not self._dirty:
+                    return
+                text = json.dumps(self.data, indent=2)
+                self._dirty = False
+            try:
+                self._write(text)
+            except Exception as e:
+                log.error("Could not save settings: %s", e)
+    
+    def _write(self, text):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        handle, temp_path = tempfile.mkstemp(prefix='.settings-', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(handle, 'w') as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        self.writes += 1
+    
+    def close(self):
+        """Stop the writer thread and write any pending changes."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+
+def read_endpoint(settings):
+    """Return the IRC endpoint overrides (host, port, use_tls) found in settings."""
+    endpoint = {}
+    if isinstance(settings.get('server'), str) and settings['server'].strip():
+        endpoint['host'] = settings['server'].strip()
+    if isinstance(settings.get('port'), int) and 0 < settings['port'] < 65536:
+        endpoint['port'] = settings['port']
+    if isinstance(settings.get('use_tls'), bool):
+        endpoint['use_tls'] = settings['use_tls']
+    return endpoint
+
+
+def parse_endpoint(text):
+    """Parse 'host[:port]' from the command line into endpoint overrides."""
+    host, sep, port = text.rpartition(':')
+    if sep and port.isdigit():
+        return {'host': host, 'port': int(port)}
+    return {'host': text}
+
+
+class NullAudioBackend:
+    """Audio backend that plays nothing and only counts play requests."""
+    
+    def __init__(self):
+        self.plays = 0
+    
+    def play(self, data):
+        """Record a play without producing any sound."""
+        self.plays += 1
+
+
+class WinsoundBackend:
+    """Audio backend using the Windows winsound module."""
+    
+    def __init__(self):
+        import winsound
+        self._winsound = winsound
+    
+    def play(self, data):
+        """Play WAV data from memory, or a short beep if there is none."""
+        if data:
+            self._winsound.PlaySound(data, self._winsound.SND_MEMORY)
+        else:
+            self._winsound.Beep(1000, 100)
+
+
+class LinuxAudioBackend:
+    """Audio backend that pipes WAV data to a command line player."""
+    
+    PLAYERS = (('paplay', []), ('aplay', ['-q', '-']))
     
     def __init__(self):
-        self.sound_threads = []
-        self.max_concurrent_sounds = 5
+        for name, args in self.PLAYERS:
+            path = shutil.which(name)
+            if path:
+                self._command = [path] + args
+                break
+        else:
+            raise RuntimeError("No audio player found (tried paplay, aplay)")
+    
+    def play(self, data):
+        """Play WAV data and wait for the player to finish."""
+        if data:
+            subprocess.run(self._command, input=data, stdout=subprocess.DEVNULL,
+                           stderr=subprocess.DEVNULL, check=False)
+
+
+def create_audio_backend(name='auto'):
+    """Create an audio backend by name, falling back to the null backend.
+    
+    Args:
+        name: One of AUDIO_BACKENDS. 'auto' picks winsound on Windows and a
+            command line player elsewhere.
+    
+    Returns:
+        An object with a play(data) method.
+    """
+    if name == 'auto':
+        name = 'winsound' if sys.platform == 'win32' else 'linux'
+    try:
+        if name == 'winsound':
+            return WinsoundBackend()
+        if name == 'linux':
+            return LinuxAudioBackend()
+    except Exception as e:
+        log.warning("Could not initialize %s audio backend: %s", name, e)
+    return NullAudioBackend()
+
+
+class SoundManager:
+    """Plays the notification sound on a single long-lived worker thread.
+    
+    The WAV file is read into memory once. Requests are coalesced so at most
+    one chime plays per min_interval seconds, however many messages arrive;
+    play_sound() itself only sets a flag and never blocks or spawns threads.
+    """
+    
+    def __init__(self, backend=None, min_interval=SOUND_INTERVAL, sound_path=None):
+        if sound_path is None:
+            sound_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), SOUND_FILE)
+        self.backend = backend
+        self.backend_name = 'auto'
+        self.min_interval = min_interval
+        self.sound_path = sound_path
+        self.played = 0
+        self.suppressed = 0
+        self._sound = None
+        self._pending = threading.Event()
+        self._worker = None
+        self._lock = threading.Lock()
     
     def play_sound(self):
-        """Play notification sound in a separate thread."""
-        self.sound_threads = [thread for thread in self.sound_threads if thread.is_alive()]
-        
-        if len(self.sound_threads) >= self.max_concurrent_sounds:
+        """Request a chime; extra requests while one is pending are dropped."""
+        if self._pending.is_set():
+            self.suppressed += 1
             return
+        self._pending.set()
+        if self._worker is None:
+            self._start_worker()
+    
+    def _start_worker(self):
+        """Start the audio worker thread once."""
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="audio", daemon=True)
+                self._worker.start()
+    
+    def _run(self):
+        """Worker loop: load the backend and sample, then play pending chimes."""
+        if self.backend is None:
+            self.backend = create_audio_backend(self.backend_name)
+        try:
+            with open(self.sound_path, 'rb') as f:
+                self._sound = f.read()
+        except OSError as e:
+            log.warning("Could not load sound file: %s", e)
         
-        def _play_sound_thread():
+        last_played = float('-inf')
+        while True:
+            self._pending.wait()
+            delay = last_played + self.min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._pending.clear()
             try:
-                script_dir = os.path.dirname(os.path.abspath(__file__))
-                sound_path = os.path.join(script_dir, SOUND_FILE)
-                
-                if os.path.exists(sound_path):
-                    winsound.PlaySound(sound_path, winsound.SND_FILENAME | winsound.SND_ASYNC)
-                else:
-                    winsound.Beep(1000, 100)
+                self.backend.play(self._sound)
             except Exception as e:
-                print(f"Could not play sound: {e}")
-                print("🔊 SOUND TRIGGERED! 🔊")
-        
-        sound_thread = threading.Thread(target=_play_sound_thread, daemon=True)
-        sound_thread.start()
-        self.sound_threads.append(sound_thread)
+                log.warning("Could not play sound: %s", e)
+            last_played = time.monotonic()
+            self.played += 1
 
 
 # Global sound manager instance
 sound_manager = SoundManager()
 
 
-class ChatWindow:
-    """Main GUI window for the Twitch chat reader application."""
+class Histogram:
+    """Fixed-bucket histogram; observe() is one bisect and a few additions."""
     
-    def __init__(self):
-        self.root = tk.Tk()
-        self.root.title("BetterTwitchChat")
-        self.root.geometry("600x500")
-        self.root.configure(bg='#1a1a1a')
-        
-        self.connected = False
-        self.sock = None
-        self.chat_thread = None
-        self.ignored_usernames = set()
-        
-        self._setup_ui()
-        self._setup_event_handlers()
-        self.load_settings()
-        
-        if self.auto_connect_var.get():
-            self.root.after(1000, self.connect)
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
     
-    def _setup_ui(self):
-        """Set up the user interface components."""
-        main_frame = tk.Frame(self.root, bg='#1a1a1a')
-        main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        
-        self._create_connection_frame(main_frame)
-        self._create_chat_display(main_frame)
-        self._create_bottom_bar(main_frame)
-        self._configure_chat_tags()
-        
-        self.center_window()
+    def __init__(self, bounds=METRICS_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
     
-    def _create_connection_frame(self, parent):
-        """Create the connection controls frame."""
-        connection_frame = tk.Frame(parent, bg='#1a1a1a')
-        connection_frame.pack(fill=tk.X, pady=(0, 10))
-        
-        # Channel input
-        channel_frame = tk.Frame(connection_frame, bg='#1a1a1a')
-        channel_frame.pack(side=tk.LEFT, padx=(0, 10))
-        
-        tk.Label(channel_frame, text="Channel:", fg='#ffffff', bg='#1a1a1a',
-                font=("Arial", 10)).pack(side=tk.LEFT)
-        
-        self.channel_var = tk.StringVar(value='rakthegoose')
-        self.channel_entry = tk.Entry(channel_frame, textvariable=self.channel_var,
-                                     width=15, bg='#2d2d2d', fg='#ffffff',
-                                     insertbackground='#ffffff')
-        self.channel_entry.pack(side=tk.LEFT, padx=(5, 0))
-        self.channel_var.trace('w', lambda *args: self.save_settings())
-        
-        # Connect button
-        self.connect_button = tk.Button(connection_frame, text="Connect",
-                                       command=self.toggle_connection,
-                                       bg='#28a745', fg='#ffffff',
-                                       font=("Arial", 10, "bold"),
-                                       width=10, relief=tk.FLAT)
-        self.connect_button.pack(side=tk.RIGHT)
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def percentile(self, fraction, since=None):
+        """Return the upper bound of the bucket holding the given fraction.
         
-        # Sound toggle
-        self.sound_enabled_var = BooleanVar(value=True)
-        self.sound_checkbox = Checkbutton(connection_frame, text="Enable Sound",
-                                         variable=self.sound_enabled_var,
-                                         fg='#ffffff', bg='#1a1a1a',
-                                         selectcolor='#2d2d2d',
-                                         font=("Arial", 9),
-                                         command=self.save_settings)
-        self.sound_checkbox.pack(side=tk.RIGHT, padx=(0, 10))
+        Args:
+            fraction: 0.5 for the median, 0.99 for p99, and so on.
+            since: Optional earlier copy of `counts`; only observations made
+                after it was taken are considered.
         
-        # Auto-connect toggle
-        self.auto_connect_var = BooleanVar()
-        self.auto_connect_checkbox = Checkbutton(connection_frame,
-                                                text="Auto-connect on launch",
-                                                variable=self.auto_connect_var,
-                                                fg='#ffffff', bg='#1a1a1a',
-                                                selectcolor='#2d2d2d',
-                                                font=("Arial", 9),
-                                                command=self.save_settings)
-        self.auto_connect_checkbox.pack(side=tk.RIGHT, padx=(0, 10))
+        Returns:
+            The bucket bound in seconds, or None without observations.
+        """
+        counts = self.counts
+        if since is not None:
+            counts = [now - before for now, before in zip(counts, since)]
+        total = sum(counts)
+        if not total:
+            return None
+        seen = 0
+        for bound, count in zip(self.bounds + (float('inf'),), counts):
+            seen += count
+            if seen >= fraction * total:
+                return bound
+
+
+class Metrics:
+    """Counters and histograms for the ingest, parse and render pipeline.
     
-    def _create_chat_display(self, parent):
-        """Create the chat message display area."""
-        self.chat_display = scrolledtext.ScrolledText(
-            parent, wrap=tk.WORD, width=70, height=18,
-            font=("Consolas", 10), bg='#2d2d2d', fg='#ffffff',
-            insertbackground='#ffffff', selectbackground='#404040',
-            state='disabled'
-        )
-        self.chat_display.pack(fill=tk.BOTH, expand=True)
+    Counters are plain attributes, each only updated from the thread that
+    owns it, so recording one costs no more than an attribute increment.
+    Values owned by other objects, like the render queue depth, are
+    registered with gauge() and only read when metrics are exported.
+    """
     
-    def _create_bottom_bar(self, parent):
-        """Create the bottom status bar with footer and status indicator."""
-        bottom_frame = tk.Frame(parent, bg='#1a1a1a')
-        bottom_frame.pack(fill=tk.X, pady=(5, 0))
-        
-        # Footer
-        footer_text = tk.Label(bottom_frame, text="Proudly created by",
-                              fg='#888888', bg='#1a1a1a', font=("Arial", 8))
-        footer_text.pack(side=tk.LEFT)
-        
-        github_link = tk.Label(bottom_frame, text="RakTheGoose",
-                              fg='#888888', bg='#1a1a1a',
-                              font=("Arial", 8, "underline"), cursor="hand2")
-        github_link.pack(side=tk.LEFT)
-        github_link.bind("<Button-1>",
-                        lambda e: webbrowser.open("https://github.com/GooseWithAKnife"))
-        
-        def on_enter(e):
-            github_link.config(fg='#cccccc')
-        
-        def on_leave(e):
-            github_link.config(fg='#888888')
-        
-        github_link.bind("<Enter>", on_enter)
-        github_link.bind("<Leave>", on_leave)
-        
-        # Spacer
-        spacer = tk.Frame(bottom_frame, bg='#1a1a1a')
-        spacer.pack(side=tk.LEFT, fill=tk.X, expand=True)
-        
-        # Ignore list button
-        self.ignore_button = tk.Button(bottom_frame, text="Ignore List",
-                                       command=self.open_ignore_list_window,
-                                       bg='#007bff', fg='#ffffff',
-                                       font=("Arial", 9, "bold"),
-                                       width=12, relief=tk.FLAT, cursor="hand2")
-        self.ignore_button.pack(side=tk.RIGHT, padx=(0, 10))
+    COUNTERS = (
+        ('bytes_received', "Bytes read from IRC connections"),
+        ('lines_received', "IRC lines read from IRC connections"),
+        ('messages_rendered', "Chat lines drawn in the window"),
+    )
+    HISTOGRAMS = (
+        ('parse_seconds', "Time to parse one IRC line"),
+        ('render_latency_seconds', "Time from queueing a message to drawing it"),
+        ('tick_seconds', "Duration of one UI render tick"),
+    )
+    PREFIX = 'bettertwitchchat_'
+    
+    def __init__(self):
+        for name, _ in self.COUNTERS:
+            setattr(self, name, 0)
+        for name, _ in self.HISTOGRAMS:
+            setattr(self, name, Histogram())
+        self._gauges = {}
+    
+    def gauge(self, name, help_text, read, kind='gauge'):
+        """Register a value that is read with read() whenever metrics are exported."""
+        self._gauges[name] = (help_text, kind, read)
+    
+    def to_prometheus(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        out = []
+        for name, help_text in self.COUNTERS:
+            full = f"{self.PREFIX}{name}_total"
+            out += [f"# HELP {full} {help_text}", f"# TYPE {full} counter",
+                    f"{full} {getattr(self, name)}"]
+        for name, (help_text, kind, read) in self._gauges.items():
+            full = self.PREFIX + name
+            try:
+                value = read()
+            except Exception:
+                continue
+            out += [f"# HELP {full} {help_text}", f"# TYPE {full} {kind}", f"{full} {value}"]
+        for name, help_text in self.HISTOGRAMS:
+            full = self.PREFIX + name
+            histogram = getattr(self, name)
+            out += [f"# HELP {full} {help_text}", f"# TYPE {full} histogram"]
+            cumulative = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                cumulative += count
+                out.append(f'{full}_bucket{{le="{bound:g}"}} {cumulative}')
+            out += [f'{full}_bucket{{le="+Inf"}} {histogram.count}',
+                    f"{full}_sum {histogram.sum}", f"{full}_count {histogram.count}"]
+        return "\n".join(out) + "\n"
+
+
+class MetricsServer:
+    """Serves metrics as Prometheus text at /metrics on a background thread."""
+    
+    def __init__(self, metrics, port, host='127.0.0.1'):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
         
-        # Status indicator
-        self.status_orb = tk.Label(bottom_frame, text="●", fg='#ff4444',
-                                  bg='#1a1a1a', font=("Arial", 16, "bold"))
-        self.status_orb.pack(side=tk.RIGHT, padx=(0, 5), pady=(0, 2))
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, format, *args):
+                log.debug("metrics: " + format, *args)
         
-        self.status_label = tk.Label(bottom_frame, text="Disconnected",
-                                    fg='#888888', bg='#1a1a1a', font=("Arial", 9))
-        self.status_label.pack(side=tk.RIGHT)
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self._thread.start()
+        log.info("Serving metrics on http://%s:%d/metrics", host, self.port)
     
-    def open_ignore_list_window(self):
-        """Open a window to edit ignored usernames (newline-separated)."""
-        win = tk.Toplevel(self.root)
-        win.title("Ignore List")
-        win.configure(bg='#1a1a1a')
-        win.geometry("400x350")
-        win.transient(self.root)
-        win.grab_set()
+    def close(self):
+        """Stop serving."""
+        self.server.shutdown()
+        self.server.server_close()
 
-        tk.Label(win, text="Usernames to ignore (no sound):",
-                 fg='#ffffff', bg='#1a1a1a', font=("Arial", 10, "bold")).pack(anchor='w', padx=10, pady=(10, 5))
 
-        hint = tk.Label(win, text="Enter one username per line. '@' optional. Case-insensitive.",
-                        fg='#aaaaaa', bg='#1a1a1a', font=("Arial", 9))
-        hint.pack(anchor='w', padx=10, pady=(0, 8))
+def _format_seconds(seconds):
+    """Format a duration compactly for the status bar readout."""
+    if seconds is None:
+        return "-"
+    if seconds == float('inf'):
+        return ">10s"
+    if seconds < 1e-3:
+        return f"{seconds * 1e6:.0f}µs"
+    if seconds < 1:
+        return f"{seconds * 1e3:.0f}ms"
+    return f"{seconds:.1f}s"
 
-        text = scrolledtext.ScrolledText(win, wrap=tk.WORD, width=45, height=12,
-                                         font=("Consolas", 10), bg='#2d2d2d', fg='#ffffff',
-                                         insertbackground='#ffffff', selectbackground='#404040')
-        # Pre-fill with current list
-        try:
-            current = sorted(self.ignored_usernames)
-            text.insert('1.0', "\n".join(current))
-        except Exception:
-            pass
-        text.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
 
-        button_frame = tk.Frame(win, bg='#1a1a1a')
-        button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+# Global metrics instance
+metrics = Metrics()
+metrics.gauge('sounds_played_total', "Notification sounds played",
+              lambda: sound_manager.played, 'counter')
+metrics.gauge('sounds_suppressed_total', "Notification sounds coalesced into another chime",
+              lambda: sound_manager.suppressed, 'counter')
 
-        def save_and_close():
-            raw = text.get('1.0', tk.END)
-            names = []
-            for line in raw.splitlines():
-                name = line.strip()
-                if not name:
-                    continue
-                if name.startswith('@'):
-                    name = name[1:]
-                names.append(name.lower())
-            self.ignored_usernames = set(names)
-            self.save_settings()
-            messagebox.showinfo("Ignore List", "Ignore list saved.", parent=win)
-            win.destroy()
 
-        save_btn = tk.Button(button_frame, text="Save", command=save_and_close,
-                             bg='#28a745', fg='#ffffff', font=("Arial", 9, "bold"),
-                             width=10, relief=tk.FLAT, cursor="hand2")
-        save_btn.pack(side=tk.RIGHT, padx=(5, 0))
+class IrcLineFramer:
+    """Reassembles complete IRC lines from a stream of raw socket reads.
+    
+    Bytes are received into one reusable buffer and decoded incrementally, so
+    lines and multibyte characters split across reads come out intact.
+    """
+    
+    def __init__(self, buffer_size=RECV_BUFFER_SIZE):
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._pending = ''
+    
+    def feed(self, data):
+        """Decode a chunk of bytes and return the list of lines it completes."""
+        text = self._decoder.decode(data)
+        if self._pending:
+            text = self._pending + text
+        lines = text.split('\r\n')
+        self._pending = lines.pop()
+        if len(self._pending) > MAX_LINE_LENGTH:
+            # Never buffer an unterminated line without bound
+            self._pending = ''
+        return lines
+    
+    def read_lines(self, sock):
+        """Yield complete, non-empty lines received from sock until EOF."""
+        buffer = self._buffer
+        view = self._view
+        feed = self.feed
+        while True:
+            received = sock.recv_into(buffer)
+            if not received:
+                return
+            for line in feed(view[:received]):
+                if line:
+                    yield line
 
-        cancel_btn = tk.Button(button_frame, text="Cancel", command=win.destroy,
-                               bg='#6c757d', fg='#ffffff', font=("Arial", 9, "bold"),
-                               width=10, relief=tk.FLAT, cursor="hand2")
-        cancel_btn.pack(side=tk.RIGHT)
 
-        # Center the ignore list window on the screen
-        try:
-            win.update_idletasks()
-            screen_width = win.winfo_screenwidth()
-            screen_height = win.winfo_screenheight()
-            window_width = win.winfo_width()
-            window_height = win.winfo_height()
-            x = (screen_width - window_width) // 2
-            y = (screen_height - window_height) // 2
-            win.geometry(f"{window_width}x{window_height}+{x}+{y}")
-        except Exception:
-            pass
+class TrafficRecorder:
+    """Appends raw received IRC lines to a gzip log with receive timestamps.
     
-    def _configure_chat_tags(self):
-        """Configure text tags for different message types."""
-        self.chat_display.tag_configure("timestamp", foreground="#888888")
-        self.chat_display.tag_configure("username", foreground="#00ff00",
-                                       font=("Consolas", 10, "bold"))
-        self.chat_display.tag_configure("message", foreground="#ffffff")
-        self.chat_display.tag_configure("system", foreground="#ffaa00",
-                                       font=("Consolas", 10, "bold"))
+    Each line is stored as '<unix time>\\t<raw line>'. The file is opened in
+    append mode and the current gzip member is closed and a new one started
+    every flush_interval seconds, so earlier recordings are never rewritten
+    and a crash loses only the last few seconds. Safe to call from any thread.
+    """
     
-    def _setup_event_handlers(self):
-        """Set up event handlers for the window."""
-        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+    def __init__(self, path, flush_interval=RECORD_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._file = gzip.open(path, 'ab')
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
     
-    def center_window(self):
-        """Center the window on the screen."""
-        self.root.update_idletasks()
-        
-        screen_width = self.root.winfo_screenwidth()
-        screen_height = self.root.winfo_screenheight()
-        window_width = self.root.winfo_width()
-        window_height = self.root.winfo_height()
-        
-        x = (screen_width - window_width) // 2
-        y = (screen_height - window_height) // 2
-        
-        self.root.geometry(f"{window_width}x{window_height}+{x}+{y}")
+    def record(self, lines):
+        """Record a batch of raw lines received together."""
+        stamp = f"{time.time():.6f}\t"
+        data = "".join(f"{stamp}{line}\n" for line in lines if line).encode('utf-8')
+        if not data:
+            return
+        with self._lock:
+            self._file.write(data)
+            self.count += len(lines)
+            now = time.monotonic()
+            if now - self._last_flush >= self.flush_interval:
+                self._file.close()
+                self._file = gzip.open(self.path, 'ab')
+                self._last_flush = now
     
-    def add_message(self, username, message, color=None):
-        """Add a chat message to the display."""
-        timestamp = datetime.now().strftime("%H:%M:%S")
-        
-        self.chat_display.config(state='normal')
-        self.chat_display.insert(tk.END, f"[{timestamp}] ", "timestamp")
-        
-        if color:
-            tag_name = f"user_{username}"
-            self.chat_display.tag_configure(tag_name, foreground=color,
-                                           font=("Consolas", 10, "bold"))
-            self.chat_display.insert(tk.END, f"{username}: ", tag_name)
-        else:
-            self.chat_display.insert(tk.END, f"{username}: ", "username")
-        
-        self.chat_display.insert(tk.END, f"{message}\n", "message")
-        self.chat_display.config(state='disabled')
-        self.chat_display.see(tk.END)
+    def close(self):
+        """Flush and close the log."""
+        with self._lock:
+            self._file.close()
+
+
+def read_traffic_log(path):
+    """Yield (timestamp, line) pairs from a recorded traffic log.
     
-    def add_system_message(self, message):
-        """Add a system message to the display."""
-        timestamp = datetime.now().strftime("%H:%M:%S")
+    Accepts gzip logs written by TrafficRecorder as well as plain text files
+    of raw IRC lines; lines without a timestamp yield None for it.
+    
+    Args:
+        path: Path to the log file.
+    """
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    if compressed:
+        for block in read_gzip_log_text(path):
+            for line in block.split('\n'):
+                line = line.rstrip('\r')
+                if line:
+                    yield split_log_stamp(line)
+        return
+    with open(path, 'rt', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            line = line.rstrip('\r\n')
+            if line:
+                yield split_log_stamp(line)
+
+
+def _gzip_members(path, read_size=GZIP_READ_SIZE):
+    """Yield the decompressed bytes of every gzip member in path, block by block.
+    
+    Members are decompressed one after another, each starting where the
+    last one's data ended. A member cut short, such as the last one
+    written by a session that crashed, ends where its data ends and is
+    followed by None. When its data runs into a later session's member,
+    decoding that as more of the cut member fails or runs off the end of
+    the file; only then is the file searched for the next member's
+    header, and reading resumes there.
+    
+    Output is held back from the first block that contains the gzip
+    magic bytes (other than the member's own header) until it ends (or GZIP_HOLD_LIMIT bytes of input
+    later), so that a cut member can be decoded again up to the header
+    instead of passing on what its decoder made of the next member.
+    """
+    magic = b'\x1f\x8b\x08'
+    with open(path, 'rb') as f:
+        start = 0
+        rest = b''
+        while True:
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            position = start
+            held = []
+            try:
+                while not decompressor.eof:
+                    data = rest or f.read(read_size)
+                    rest = b''
+                    if not data:
+                        break
+                    offset = position
+                    position += len(data)
+                    if (held or data.find(magic, 1 if offset == start else 0) >= 0
+                            or data.endswith((magic[:1], magic[:2]))):
+                        # Kept before decompressing, in case this block is where it fails
+                        before = decompressor.copy()
+                        held.append((offset, before, None))
+                        held[-1] = (offset, before, decompressor.decompress(data))
+                        if position - held[0][0] >= GZIP_HOLD_LIMIT:
+                            for _, _, output in held:
+                                yield output
+                            held = []
+                    else:
+                        yield decompressor.decompress(data)
+            except zlib.error:
+                pass
+            else:
+                if decompressor.eof:
+                    for _, _, output in held:
+                        yield output
+                    rest = decompressor.unused_data or f.read(read_size)
+                    if not rest:
+                        return
+                    start = position - len(decompressor.unused_data)
+                    continue
+            
+            next_start = _find_gzip_header(f, start + 1)
+            for i, (offset, before, output) in enumerate(held):
+                end = held[i + 1][0] if i + 1 < len(held) else position
+                if next_start is not None and offset <= next_start < end:
+                    yield _decompress_range(f, before, offset, next_start)
+                    break
+                if output is not None:
+                    yield output
+            yield None
+            if next_start is None:
+                log.warning("%s: gzip data ends early; read what was complete", path)
+                return
+            log.warning("%s: skipped the unfinished end of a gzip member", path)
+            start = next_start
+            f.seek(start)
+
+
+def _decompress_range(f, decompressor, start, end):
+    """Return what decompressor makes of f from start to end, or b'' if it is damaged."""
+    f.seek(start)
+    try:
+        return decompressor.decompress(f.read(end - start))
+    except zlib.error:
+        return b''
+
+
+def _find_gzip_header(f, offset, read_size=GZIP_READ_SIZE, probe_size=1 << 14):
+    """Return the offset of the next gzip member at or after offset in f, or None.
+    
+    Only used to resynchronize after a damaged or cut member. The magic
+    bytes can turn up inside compressed data, so each one found has to
+    start a header with no reserved flags set and data that decompresses.
+    """
+    magic = b'\x1f\x8b\x08'
+    while True:
+        f.seek(offset)
+        buffer = f.read(read_size + len(magic))
+        if len(buffer) < len(magic):
+            return None
+        found = buffer.find(magic)
+        while 0 <= found < read_size:
+            if found + 3 < len(buffer) and not buffer[found + 3] & 0xe0:
+                f.seek(offset + found)
+                try:
+                    zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(f.read(probe_size))
+                    return offset + found
+                except zlib.error:
+                    pass
+            found = buffer.find(magic, found + 1)
+        offset += read_size
+
+
+def read_gzip_log_text(path):
+    """Yield the text of a gzip log in blocks that end at line boundaries.
+    
+    Truncated and damaged members are handled as in _gzip_members; the
+    unfinished last line of such a member is dropped.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    tail = ''
+    for data in _gzip_members(path):
+        if data is None:
+            decoder.reset()
+            tail = ''
+            continue
+        text = tail + decoder.decode(data)
+        cut = text.rfind('\n') + 1
+        tail = text[cut:]
+        if cut:
+            yield text[:cut]
+    tail += decoder.decode(b'', True)
+    if tail:
+        yield tail
+
+
+def split_log_stamp(line):
+    """Split a traffic log line into (timestamp, raw line); timestamp may be None."""
+    stamp, sep, raw = line.partition('\t')
+    if sep and stamp.replace('.', '', 1).isdigit():
+        return float(stamp), raw
+    return None, line
+
+
+def parse_speed(text):
+    """Parse a replay speed such as '1', '10x' or 'max' (returned as 0)."""
+    text = str(text).strip().lower()
+    if text == 'max':
+        return 0.0
+    speed = float(text.rstrip('x'))
+    if speed <= 0:
+        raise ValueError("speed must be positive or 'max'")
+    return speed
+
+
+def paced_replay(path, speed=1.0):
+    """Yield (due, line) pairs from a traffic log.
+    
+    due is the number of seconds after the start of the replay at which line
+    should be delivered to reproduce the recorded timing at speed. With a
+    speed of 0 ('max') every line is due immediately.
+    """
+    first = None
+    for stamp, line in read_traffic_log(path):
+        if speed and stamp is not None:
+            if first is None:
+                first = stamp
+            yield (stamp - first) / speed, line
+        else:
+            yield 0.0, line
+
+
+def replay_traffic_log(path, speed, on_message, stop=None):
+    """Parse a traffic log and feed it to on_message with its recorded timing.
+    
+    This is the direct-feed replay path: no socket is involved, so parsing
+    and everything downstream see the exact recorded burst shape.
+    
+    Args:
+        path: Path to the log file.
+        speed: Playback speed multiplier, or 0 for as fast as possible.
+        on_message: Called with each parsed IrcMessage.
+        stop: Optional threading.Event that ends the replay early.
+    
+    Returns:
+        The number of messages delivered.
+    """
+    started = time.monotonic()
+    delivered = 0
+    for due, line in paced_replay(path, speed):
+        if stop is not None and stop.is_set():
+            break
+        delay = started + due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if line.startswith('PING'):
+            continue
+        msg = parse_irc_line(line)
+        if msg is not None:
+            on_message(msg)
+            delivered += 1
+    return delivered
+
+
+class LogStats:
+    """Aggregates over a slice of a chat log, mergeable with other slices.
+    
+    Counts lines, chat messages per user and channel, messages per minute
+    (by the server's tmi-sent-ts, else the recorded receive time), emote
+    uses and keyword hits. Keywords match whole words, case-insensitively.
+    """
+    
+    def __init__(self, keywords=()):
+        self.keywords = [keyword.lower() for keyword in keywords]
+        self.lines = 0
+        self.messages = 0
+        self.users = Counter()
+        self.channels = Counter()
+        self.minutes = Counter()
+        self.emotes = Counter()
+        self.emote_names = {}
+        self.keyword_hits = Counter()
+        self._keyword_re = (re.compile(r'\b(?:' + '|'.join(map(re.escape, self.keywords)) + r')\b',
+                                       re.IGNORECASE)
+                            if self.keywords else None)
+    
+    def add_lines(self, block):
+        """Count every line in a block of log text made of whole lines."""
+        users, channels, minutes = self.users, self.channels, self.minutes
+        emotes, emote_names, keyword_hits = self.emotes, self.emote_names, self.keyword_hits
+        find_keywords = self._keyword_re.findall if self._keyword_re is not None else None
+        # Not splitlines(): chat text may hold U+2028 and other separators it splits on
+        for line in block.split('\n'):
+            line = line.rstrip('\r')
+            if not line:
+                continue
+            self.lines += 1
+            if 'PRIVMSG' not in line:
+                continue
+            stamp, raw = split_log_stamp(line)
+            msg = parse_irc_line(raw)
+            if msg is None or msg.command != 'PRIVMSG' or not msg.user or msg.text is None:
+                continue
+            self.messages += 1
+            users[msg.user] += 1
+            if msg.channel:
+                channels[msg.channel.lstrip('#')] += 1
+            sent = msg.sent_ts
+            if sent is not None:
+                stamp = sent / 1000
+            if stamp is not None:
+                minutes[int(stamp // 60)] += 1
+            text = msg.text
+            for emote_id, start, end in msg.emotes:
+                emotes[emote_id] += 1
+                if emote_id not in emote_names:
+                    emote_names[emote_id] = text[start:end + 1]
+            if find_keywords is not None:
+                for hit in find_keywords(text):
+                    keyword_hits[hit.lower()] += 1
+    
+    def merge(self, other):
+        """Add the counts of another LogStats into this one."""
+        self.lines += other.lines
+        self.messages += other.messages
+        self.users.update(other.users)
+        self.channels.update(other.channels)
+        self.minutes.update(other.minutes)
+        self.emotes.update(other.emotes)
+        for emote_id, name in other.emote_names.items():
+            self.emote_names.setdefault(emote_id, name)
+        self.keyword_hits.update(other.keyword_hits)
+    
+    def to_report(self):
+        """Return the aggregates as a JSON-ready dict, biggest counts first."""
+        return {
+            'lines': self.lines,
+            'messages': self.messages,
+            'chatters': len(self.users),
+            'channels': dict(self.channels.most_common()),
+            'users': [{'user': user, 'messages': count} for user, count in self.users.most_common()],
+            'per_minute': [{'minute': time.strftime('%Y-%m-%dT%H:%MZ', time.gmtime(minute * 60)),
+                            'messages': self.minutes[minute]} for minute in sorted(self.minutes)],
+            'emotes': [{'id': emote_id, 'name': self.emote_names.get(emote_id, ''), 'uses': count}
+                       for emote_id, count in self.emotes.most_common()],
+            'keywords': {keyword: self.keyword_hits[keyword] for keyword in self.keywords},
+        }
+
+
+def log_chunks(path, chunk_size=ANALYZE_CHUNK_SIZE):
+    """Return (start, end) byte ranges of about chunk_size that end on line boundaries."""
+    size = os.path.getsize(path)
+    if size == 0:
+        return []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        bounds = []
+        start = 0
+        while start < size:
+            newline = data.find(b'\n', min(start + chunk_size, size) - 1)
+            end = size if newline < 0 else newline + 1
+            bounds.append((start, end))
+            start = end
+    return bounds
+
+
+def _analyze_chunk(path, start, end, keywords):
+    """Process pool entry point: aggregate one byte range of a log file.
+    
+    Gzip logs cannot be split, so they come as a single range covering
+    the whole file and are decompressed here.
+    """
+    stats = LogStats(keywords)
+    with open(path, 'rb') as f:
+        if f.read(2) == b'\x1f\x8b':
+            for block in read_gzip_log_text(path):
+                stats.add_lines(block)
+            return stats
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            stats.add_lines(data[start:end].decode('utf-8', errors='replace'))
+    return stats
+
+
+def analyze_logs(paths, keywords=(), jobs=None, chunk_size=ANALYZE_CHUNK_SIZE):
+    """Aggregate chat logs in parallel over a process pool.
+    
+    Plain logs (raw IRC lines, optionally with TrafficRecorder timestamps)
+    are memory-mapped and split into chunks on line boundaries; gzip logs
+    are one chunk each. Each chunk is parsed with parse_irc_line in a
+    worker and the partial LogStats are merged here.
+    
+    Args:
+        paths: Log files to read.
+        keywords: Words to count in message text.
+        jobs: Worker processes (default: one per CPU); 1 runs in this process.
+        chunk_size: Largest chunk in bytes. Smaller files are cut into about
+            four chunks per worker so the workers finish together.
+    
+    Returns:
+        The merged LogStats.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    tasks = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            compressed = f.read(2) == b'\x1f\x8b'
+        if compressed:
+            tasks.append((path, 0, 0))
+        else:
+            size = min(chunk_size, max(1 << 20, os.path.getsize(path) // (jobs * 4)))
+            tasks.extend((path, start, end) for start, end in log_chunks(path, size))
+    
+    total = LogStats(keywords)
+    if jobs == 1 or len(tasks) <= 1:
+        for path, start, end in tasks:
+            total.merge(_analyze_chunk(path, start, end, keywords))
+        return total
+    with concurrent.futures.ProcessPoolExecutor(min(jobs, len(tasks))) as pool:
+        futures = [pool.submit(_analyze_chunk, path, start, end, tuple(keywords))
+                   for path, start, end in tasks]
+        for future in futures:
+            total.merge(future.result())
+    return total
+
+
+def write_analysis(report, output='-', fmt='json'):
+    """Write an analysis report as JSON, or as CSV rows of kind,key,name,count."""
+    f = sys.stdout if output == '-' else open(output, 'w', newline='', encoding='utf-8')
+    try:
+        if fmt == 'json':
+            json.dump(report, f, indent=2)
+            f.write('\n')
+            return
+        writer = csv.writer(f)
+        writer.writerow(('kind', 'key', 'name', 'count'))
+        for key in ('lines', 'messages', 'chatters'):
+            writer.writerow(('total', key, '', report[key]))
+        writer.writerows(('channel', channel, '', count) for channel, count in report['channels'].items())
+        writer.writerows(('user', row['user'], '', row['messages']) for row in report['users'])
+        writer.writerows(('minute', row['minute'], '', row['messages']) for row in report['per_minute'])
+        writer.writerows(('emote', row['id'], row['name'], row['uses']) for row in report['emotes'])
+        writer.writerows(('keyword', keyword, '', count) for keyword, count in report['keywords'].items())
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+class HistoryStore:
+    """Persistent chat history in SQLite with a full-text index over messages.
+    
+    The database runs in WAL mode so searches never wait on writes. add()
+    only queues the message; a background thread commits queued messages in
+    one transaction every batch_size messages or batch_interval seconds,
+    whichever comes first, so ingestion never waits on disk.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            ts REAL NOT NULL,
+            channel TEXT NOT NULL,
+            user TEXT,
+            display_name TEXT,
+            text TEXT NOT NULL,
+            msg_id TEXT
+        );
+        CREATE INDEX IF NOT EXISTS messages_channel_ts ON messages (channel, ts);
+        CREATE INDEX IF NOT EXISTS messages_user_ts ON messages (user, ts);
+        CREATE INDEX IF NOT EXISTS messages_ts ON messages (ts);
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+            USING fts5(text, content='messages', content_rowid='id');
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text);
+        END;
+    """
+    
+    def __init__(self, path, batch_size=HISTORY_BATCH_SIZE, batch_interval=HISTORY_BATCH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.written = 0
+        self._queue = queue.SimpleQueue()
+        connection = self._connect()
+        connection.executescript(self.SCHEMA)
+        connection.close()
+        self._local = threading.local()
+        self._writer = threading.Thread(target=self._write_loop, name="history", daemon=True)
+        self._writer.start()
+    
+    def _connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+    
+    def add(self, ts, channel, user, display_name, text, msg_id=None):
+        """Queue one message for writing. Safe to call from any thread."""
+        self._queue.put((ts, channel, user, display_name, text, msg_id))
+    
+    def close(self):
+        """Write everything still queued and stop the writer thread."""
+        self._queue.put(None)
+        self._writer.join(timeout=10)
+    
+    def _write_loop(self):
+        """Collect queued messages into batches and commit each in one transaction."""
+        connection = self._connect()
+        insert = ("INSERT INTO messages (ts, channel, user, display_name, text, msg_id) "
+                  "VALUES (?, ?, ?, ?, ?, ?)")
+        running = True
+        while running:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+            try:
+                with connection:
+                    connection.executemany(insert, batch)
+                self.written += len(batch)
+            except sqlite3.Error as e:
+                log.error("Could not write chat history: %s", e)
+        connection.close()
+    
+    def search(self, text='', channel=None, user=None, limit=HISTORY_SEARCH_LIMIT):
+        """Search the history, newest first.
+        
+        Args:
+            text: Words that must all appear in the message. Each word is
+                matched as an FTS5 phrase, so user input cannot break the query.
+            channel: Only messages in this channel (without '#').
+            user: Only messages from this login name.
+            limit: Maximum number of rows returned.
+        
+        Returns:
+            List of (ts, channel, display_name, text) tuples.
+        """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        
+        conditions = []
+        params = []
+        if channel:
+            conditions.append("m.channel = ?")
+            params.append(channel.lower())
+        if user:
+            conditions.append("m.user = ?")
+            params.append(user.lower())
+        
+        words = text.split()
+        if words:
+            match = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+            sql = ("SELECT m.ts, m.channel, m.display_name, m.text FROM messages_fts "
+                   "JOIN messages m ON m.id = messages_fts.rowid WHERE messages_fts MATCH ?")
+            params.insert(0, match)
+            order = "messages_fts.rowid"
+        else:
+            sql = "SELECT m.ts, m.channel, m.display_name, m.text FROM messages m WHERE 1"
+            order = "m.ts"
+        for condition in conditions:
+            sql += f" AND {condition}"
+        sql += f" ORDER BY {order} DESC LIMIT ?"
+        params.append(limit)
+        return connection.execute(sql, params).fetchall()
+
+
+def parse_search_query(query):
+    """Split a search box query into (text, channel, user).
+    
+    'from:name' and 'in:channel' words become filters; the rest is text.
+    """
+    words = []
+    channel = user = None
+    for word in query.split():
+        lowered = word.lower()
+        if lowered.startswith('from:') and len(word) > 5:
+            user = lowered[5:].lstrip('@')
+        elif lowered.startswith('in:') and len(word) > 3:
+            channel = lowered[3:].lstrip('#')
+        else:
+            words.append(word)
+    return " ".join(words), channel, user
+
+
+def _wildcard_tokens(pattern):
+    """Split a '*'/'?' wildcard into regex tokens that stay within one word."""
+    return tuple('\\S*' if char == '*' else '\\S' if char == '?' else re.escape(char)
+                 for char in pattern)
+
+
+def _trie_pattern(token_lists):
+    """Build a regex alternation of token sequences shaped as a prefix trie.
+    
+    re tries alternatives one by one, so a flat 'a|b|c' over hundreds of
+    keywords costs one attempt per keyword at every position. Merging
+    shared prefixes lets each position fail after a character or two.
+    """
+    trie = {}
+    for tokens in token_lists:
+        node = trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[''] = {}
+    
+    def build(node):
+        branches = [token + build(child) for token, child in sorted(node.items()) if token]
+        if not branches:
+            return ''
+        optional = '' in node
+        if len(branches) == 1 and not optional:
+            return branches[0]
+        group = '(?:' + '|'.join(branches) + ')'
+        return group + '?' if optional else group
+    return build(trie)
+
+
+class FilterRules:
+    """Ignore, hide and highlight rules compiled into a few combined matchers.
+    
+    Each rule is one line of the ignore list, with an optional prefix:
+    
+        name            no sound for this user
+        hide:name       don't show this user's messages at all
+        word:text       no sound for messages containing text
+        hideword:text   don't show messages containing text
+        highlight:text  highlight messages containing text and always chime
+    
+    A pattern may contain '*' and '?' wildcards or be a /regex/. User
+    rules match the whole login or display name; word rules match whole
+    words anywhere in the message. Matching is case-insensitive.
+    
+    All rules of one kind are merged into a single set lookup plus one
+    regex whose plain words and wildcards share a prefix trie, so
+    check() grows slowly with the rule count. /regex/ rules can't be
+    merged that way and are tried in turn, so prefer wildcards where
+    they will do. Compile a new FilterRules whenever the list changes.
+    """
+    
+    HIDE = 1
+    SILENCE = 2
+    HIGHLIGHT = 4
+    PREFIXES = ('hide', 'word', 'hideword', 'highlight')
+    
+    def __init__(self, rules=()):
+        self.rules = [rule.strip() for rule in rules if rule.strip()]
+        users = {'user': ([], [], []), 'hide': ([], [], [])}
+        words = {'word': ([], [], []), 'hideword': ([], [], []), 'highlight': ([], [], [])}
+        for number, rule in enumerate(self.rules, 1):
+            kind, pattern = 'user', rule
+            prefix, sep, rest = rule.partition(':')
+            if sep and prefix.strip().lower() in self.PREFIXES:
+                kind, pattern = prefix.strip().lower(), rest.strip()
+            if not pattern:
+                raise ValueError(f"Rule {number} ({rule!r}) has no pattern")
+            names, wildcards, regexes = users[kind] if kind in users else words[kind]
+            if len(pattern) > 2 and pattern.startswith('/') and pattern.endswith('/'):
+                try:
+                    re.compile(pattern[1:-1])
+                except re.error as e:
+                    raise ValueError(f"Rule {number} ({rule!r}) is not a valid regex: {e}")
+                regexes.append(pattern[1:-1])
+                continue
+            if kind in users:
+                pattern = pattern.lstrip('@')
+            if kind in users and '*' not in pattern and '?' not in pattern:
+                names.append(pattern.lower())
+            else:
+                wildcards.append(_wildcard_tokens(pattern.lower()))
+        
+        self._hide_names, self._hide_user_re = self._compile_users(*users['hide'])
+        self._silence_names, self._silence_user_re = self._compile_users(*users['user'])
+        self._hide_word_re = self._compile_words(*words['hideword'])
+        self._silence_word_re = self._compile_words(*words['word'])
+        self._highlight_re = self._compile_words(*words['highlight'])
+    
+    def __len__(self):
+        return len(self.rules)
+    
+    @staticmethod
+    def _compile_users(names, wildcards, regexes):
+        alternatives = [f'(?:{pattern})' for pattern in regexes]
+        if wildcards:
+            alternatives.insert(0, f'(?:{_trie_pattern(wildcards)})')
+        if not alternatives:
+            return frozenset(names), None
+        return frozenset(names), re.compile('|'.join(alternatives), re.IGNORECASE)
+    
+    @staticmethod
+    def _compile_words(names, wildcards, regexes):
+        alternatives = [f'(?:{pattern})' for pattern in regexes]
+        if wildcards:
+            alternatives.insert(0, f'(?<!\\w)(?:{_trie_pattern(wildcards)})(?!\\w)')
+        if not alternatives:
+            return None
+        return re.compile('|'.join(alternatives), re.IGNORECASE)
+    
+    @staticmethod
+    def _user_matches(names, regex, login, display_name):
+        if login in names or display_name in names:
+            return True
+        return regex is not None and bool(regex.fullmatch(login) or regex.fullmatch(display_name))
+    
+    def check(self, login, display_name, text):
+        """Return the HIDE, SILENCE and HIGHLIGHT flags that apply to a message.
+        
+        Hidden messages get no other flag; a highlight overrides silence.
+        """
+        if not self.rules:
+            return 0
+        login = (login or '').lower()
+        display_name = (display_name or login).lower()
+        if self._user_matches(self._hide_names, self._hide_user_re, login, display_name):
+            return self.HIDE
+        if self._hide_word_re is not None and self._hide_word_re.search(text):
+            return self.HIDE
+        if self._highlight_re is not None and self._highlight_re.search(text):
+            return self.HIGHLIGHT
+        if self._user_matches(self._silence_names, self._silence_user_re, login, display_name):
+            return self.SILENCE
+        if self._silence_word_re is not None and self._silence_word_re.search(text):
+            return self.SILENCE
+        return 0
+
+
+class ChatRecord:
+    """One displayed line: a chat message or a system notice.
+    
+    channel is the channel name without '#', or None for notices that
+    belong to every channel view. When repeats are collapsed, key is the
+    message's RepeatIndex key and a 'repeat' record with a count > 1
+    updates the line first shown for that key instead of adding one.
+    
+    'clearmsg' and 'clearchat' records add no line; they mark the line
+    with msg_id, or every line from user (or the whole view if user is
+    None), as removed by a moderator. emotes is the message's list of
+    (emote id, start, end) ranges in text, or None.
+    """
+    
+    __slots__ = ('kind', 'ts', 'channel', 'username', 'text', 'color', 'key', 'count',
+                 'msg_id', 'user', 'emotes')
+    
+    def __init__(self, kind, ts, username, text, color=None, channel=None, key=None, count=1,
+                 msg_id=None, user=None, emotes=None):
+        self.kind = kind
+        self.ts = ts
+        self.channel = channel
+        self.username = username
+        self.text = text
+        self.color = color
+        self.key = key
+        self.count = count
+        self.msg_id = msg_id
+        self.user = user
+        self.emotes = emotes
+
+
+def normalize_repeat(text):
+    """Reduce a message to the form copies of it are compared in.
+    
+    Case and spacing are ignored, as is the invisible tag character some
+    clients append to get around Twitch's duplicate message check.
+    """
+    return ' '.join(text.replace('\U000E0000', '').lower().split())
+
+
+class RepeatIndex:
+    """Counts copies of recent messages within a rolling time window.
+    
+    Entries are kept in last-seen order, so expired ones are always at the
+    front and are dropped as new hits come in. At most max_entries are
+    kept however fast messages arrive; the least recently seen goes first.
+    """
+    
+    def __init__(self, window=REPEAT_WINDOW, max_entries=REPEAT_MAX_ENTRIES):
+        self.window = window
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def hit(self, key, now):
+        """Record one sighting of key and return how often it was seen in a row."""
+        entries = self._entries
+        horizon = now - self.window
+        while entries:
+            oldest = next(iter(entries.values()))
+            if oldest[0] >= horizon:
+                break
+            entries.popitem(last=False)
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = [now, 1]
+            if len(entries) > self.max_entries:
+                entries.popitem(last=False)
+            return 1
+        entry[0] = now
+        entry[1] += 1
+        entries.move_to_end(key)
+        return entry[1]
+
+
+class SpaceSaving:
+    """Approximate top-K counter (the Space-Saving algorithm) in fixed memory.
+    
+    At most capacity keys are tracked. An untracked key takes the place of
+    one with the lowest count and inherits that count, so a count is never
+    too low and is too high by at most the key's recorded error. Any key
+    seen more than total / capacity times is guaranteed to be tracked.
+    Keys are grouped into buckets by count, which makes add() O(1).
+    """
+    
+    def __init__(self, capacity=STATS_TOP_CAPACITY):
+        self.capacity = capacity
+        self.total = 0
+        self._counts = {}
+        self._errors = {}
+        self._buckets = {}
+        self._min = 0
+    
+    def __len__(self):
+        return len(self._counts)
+    
+    def add(self, key):
+        """Count one occurrence of key."""
+        self.total += 1
+        count = self._counts.get(key)
+        if count is None:
+            if len(self._counts) < self.capacity:
+                count = error = 0
+            else:
+                count = error = self._min
+                evicted = next(iter(self._buckets[count]))
+                self._unlink(evicted, count)
+                del self._counts[evicted], self._errors[evicted]
+            self._errors[key] = error
+        else:
+            self._unlink(key, count)
+        count += 1
+        self._counts[key] = count
+        bucket = self._buckets.get(count)
+        if bucket is None:
+            bucket = self._buckets[count] = {}
+        bucket[key] = None
+        if count == 1:
+            self._min = 1
+    
+    def _unlink(self, key, count):
+        """Take key out of its bucket; the caller moves it to count + 1."""
+        bucket = self._buckets[count]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[count]
+            if count == self._min:
+                self._min = count + 1
+    
+    def top(self, n=STATS_TOP_SHOWN):
+        """Return up to n (key, count, error) tuples, highest count first."""
+        ranked = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)[:n]
+        return [(key, count, self._errors[key]) for key, count in ranked]
+
+
+class HyperLogLog:
+    """Estimates the number of distinct strings seen, in 2**precision bytes.
+    
+    The standard error is about 1.04 / sqrt(2**precision), 1.6% at the
+    default precision of 12. Python's string hash (SipHash, salted per
+    process) is the hash function, so estimates are only comparable within
+    one run.
+    """
+    
+    def __init__(self, precision=STATS_HLL_PRECISION):
+        self.precision = precision
+        self._size = 1 << precision
+        self._registers = bytearray(self._size)
+        self._rest_bits = 64 - precision
+        self._rest_mask = (1 << self._rest_bits) - 1
+    
+    def add(self, key):
+        """Count key; adding it again has no effect."""
+        hashed = hash(key) & 0xFFFFFFFFFFFFFFFF
+        index = hashed >> self._rest_bits
+        rank = self._rest_bits - (hashed & self._rest_mask).bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+    
+    def estimate(self):
+        """Return the estimated number of distinct keys added."""
+        size = self._size
+        registers = self._registers
+        raw = (0.7213 / (1 + 1.079 / size)) * size * size / sum(2.0 ** -r for r in registers)
+        zeros = registers.count(0)
+        if raw <= 2.5 * size and zeros:
+            # Linear counting is more accurate while most registers are empty
+            return size * math.log(size / zeros)
+        return raw
+
+
+class RateRing:
+    """Message counts per fixed-width time bucket over a sliding window.
+    
+    The buckets form a ring indexed by time, so memory is fixed however
+    long the session runs, and stale buckets are zeroed as time moves on.
+    """
+    
+    def __init__(self, width=STATS_BUCKET_SECONDS, buckets=STATS_BUCKETS):
+        self.width = width
+        self._counts = [0] * buckets
+        self._current = None
+        self._started = None
+    
+    def _advance(self, now):
+        """Move the ring to the bucket for now and return its index."""
+        slot = int(now // self.width)
+        current = self._current
+        if current is None:
+            self._started = now
+        elif slot > current:
+            size = len(self._counts)
+            for stale in range(current + 1, min(slot, current + size) + 1):
+                self._counts[stale % size] = 0
+        if current is None or slot > current:
+            self._current = current = slot
+        return current % len(self._counts)
+    
+    def add(self, now):
+        """Count one message at time now (a monotonic clock)."""
+        self._counts[self._advance(now)] += 1
+    
+    def series(self, now):
+        """Return the bucket counts up to now, oldest first."""
+        index = self._advance(now) + 1
+        return self._counts[index:] + self._counts[:index]
+    
+    def per_minute(self, now, window=60.0):
+        """Return the message rate over the last window seconds, per minute."""
+        if self._started is None:
+            return 0.0
+        buckets = max(1, min(len(self._counts), int(round(window / self.width))))
+        recent = sum(self.series(now)[-buckets:])
+        elapsed = (buckets - 1) * self.width + now % self.width
+        elapsed = min(elapsed, now - self._started)
+        return recent * 60.0 / elapsed if elapsed > 0 else 0.0
+
+
+class ChatStats:
+    """Top chatters, distinct chatters and message rate in fixed memory.
+    
+    add() costs O(1) and is called on the event loop thread for every chat
+    message; snapshot() is called by the stats panel on the Tk thread. A
+    lock keeps the two apart.
+    """
+    
+    def __init__(self, top_capacity=STATS_TOP_CAPACITY, precision=STATS_HLL_PRECISION,
+                 width=STATS_BUCKET_SECONDS, buckets=STATS_BUCKETS):
+        self.chatters = SpaceSaving(top_capacity)
+        self.distinct = HyperLogLog(precision)
+        self.rate = RateRing(width, buckets)
+        self._lock = threading.Lock()
+    
+    def add(self, user, now):
+        """Count one message from user (a login) at monotonic time now."""
+        with self._lock:
+            self.chatters.add(user)
+            self.distinct.add(user)
+            self.rate.add(now)
+    
+    def snapshot(self, now, top=STATS_TOP_SHOWN):
+        """Return a dict of the current figures for display."""
+        with self._lock:
+            return {
+                'messages': self.chatters.total,
+                'chatters': self.distinct.estimate(),
+                'per_minute': self.rate.per_minute(now),
+                'top': self.chatters.top(top),
+                'series': self.rate.series(now),
+            }
+
+
+def _relative_luminance(rgb):
+    """WCAG relative luminance of an (r, g, b) tuple of 0-255 ints."""
+    channels = []
+    for value in rgb:
+        value /= 255
+        channels.append(value / 12.92 if value <= 0.03928 else ((value + 0.055) / 1.055) ** 2.4)
+    return 0.2126 * channels[0] + 0.7152 * channels[1] + 0.0722 * channels[2]
+
+
+def _contrast_ratio(first, second):
+    """WCAG contrast ratio between two (r, g, b) tuples."""
+    lighter, darker = sorted((_relative_luminance(first), _relative_luminance(second)), reverse=True)
+    return (lighter + 0.05) / (darker + 0.05)
+
+
+@functools.lru_cache(maxsize=16384)
+def readable_color(color, background=CHAT_BACKGROUND):
+    """Normalize a user color and lighten it until it is readable on background.
+    
+    The result is rounded to 4 bits per channel, which is visually close and
+    lets many near-identical custom colors share one tag.
+    
+    Args:
+        color: Color string as sent by Twitch, e.g. '#0000FF'.
+        background: Background color the name is drawn on.
+    
+    Returns:
+        Lowercase '#rgb' string, or None if color is not a valid hex color.
+    """
+    value = color.lstrip('#')
+    if len(value) != 6:
+        return None
+    try:
+        rgb = tuple(int(value[i:i + 2], 16) for i in (0, 2, 4))
+        back = tuple(int(background.lstrip('#')[i:i + 2], 16) for i in (0, 2, 4))
+    except ValueError:
+        return None
+    
+    # Blend towards white in small steps; pure white always passes on a dark background
+    original = rgb
+    step = 0
+    while _contrast_ratio(rgb, back) < MIN_NAME_CONTRAST and step < 10:
+        step += 1
+        rgb = tuple(round(c + (255 - c) * step / 10) for c in original)
+    return '#%x%x%x' % tuple(round(c / 17) for c in rgb)
+
+
+class ColorTagPool:
+    """Bounded LRU pool of Text tags keyed by normalized color.
+    
+    Chatters with the same color share one tag. When the pool is full the
+    least recently used tag is reconfigured for the new color, so the number
+    of tags in the widget never exceeds size (old lines that used an evicted
+    tag take on its new color).
+    """
+    
+    def __init__(self, widget, size=COLOR_TAG_POOL_SIZE, font=("Consolas", 10, "bold")):
+        self._widget = widget
+        self._font = font
+        self.size = size
+        self._tags = OrderedDict()
+    
+    def __len__(self):
+        return len(self._tags)
+    
+    def tag_for(self, color, fallback="username"):
+        """Return the tag to draw a name in color, or fallback if it is invalid."""
+        color = readable_color(color)
+        if color is None:
+            return fallback
+        
+        tag = self._tags.get(color)
+        if tag is not None:
+            self._tags.move_to_end(color)
+            return tag
+        
+        if len(self._tags) < self.size:
+            tag = f"ucolor_{len(self._tags)}"
+        else:
+            _, tag = self._tags.popitem(last=False)
+        self._widget.tag_configure(tag, foreground=color, font=self._font)
+        self._tags[color] = tag
+        return tag
+
+
+class RenderQueue:
+    """Bounded, thread-safe hand-off between the listener thread and the UI.
+    
+    When full, the oldest entry is discarded. With the 'collapse' policy the
+    number of entries discarded since the last drain is also reported so the
+    UI can show a single placeholder line in their place.
+    """
+    
+    def __init__(self, maxsize=RENDER_QUEUE_SIZE, policy='drop_oldest'):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self._collapsed = 0
+        self._items = deque()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._items)
+    
+    def put(self, item):
+        """Queue an item, discarding the oldest one if the queue is full."""
+        with self._lock:
+            if len(self._items) >= self.maxsize:
+                self._items.popleft()
+                self.dropped += 1
+                self._collapsed += 1
+            self._items.append(item)
+    
+    def drain(self, limit=RENDER_MAX_BATCH):
+        """Remove and return up to limit items plus the collapsed-entry count."""
+        with self._lock:
+            items = self._items
+            if len(items) <= limit:
+                self._items = deque()
+            else:
+                items = [items.popleft() for _ in range(limit)]
+            collapsed = self._collapsed if self.policy == 'collapse' else 0
+            self._collapsed = 0
+        return items, collapsed
+
+
+class HttpEmoteFetcher:
+    """Downloads emote images from a URL template such as the Twitch CDN.
+    
+    The template's {id} is replaced with the emote id, so a local stand-in
+    like 'http://127.0.0.1:8000/{id}.png' works as well.
+    """
+    
+    def __init__(self, url_template=EMOTE_URL, timeout=EMOTE_FETCH_TIMEOUT):
+        self.url_template = url_template
+        self.timeout = timeout
+    
+    def fetch(self, emote_id):
+        """Return the image bytes for emote_id; raises OSError on failure."""
+        import urllib.parse
+        import urllib.request
+        url = self.url_template.format(id=urllib.parse.quote(emote_id, safe=''))
+        with urllib.request.urlopen(url, timeout=self.timeout) as response:
+            return response.read()
+
+
+class DirectoryEmoteFetcher:
+    """Reads emote images named <id>.png from a local directory."""
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def fetch(self, emote_id):
+        """Return the image bytes for emote_id; raises OSError on failure."""
+        with open(os.path.join(self.path, f"{os.path.basename(emote_id)}.png"), 'rb') as f:
+            return f.read()
+
+
+def create_emote_fetcher(source=None):
+    """Create a fetcher from an http(s) URL template or a directory path."""
+    if not source:
+        return HttpEmoteFetcher()
+    if source.startswith(('http://', 'https://')):
+        return HttpEmoteFetcher(source)
+    return DirectoryEmoteFetcher(source)
+
+
+def default_cache_dir():
+    """Return the per-user cache directory for downloaded files."""
+    base = (os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, 'BetterTwitchChat')
+
+
+class EmoteDiskCache:
+    """Content-addressed on-disk store of emote images.
+    
+    Images are stored once under objects/ by the SHA-256 of their bytes,
+    and keys/ maps each emote id to its digest, so emotes that share an
+    image share a file. Files are written to a temporary name and renamed,
+    so a crash never leaves a truncated image behind.
+    """
+    
+    _KEY_RE = re.compile(r'[^A-Za-z0-9_.-]')
+    
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.join(path, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(path, 'keys'), exist_ok=True)
+    
+    def _key_path(self, key):
+        return os.path.join(self.path, 'keys', self._KEY_RE.sub('_', key))
+    
+    def _object_path(self, digest):
+        return os.path.join(self.path, 'objects', digest[:2], digest)
+    
+    def get(self, key):
+        """Return the stored bytes for key, or None."""
+        try:
+            with open(self._key_path(key), 'r') as f:
+                digest = f.read().strip()
+            with open(self._object_path(digest), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def put(self, key, data):
+        """Store data under key."""
+        digest = hashlib.sha256(data).hexdigest()
+        object_path = self._object_path(digest)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            self._write(object_path, data)
+        self._write(self._key_path(key), digest.encode('ascii'))
+    
+    @staticmethod
+    def _write(path, data):
+        handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(handle, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+
+
+class EmoteCache:
+    """Emote images for the chat view, loaded in the background.
+    
+    Decoded images live in an LRU of at most `capacity` entries, backed by
+    an EmoteDiskCache; misses are read from disk or fetched on a pool of
+    worker threads, which also base64-encode the data for Tk. Tk itself
+    is not thread-safe, so the Tk thread turns finished loads into images
+    in process_ready(). Until then get() returns None and the emote is
+    shown as text. An image evicted from the LRU also disappears from any
+    line still showing it, so capacity should comfortably exceed the
+    number of distinct emotes on screen.
+    
+    Args:
+        fetcher: Object with fetch(emote_id) -> bytes.
+        disk: EmoteDiskCache, or None to fetch every time.
+        capacity: Maximum number of images kept in memory.
+        workers: Size of the worker pool.
+        make_image: Turns base64 image data into an image; defaults to a
+            Tk PhotoImage, and must be called on the Tk thread.
+    """
+    
+    def __init__(self, fetcher, disk=None, capacity=EMOTE_MEMORY_CACHE, workers=EMOTE_WORKERS,
+                 make_image=None):
+        self.fetcher = fetcher
+        self.disk = disk
+        self.capacity = capacity
+        self.make_image = make_image or (lambda data: tk.PhotoImage(data=data))
+        self.disk_hits = 0
+        self.fetched = 0
+        self.failed = 0
+        self._images = OrderedDict()
+        self._pending = set()
+        self._failed_at = OrderedDict()
+        self._ready = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='emote')
+    
+    def __len__(self):
+        return len(self._images)
+    
+    def prefetch(self, emote_ids):
+        """Start loading emotes that aren't in memory. Safe to call from any thread."""
+        now = time.monotonic()
+        with self._lock:
+            for emote_id in emote_ids:
+                if emote_id in self._images or emote_id in self._pending:
+                    continue
+                failed_at = self._failed_at.get(emote_id)
+                if failed_at is not None and now - failed_at < EMOTE_RETRY_INTERVAL:
+                    continue
+                self._pending.add(emote_id)
+                self._executor.submit(self._load, emote_id)
+    
+    def get(self, emote_id):
+        """Return the image for emote_id, or None and start loading it. Tk thread only."""
+        image = self._images.get(emote_id)
+        if image is not None:
+            self._images.move_to_end(emote_id)
+            return image
+        self.prefetch((emote_id,))
+        return None
+    
+    def _load(self, emote_id):
+        """Worker: read the emote from disk or fetch and store it."""
+        data = None
+        try:
+            data = self.disk.get(emote_id) if self.disk is not None else None
+            if data is not None:
+                self.disk_hits += 1
+            else:
+                data = self.fetcher.fetch(emote_id)
+                self.fetched += 1
+                if self.disk is not None:
+                    self.disk.put(emote_id, data)
+            data = base64.b64encode(data).decode('ascii')
+        except Exception as e:
+            log.debug("Could not load emote %s: %s", emote_id, e)
+            self.failed += 1
+            data = None
+        self._ready.put((emote_id, data))
+    
+    def process_ready(self):
+        """Create images for finished loads. Tk thread only.
+        
+        Returns:
+            The number of images created.
+        """
+        created = 0
+        while True:
+            try:
+                emote_id, data = self._ready.get_nowait()
+            except queue.Empty:
+                return created
+            image = None
+            if data is not None:
+                try:
+                    image = self.make_image(data)
+                except Exception as e:
+                    log.debug("Could not decode emote %s: %s", emote_id, e)
+            with self._lock:
+                self._pending.discard(emote_id)
+                if image is None:
+                    self._failed_at[emote_id] = time.monotonic()
+                    self._failed_at.move_to_end(emote_id)
+                    if len(self._failed_at) > self.capacity:
+                        self._failed_at.popitem(last=False)
+                    continue
+                self._failed_at.pop(emote_id, None)
+                self._images[emote_id] = image
+                if len(self._images) > self.capacity:
+                    self._images.popitem(last=False)
+            created += 1
+    
+    def close(self):
+        """Stop the worker pool without waiting for queued loads."""
+        self._executor.shutdown(wait=False)
+
+
+class LineIndex:
+    """Finds the view lines showing a message id or a user's messages.
+    
+    Lines are numbered from the first line ever shown in a view, so a
+    number stays valid while older lines are trimmed above it. Entries
+    are also kept in line order, which lets prune() drop everything
+    trimmed from the view in time proportional to the lines removed.
+    """
+    
+    def __init__(self):
+        self._by_id = {}
+        self._by_user = {}
+        self._lines = deque()
+    
+    def __len__(self):
+        return len(self._lines)
+    
+    def add(self, line, msg_id, user):
+        """Index line as showing message msg_id from user; either may be None."""
+        if msg_id:
+            self._by_id[msg_id] = line
+        if user:
+            lines = self._by_user.get(user)
+            if lines is None:
+                lines = self._by_user[user] = deque()
+            lines.append(line)
+        self._lines.append((line, msg_id, user))
+    
+    def line_for(self, msg_id):
+        """Return the line showing msg_id, or None."""
+        return self._by_id.get(msg_id)
+    
+    def lines_for(self, user):
+        """Return the lines showing messages from user, oldest first."""
+        return self._by_user.get(user, ())
+    
+    def prune(self, first_line):
+        """Forget every line numbered below first_line."""
+        entries = self._lines
+        while entries and entries[0][0] < first_line:
+            line, msg_id, user = entries.popleft()
+            if msg_id and self._by_id.get(msg_id) == line:
+                del self._by_id[msg_id]
+            if user:
+                lines = self._by_user[user]
+                lines.popleft()
+                if not lines:
+                    del self._by_user[user]
+    
+    def clear(self):
+        """Forget all lines."""
+        self._by_id.clear()
+        self._by_user.clear()
+        self._lines.clear()
+
+
+class ChatView:
+    """One channel's chat display: its Text widget, scrollback and color tags."""
+    
+    def __init__(self, parent, scrollback_lines=SCROLLBACK_LINES, moderation_display='strike',
+                 emotes=None):
+        self.scrollback_lines = scrollback_lines
+        self.moderation_display = moderation_display
+        self.emotes = emotes
+        self.lines = LineIndex()
+        self.widget = scrolledtext.ScrolledText(
+            parent, wrap=tk.WORD, width=70, height=18,
+            font=("Consolas", 10), bg=CHAT_BACKGROUND, fg='#ffffff',
+            insertbackground='#ffffff', selectbackground='#404040',
+            state='disabled'
+        )
+        self._view_lines = 0
+        self._lines_added = 0
+        self._repeat_marks = OrderedDict()
+        self._next_mark = 0
+        self._configure_tags()
+    
+    def _configure_tags(self):
+        """Configure text tags for different message types."""
+        self.widget.tag_configure("timestamp", foreground="#888888")
+        self.widget.tag_configure("username", foreground="#00ff00",
+                                  font=("Consolas", 10, "bold"))
+        self.widget.tag_configure("message", foreground="#ffffff")
+        self.widget.tag_configure("system", foreground="#ffaa00",
+                                  font=("Consolas", 10, "bold"))
+        self.widget.tag_configure("highlight", foreground="#ffffff", background="#4a3f1a")
+        self.widget.tag_configure("repeat", foreground="#ffaa00",
+                                  font=("Consolas", 10, "bold"))
+        self.widget.tag_configure("notice", foreground="#b98cff")
+        self.widget.tag_configure("strike", foreground="#666666", overstrike=True)
+        self.widget.tag_configure("hide", elide=True)
+        self.color_tags = ColorTagPool(self.widget)
+    
+    def render(self, records):
+        """Insert a batch of records with a single state toggle and scroll."""
+        display = self.widget
+        insert = display.insert
+        color_tag = self.color_tags.tag_for
+        last_second = None
+        stamp = ''
+        
+        display.config(state='normal')
+        for record in records:
+            kind = record.kind
+            if kind == 'clearmsg' or kind == 'clearchat':
+                self._moderate(record)
+                continue
+            if kind == 'repeat' and self._update_repeat(record):
+                continue
+            self._view_lines += 1
+            self._lines_added += 1
+            second = int(record.ts)
+            if second != last_second:
+                last_second = second
+                stamp = f"[{datetime.fromtimestamp(record.ts).strftime('%H:%M:%S')}] "
+            if kind == 'system' or kind == 'notice':
+                insert(tk.END, stamp, "timestamp", f"{record.text}\n", kind)
+                continue
+            tag_name = color_tag(record.color) if record.color else "username"
+            message_tag = "highlight" if kind == 'highlight' else "message"
+            if record.emotes and self.emotes is not None:
+                insert(tk.END, stamp, "timestamp", f"{record.username}: ", tag_name)
+                self._insert_with_emotes(record.text, record.emotes, message_tag)
+            else:
+                insert(tk.END, stamp, "timestamp", f"{record.username}: ", tag_name,
+                       f"{record.text}\n", message_tag)
+            if record.msg_id or record.user:
+                self.lines.add(self._lines_added, record.msg_id, record.user)
+            if record.key is not None:
+                self._mark_repeat(record, self._lines_added)
+        self._trim()
+        display.config(state='disabled')
+        display.see(tk.END)
+    
+    def _trim(self):
+        """Delete the oldest lines in one call once the view overshoots the limit.
+        
+        Trimming waits for a 10% overshoot so the delete is amortized over
+        many inserts instead of running once per line.
+        """
+        excess = self._view_lines - self.scrollback_lines
+        if excess <= max(100, self.scrollback_lines // 10):
+            return
+        self.widget.delete('1.0', f'{excess + 1}.0')
+        self._view_lines -= excess
+        
+        first_line = self._lines_added - self._view_lines + 1
+        self.lines.prune(first_line)
+        # The marks are ordered by last update, not by line, so check them all
+        marks = self._repeat_marks
+        for key in [key for key, (_, line) in marks.items() if line < first_line]:
+            self.widget.mark_unset(marks.pop(key)[0])
+    
+    def _insert_with_emotes(self, text, emotes, message_tag):
+        """Insert a message body with its emote ranges shown as images.
+        
+        Emotes whose image isn't loaded yet stay as text.
+        """
+        display = self.widget
+        get_image = self.emotes.get
+        position = 0
+        for emote_id, start, end in emotes:
+            if start < position or end >= len(text):
+                continue
+            image = get_image(emote_id)
+            if image is None:
+                continue
+            if start > position:
+                display.insert(tk.END, text[position:start], message_tag)
+            display.image_create(tk.END, image=image)
+            position = end + 1
+        display.insert(tk.END, f"{text[position:]}\n", message_tag)
+    
+    def _moderate(self, record):
+        """Strike out or hide the lines a CLEARMSG or CLEARCHAT removed.
+        
+        Uses the line index, so the cost is one lookup per message id or
+        per line from the user, however long the scrollback is.
+        """
+        display = self.widget
+        tag = self.moderation_display
+        # Color tags are created on demand and would otherwise outrank it
+        display.tag_raise(tag)
+        if record.kind == 'clearchat' and record.user is None:
+            display.tag_add(tag, '1.0', 'end-1c')
+            return
+        if record.kind == 'clearmsg':
+            line = self.lines.line_for(record.msg_id)
+            lines = () if line is None else (line,)
+        else:
+            lines = self.lines.lines_for(record.user)
+        offset = self._lines_added - self._view_lines
+        for line in lines:
+            if line > offset:
+                display.tag_add(tag, f'{line - offset}.0', f'{line - offset + 1}.0')
+    
+    def _mark_repeat(self, record, line):
+        """Remember where the repeat counter of the line just inserted goes.
+        
+        Args:
+            record: The record that was inserted; its key names the line.
+            line: The line's number counted from the first line ever shown.
+        """
+        display = self.widget
+        old = self._repeat_marks.pop(record.key, None)
+        if old is not None:
+            display.mark_unset(old[0])
+        mark = f"repeat{self._next_mark}"
+        self._next_mark += 1
+        # The mark sits before the line's newline and keeps left gravity,
+        # so the counter can be rewritten after it without moving it
+        display.mark_set(mark, 'end-2c')
+        display.mark_gravity(mark, 'left')
+        self._repeat_marks[record.key] = (mark, line)
+        if len(self._repeat_marks) > REPEAT_MAX_ENTRIES:
+            display.mark_unset(self._repeat_marks.popitem(last=False)[1][0])
+        if record.count > 1:
+            display.insert(mark, f" \u00d7{record.count}", "repeat")
+    
+    def _update_repeat(self, record):
+        """Show a repeat's count on the line first shown for its key.
+        
+        Returns:
+            False if that line is no longer on screen; the repeat is then
+            shown as a new line.
+        """
+        entry = self._repeat_marks.get(record.key)
+        if entry is None:
+            return False
+        mark, line = entry
+        if line <= self._lines_added - self._view_lines:
+            del self._repeat_marks[record.key]
+            self.widget.mark_unset(mark)
+            return False
+        self.widget.delete(mark, f"{mark} lineend")
+        self.widget.insert(mark, f" \u00d7{record.count}", "repeat")
+        self._repeat_marks.move_to_end(record.key)
+        return True
+
+
+class ChatWindow:
+    """Main GUI window for the Twitch chat reader application.
+    
+    With auto-connect on, the connection is opened before Tk is even
+    imported, so the TLS handshake and JOIN overlap building the window.
+    Messages and status changes that arrive before the window is ready are
+    held in _early and handed on, in order, once it is. With ingest_process
+    on, an IngestProcess owns the connection instead of the pool, and the
+    render tick drains its ring.
+    """
+    
+    def __init__(self, endpoint=None, record_path=None, replay=None, history_path=None,
+                 metrics_port=None, overlay_port=None, settings_path=None, ingest_process=None):
+        self.connected = False
+        self.channel_text = 'rakthegoose'
+        self.username = None
+        self.auto_connect = False
+        self.sound_enabled = True
+        self.pool = None
+        self.loop_thread = None
+        self.ingest_process = False
+        self.ingest = None
+        self.views = {}
+        self.filter_rules = FilterRules()
+        self.render_fps = RENDER_FPS
+        self.render_queue_size = RENDER_QUEUE_SIZE
+        self.overflow_policy = 'drop_oldest'
+        self.scrollback_lines = SCROLLBACK_LINES
+        self.collapse_repeats = False
+        self.repeat_window = REPEAT_WINDOW
+        self.repeats = None
+        self.moderation_display = 'strike'
+        self.max_connections = MAX_CONNECTIONS
+        self.endpoint = {'host': TWITCH_SERVER, 'port': TWITCH_TLS_PORT, 'use_tls': True}
+        self.record_path = None
+        self.recorder = None
+        self.history_path = None
+        self.history = None
+        self.metrics_port = None
+        self.metrics_server = None
+        self.overlay_port = None
+        self.overlay = None
+        self.emotes_enabled = True
+        self.emote_source = None
+        self.emote_cache_dir = None
+        self.emotes = None
+        self.stats = ChatStats()
+        self.stats_window = None
+        self._replay_stop = threading.Event()
+        self._early = deque()
+        self._early_dropped = 0
+        self.settings = SettingsStore(settings_path)
+        
+        self.load_settings()
+        if endpoint:
+            self.endpoint.update(endpoint)
+        if record_path:
+            self.record_path = record_path
+        if ingest_process is not None:
+            self.ingest_process = ingest_process
+        self.render_queue = RenderQueue(self.render_queue_size, self.overflow_policy)
+        if not replay and self.auto_connect and self._token_configured():
+            channels = parse_channel_list(self.channel_text)
+            if channels:
+                self._start_pool(channels)
+        
+        _import_tk()
+        self.root = tk.Tk()
+        self.root.title("BetterTwitchChat")
+        self.root.geometry(f"{WINDOW_WIDTH}x{WINDOW_HEIGHT}")
+        self.root.configure(bg='#1a1a1a')
+        self._setup_ui()
+        self._setup_event_handlers()
+        self.channel_var.trace('w', lambda *args: self.save_settings())
+        
+        if history_path:
+            self.history_path = history_path
+        if self.history_path:
+            try:
+                self.history = HistoryStore(self.history_path)
+            except sqlite3.Error as e:
+                log.error("Could not open chat history: %s", e)
+        
+        if self.collapse_repeats:
+            self.repeats = RepeatIndex(self.repeat_window)
+        metrics.gauge('render_queue_depth', "Messages waiting to be drawn",
+                      lambda: len(self.render_queue))
+        metrics.gauge('render_queue_dropped_total', "Messages dropped because the render queue was full",
+                      lambda: self.render_queue.dropped, 'counter')
+        if metrics_port is not None:
+            self.metrics_port = metrics_port
+        if self.metrics_port:
+            try:
+                self.metrics_server = MetricsServer(metrics, self.metrics_port)
+            except OSError as e:
+                log.error("Could not start metrics server: %s", e)
+        if overlay_port is not None:
+            self.overlay_port = overlay_port
+        if self.overlay_port:
+            if self.loop_thread is None:
+                self.loop_thread = AsyncLoopThread()
+            overlay = OverlayServer(self.overlay_port)
+            try:
+                self.loop_thread.submit(overlay.start()).result(timeout=5)
+                self.overlay = overlay
+            except OSError as e:
+                log.error("Could not start overlay server: %s", e)
+        if self.emotes_enabled:
+            try:
+                disk = EmoteDiskCache(self.emote_cache_dir or os.path.join(default_cache_dir(), 'emotes'))
+            except OSError as e:
+                log.warning("Could not open emote cache: %s", e)
+                disk = None
+            self.emotes = EmoteCache(create_emote_fetcher(self.emote_source), disk)
+            metrics.gauge('emote_images', "Emote images held in memory", lambda: len(self.emotes))
+        self._sync_views(parse_channel_list(self.channel_var.get()))
+        self._shown_dropped = 0
+        self._metrics_snapshot = None
+        self._render_tick()
+        self._update_metrics_readout()
+        
+        if self.connected:
+            self._show_connected()
+            self.update_status("Connecting...")
+            if self.pool is not None:
+                self.loop_thread.call(self._release_early)
+        else:
+            self._early = None
+            if replay:
+                self.root.after(0, self.start_replay, *replay)
+            elif self.auto_connect:
+                # Shows why connecting early was skipped, like a missing token
+                self.connect()
+    
+    def _setup_ui(self):
+        """Set up the user interface components."""
+        main_frame = tk.Frame(self.root, bg='#1a1a1a')
+        main_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        self._create_connection_frame(main_frame)
+        self._create_chat_display(main_frame)
+        self._create_send_bar(main_frame)
+        self._create_bottom_bar(main_frame)
+        
+        self.center_window()
+    
+    def _create_connection_frame(self, parent):
+        """Create the connection controls frame."""
+        connection_frame = tk.Frame(parent, bg='#1a1a1a')
+        connection_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        # Channel input
+        channel_frame = tk.Frame(connection_frame, bg='#1a1a1a')
+        channel_frame.pack(side=tk.LEFT, padx=(0, 10))
+        
+        tk.Label(channel_frame, text="Channels:", fg='#ffffff', bg='#1a1a1a',
+                font=("Arial", 10)).pack(side=tk.LEFT)
+        
+        self.channel_var = tk.StringVar(value=self.channel_text)
+        self.channel_entry = tk.Entry(channel_frame, textvariable=self.channel_var,
+                                     width=20, bg='#2d2d2d', fg='#ffffff',
+                                     insertbackground='#ffffff')
+        self.channel_entry.pack(side=tk.LEFT, padx=(5, 0))
+        
+        # Connect button
+        self.connect_button = tk.Button(connection_frame, text="Connect",
+                                       command=self.toggle_connection,
+                                       bg='#28a745', fg='#ffffff',
+                                       font=("Arial", 10, "bold"),
+                                       width=10, relief=tk.FLAT)
+        self.connect_button.pack(side=tk.RIGHT)
+        
+        # Sound toggle
+        self.sound_enabled_var = BooleanVar(value=self.sound_enabled)
+        self.sound_checkbox = Checkbutton(connection_frame, text="Enable Sound",
+                                         variable=self.sound_enabled_var,
+                                         fg='#ffffff', bg='#1a1a1a',
+                                         selectcolor='#2d2d2d',
+                                         font=("Arial", 9),
+                                         command=self.save_settings)
+        self.sound_checkbox.pack(side=tk.RIGHT, padx=(0, 10))
+        
+        # Auto-connect toggle
+        self.auto_connect_var = BooleanVar(value=self.auto_connect)
+        self.auto_connect_checkbox = Checkbutton(connection_frame,
+                                                text="Auto-connect on launch",
+                                                variable=self.auto_connect_var,
+                                                fg='#ffffff', bg='#1a1a1a',
+                                                selectcolor='#2d2d2d',
+                                                font=("Arial", 9),
+                                                command=self.save_settings)
+        self.auto_connect_checkbox.pack(side=tk.RIGHT, padx=(0, 10))
+    
+    def _create_chat_display(self, parent):
+        """Create the tabbed chat display area, one tab per channel."""
+        style = ttk.Style(self.root)
+        style.configure('Chat.TNotebook', background='#1a1a1a', borderwidth=0)
+        style.configure('Chat.TNotebook.Tab', background='#2d2d2d', foreground='#ffffff',
+                        padding=(8, 2))
+        style.map('Chat.TNotebook.Tab', background=[('selected', '#404040')])
+        
+        self.notebook = ttk.Notebook(parent, style='Chat.TNotebook')
+        self.notebook.pack(fill=tk.BOTH, expand=True)
+    
+    def _create_send_bar(self, parent):
+        """Create the entry for sending messages to the current tab's channel."""
+        send_frame = tk.Frame(parent, bg='#1a1a1a')
+        send_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        self.send_var = tk.StringVar()
+        self.send_entry = tk.Entry(send_frame, textvariable=self.send_var,
+                                   bg='#2d2d2d', fg='#ffffff', insertbackground='#ffffff',
+                                   font=("Consolas", 10))
+        self.send_entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.send_entry.bind("<Return>", self.send_message)
+        
+        tk.Button(send_frame, text="Send", command=self.send_message,
+                  bg='#28a745', fg='#ffffff', font=("Arial", 9, "bold"),
+                  width=8, relief=tk.FLAT, cursor="hand2").pack(side=tk.RIGHT, padx=(5, 0))
+    
+    def _sync_views(self, channels):
+        """Make the tabs match channels, keeping views that already exist."""
+        wanted = channels or [None]
+        for channel in list(self.views):
+            if channel not in wanted:
+                view = self.views.pop(channel)
+                self.notebook.forget(view.widget.frame)
+                view.widget.frame.destroy()
+        for channel in wanted:
+            self._view_for(channel)
+    
+    def _view_for(self, channel):
+        """Return the view for channel, creating its tab if needed."""
+        view = self.views.get(channel)
+        if view is None:
+            view = ChatView(self.notebook, self.scrollback_lines, self.moderation_display, self.emotes)
+            self.notebook.add(view.widget.frame, text=channel or "Chat")
+            self.views[channel] = view
+        return view
+    
+    def _create_bottom_bar(self, parent):
+        """Create the bottom status bar with footer and status indicator."""
+        bottom_frame = tk.Frame(parent, bg='#1a1a1a')
+        bottom_frame.pack(fill=tk.X, pady=(5, 0))
+        
+        # Footer
+        footer_text = tk.Label(bottom_frame, text="Proudly created by",
+                              fg='#888888', bg='#1a1a1a', font=("Arial", 8))
+        footer_text.pack(side=tk.LEFT)
+        
+        github_link = tk.Label(bottom_frame, text="RakTheGoose",
+                              fg='#888888', bg='#1a1a1a',
+                              font=("Arial", 8, "underline"), cursor="hand2")
+        github_link.pack(side=tk.LEFT)
+        github_link.bind("<Button-1>", self.open_homepage)
+        
+        def on_enter(e):
+            github_link.config(fg='#cccccc')
+        
+        def on_leave(e):
+            github_link.config(fg='#888888')
+        
+        github_link.bind("<Enter>", on_enter)
+        github_link.bind("<Leave>", on_leave)
+        
+        # Spacer
+        spacer = tk.Frame(bottom_frame, bg='#1a1a1a')
+        spacer.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        
+        # Chat stats button
+        self.stats_button = tk.Button(bottom_frame, text="Stats",
+                                      command=self.open_stats_window,
+                                      bg='#17a2b8', fg='#ffffff',
+                                      font=("Arial", 9, "bold"),
+                                      width=8, relief=tk.FLAT, cursor="hand2")
+        self.stats_button.pack(side=tk.RIGHT, padx=(0, 5))
+        
+        # History search button
+        self.search_button = tk.Button(bottom_frame, text="Search",
+                                       command=self.open_search_window,
+                                       bg='#6f42c1', fg='#ffffff',
+                                       font=("Arial", 9, "bold"),
+                                       width=8, relief=tk.FLAT, cursor="hand2")
+        self.search_button.pack(side=tk.RIGHT, padx=(0, 5))
+        
+        # Ignore list button
+        self.ignore_button = tk.Button(bottom_frame, text="Ignore List",
+                                       command=self.open_ignore_list_window,
+                                       bg='#007bff', fg='#ffffff',
+                                       font=("Arial", 9, "bold"),
+                                       width=12, relief=tk.FLAT, cursor="hand2")
+        self.ignore_button.pack(side=tk.RIGHT, padx=(0, 10))
+        
+        # Status indicator
+        self.status_orb = tk.Label(bottom_frame, text="●", fg='#ff4444',
+                                  bg='#1a1a1a', font=("Arial", 16, "bold"))
+        self.status_orb.pack(side=tk.RIGHT, padx=(0, 5), pady=(0, 2))
+        
+        self.status_label = tk.Label(bottom_frame, text="Disconnected",
+                                    fg='#888888', bg='#1a1a1a', font=("Arial", 9))
+        self.status_label.pack(side=tk.RIGHT)
+        
+        self.dropped_label = tk.Label(bottom_frame, text="",
+                                     fg='#ffaa00', bg='#1a1a1a', font=("Arial", 9))
+        self.dropped_label.pack(side=tk.RIGHT, padx=(0, 10))
+        
+        self.metrics_label = tk.Label(bottom_frame, text="",
+                                     fg='#666666', bg='#1a1a1a', font=("Consolas", 8))
+        self.metrics_label.pack(side=tk.RIGHT, padx=(0, 10))
+    
+    def open_homepage(self, event=None):
+        """Open the author's GitHub page in the default browser."""
+        import webbrowser
+        webbrowser.open("https://github.com/GooseWithAKnife")
+    
+    def open_ignore_list_window(self):
+        """Open a window to edit the ignore, hide and highlight rules (one per line)."""
+        win = tk.Toplevel(self.root)
+        win.title("Ignore List")
+        win.configure(bg='#1a1a1a')
+        win.geometry("440x420")
+        win.transient(self.root)
+        win.grab_set()
+
+        tk.Label(win, text="Ignore, hide and highlight rules:",
+                 fg='#ffffff', bg='#1a1a1a', font=("Arial", 10, "bold")).pack(anchor='w', padx=10, pady=(10, 5))
+
+        hint = tk.Label(win, text="One rule per line. Case-insensitive. Patterns may use * and ? or /regex/.\n"
+                                  "name - no sound from this user ('@' optional)\n"
+                                  "hide:name - hide this user's messages\n"
+                                  "word:text - no sound for messages containing text\n"
+                                  "hideword:text - hide messages containing text\n"
+                                  "highlight:text - highlight messages containing text and always chime",
+                        fg='#aaaaaa', bg='#1a1a1a', font=("Arial", 9), justify=tk.LEFT)
+        hint.pack(anchor='w', padx=10, pady=(0, 8))
+
+        text = scrolledtext.ScrolledText(win, wrap=tk.WORD, width=45, height=12,
+                                         font=("Consolas", 10), bg='#2d2d2d', fg='#ffffff',
+                                         insertbackground='#ffffff', selectbackground='#404040')
+        # Pre-fill with current list
+        try:
+            text.insert('1.0', "\n".join(self.filter_rules.rules))
+        except Exception:
+            pass
+        text.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+
+        button_frame = tk.Frame(win, bg='#1a1a1a')
+        button_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+
+        def save_and_close():
+            raw = text.get('1.0', tk.END)
+            try:
+                rules = FilterRules(raw.splitlines())
+            except ValueError as e:
+                messagebox.showerror("Ignore List", str(e), parent=win)
+                return
+            # Swapped in as one object so the network thread never sees a half-built rule set
+            self.filter_rules = rules
+            self.save_settings()
+            messagebox.showinfo("Ignore List", "Ignore list saved.", parent=win)
+            win.destroy()
+
+        save_btn = tk.Button(button_frame, text="Save", command=save_and_close,
+                             bg='#28a745', fg='#ffffff', font=("Arial", 9, "bold"),
+                             width=10, relief=tk.FLAT, cursor="hand2")
+        save_btn.pack(side=tk.RIGHT, padx=(5, 0))
+
+        cancel_btn = tk.Button(button_frame, text="Cancel", command=win.destroy,
+                               bg='#6c757d', fg='#ffffff', font=("Arial", 9, "bold"),
+                               width=10, relief=tk.FLAT, cursor="hand2")
+        cancel_btn.pack(side=tk.RIGHT)
+
+        # Center the ignore list window on the screen
+        try:
+            win.update_idletasks()
+            screen_width = win.winfo_screenwidth()
+            screen_height = win.winfo_screenheight()
+            window_width = win.winfo_width()
+            window_height = win.winfo_height()
+            x = (screen_width - window_width) // 2
+            y = (screen_height - window_height) // 2
+            win.geometry(f"{window_width}x{window_height}+{x}+{y}")
+        except Exception:
+            pass
+    
+    def open_search_window(self):
+        """Open a window that searches the saved chat history."""
+        if self.history is None:
+            messagebox.showinfo("Search", "Chat history is off. Set \"history_db\" in "
+                                "chat_settings.json to a file name to turn it on.", parent=self.root)
+            return
+        
+        win = tk.Toplevel(self.root)
+        win.title("Search History")
+        win.configure(bg='#1a1a1a')
+        win.geometry("600x400")
+        win.transient(self.root)
+        
+        search_frame = tk.Frame(win, bg='#1a1a1a')
+        search_frame.pack(fill=tk.X, padx=10, pady=(10, 5))
+        
+        query_var = tk.StringVar()
+        entry = tk.Entry(search_frame, textvariable=query_var, bg='#2d2d2d', fg='#ffffff',
+                         insertbackground='#ffffff', font=("Consolas", 10))
+        entry.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        entry.focus_set()
+        
+        hint = tk.Label(win, text="Words to find. Filter with from:username and in:channel.",
+                        fg='#aaaaaa', bg='#1a1a1a', font=("Arial", 9))
+        hint.pack(anchor='w', padx=10, pady=(0, 5))
+        
+        results = scrolledtext.ScrolledText(win, wrap=tk.WORD, font=("Consolas", 10),
+                                            bg=CHAT_BACKGROUND, fg='#ffffff',
+                                            selectbackground='#404040', state='disabled')
+        results.pack(fill=tk.BOTH, expand=True, padx=10, pady=(0, 10))
+        results.tag_configure("timestamp", foreground="#888888")
+        results.tag_configure("username", foreground="#00ff00", font=("Consolas", 10, "bold"))
+        
+        def show(rows, elapsed):
+            if not win.winfo_exists():
+                return
+            results.config(state='normal')
+            results.delete('1.0', tk.END)
+            for ts, channel, name, text in rows:
+                stamp = datetime.fromtimestamp(ts).strftime('%Y-%m-%d %H:%M:%S')
+                results.insert(tk.END, f"[{stamp}] #{channel} ", "timestamp",
+                               f"{name}: ", "username", f"{text}\n")
+            results.config(state='disabled')
+            win.title(f"Search History - {len(rows)} results in {elapsed * 1000:.0f} ms")
         
-        self.chat_display.config(state='normal')
-        self.chat_display.insert(tk.END, f"[{timestamp}] ", "timestamp")
-        self.chat_display.insert(tk.END, f"{message}\n", "system")
-        self.chat_display.config(state='disabled')
-        self.chat_display.see(tk.END)
+        def run_search(event=None):
+            text, channel, user = parse_search_query(query_var.get())
+            
+            def _search():
+                started = time.perf_counter()
+                try:
+                    rows = self.history.search(text, channel, user)
+                except sqlite3.Error as e:
+                    rows = []
+                    log.error("Search failed: %s", e)
+                self.root.after(0, show, rows, time.perf_counter() - started)
+            threading.Thread(target=_search, daemon=True).start()
+        
+        tk.Button(search_frame, text="Search", command=run_search,
+                  bg='#6f42c1', fg='#ffffff', font=("Arial", 9, "bold"),
+                  relief=tk.FLAT, cursor="hand2").pack(side=tk.RIGHT, padx=(5, 0))
+        entry.bind("<Return>", run_search)
+    
+    def open_stats_window(self):
+        """Open a panel with top chatters, unique chatters and the message rate.
+        
+        Messages are counted all the time, including hidden ones; the panel
+        only redraws once per STATS_REDRAW_INTERVAL while it is open.
+        """
+        if self.stats_window is not None and self.stats_window.winfo_exists():
+            self.stats_window.lift()
+            return
+        
+        win = self.stats_window = tk.Toplevel(self.root)
+        win.title("Chat Stats")
+        win.configure(bg='#1a1a1a')
+        win.geometry("380x460")
+        win.transient(self.root)
+        
+        summary = tk.Label(win, text="", fg='#ffffff', bg='#1a1a1a', font=("Arial", 10, "bold"),
+                           justify=tk.LEFT)
+        summary.pack(anchor='w', padx=10, pady=(10, 5))
+        
+        graph_height = 100
+        graph = tk.Canvas(win, height=graph_height, bg=CHAT_BACKGROUND, highlightthickness=0)
+        graph.pack(fill=tk.X, padx=10)
+        span = STATS_BUCKETS * STATS_BUCKET_SECONDS / 60
+        tk.Label(win, text=f"Messages per {STATS_BUCKET_SECONDS:g}s over the last {span:g} minutes",
+                 fg='#aaaaaa', bg='#1a1a1a', font=("Arial", 8)).pack(anchor='w', padx=10)
+        
+        tk.Label(win, text="Top chatters:", fg='#ffffff', bg='#1a1a1a',
+                 font=("Arial", 10, "bold")).pack(anchor='w', padx=10, pady=(10, 2))
+        top = tk.Label(win, text="", fg='#cccccc', bg='#1a1a1a', font=("Consolas", 10),
+                       justify=tk.LEFT)
+        top.pack(anchor='w', padx=10)
+        
+        def reset():
+            # Swapped in as one object; a message counted into the old one is simply lost
+            self.stats = ChatStats()
+            redraw(reschedule=False)
+        
+        tk.Button(win, text="Reset", command=reset, bg='#6c757d', fg='#ffffff',
+                  font=("Arial", 9, "bold"), width=10, relief=tk.FLAT,
+                  cursor="hand2").pack(side=tk.BOTTOM, anchor='e', padx=10, pady=10)
+        
+        def redraw(reschedule=True):
+            if not win.winfo_exists():
+                return
+            snapshot = self.stats.snapshot(time.monotonic())
+            summary.config(text=f"{snapshot['per_minute']:,.0f} messages/min    "
+                                f"~{snapshot['chatters']:,.0f} unique chatters    "
+                                f"{snapshot['messages']:,} messages")
+            
+            series = snapshot['series']
+            width = max(graph.winfo_width(), 1)
+            peak = max(series) or 1
+            bar = width / len(series)
+            graph.delete('all')
+            for i, count in enumerate(series):
+                if count:
+                    height = count / peak * (graph_height - 4)
+                    graph.create_rectangle(i * bar, graph_height - height, (i + 1) * bar - 1,
+                                           graph_height, fill='#17a2b8', width=0)
+            
+            lines = []
+            for login, count, error in snapshot['top']:
+                approx = f" (up to {error:,} high)" if error else ""
+                lines.append(f"{login[:20]:20s} {count:8,}{approx}")
+            top.config(text="\n".join(lines) or "No messages yet")
+            if reschedule:
+                win.after(int(STATS_REDRAW_INTERVAL * 1000), redraw)
+        
+        redraw()
+    
+    def _setup_event_handlers(self):
+        """Set up event handlers for the window."""
+        self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
+    
+    def center_window(self):
+        """Center the window on the screen.
+        
+        The window's size is fixed by its geometry, so there is no need to
+        force a layout pass with update_idletasks() to measure it.
+        """
+        screen_width = self.root.winfo_screenwidth()
+        screen_height = self.root.winfo_screenheight()
+        
+        x = (screen_width - WINDOW_WIDTH) // 2
+        y = (screen_height - WINDOW_HEIGHT) // 2
+        
+        self.root.geometry(f"{WINDOW_WIDTH}x{WINDOW_HEIGHT}+{x}+{y}")
+    
+    def _current_channel(self):
+        """Return the channel of the selected tab, or None."""
+        selected = self.notebook.select()
+        for channel, view in self.views.items():
+            if str(view.widget.frame) == selected:
+                return channel
+        return None
+    
+    def send_message(self, event=None):
+        """Send the entry's text to the current tab's channel.
+        
+        Messages are queued and go out within Twitch's rate limits; chat
+        commands starting with '/' or '.' jump ahead of queued chat.
+        """
+        text = self.send_var.get().strip()
+        if not text:
+            return
+        channel = self._current_channel()
+        if not self.username:
+            self.add_system_message("To send messages, set \"username\" in chat_settings.json to "
+                                    "the account your token belongs to and reconnect.", channel)
+            return
+        if self.pool is None and self.ingest is None or channel is None:
+            self.update_status("Connect to a channel to send messages")
+            return
+        self.send_var.set('')
+        
+        def sent(future):
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                self.add_system_message(f"Message not sent: {error}", channel)
+            elif not future.result():
+                self.add_system_message("Message not sent: too many messages are waiting", channel)
+        if self.ingest is not None:
+            # The ingest process reports a dropped message back through its ring
+            self.ingest.say(channel, text)
+        else:
+            self.pool.say(channel, text).add_done_callback(sent)
+        if not text.startswith(('/', '.')):
+            # Twitch does not echo our own messages back
+            self.add_message(self.username, text, channel=channel)
+    
+    def add_message(self, username, message, color=None, channel=None, highlight=False,
+                    key=None, count=1, msg_id=None, user=None, emotes=None):
+        """Queue a chat message for display. Safe to call from any thread.
+        
+        key and count come from RepeatIndex when repeats are collapsed;
+        msg_id and the sender's login let moderators' deletions find it;
+        emotes are the (id, start, end) ranges to show as images.
+        """
+        kind = 'repeat' if count > 1 else 'highlight' if highlight else 'chat'
+        self.render_queue.put(ChatRecord(kind, time.time(), username, message, color, channel,
+                                         key, count, msg_id, user, emotes))
+    
+    def add_system_message(self, message, channel=None):
+        """Queue a system message for display. Safe to call from any thread.
+        
+        Messages without a channel are shown in every channel's view.
+        """
+        self.render_queue.put(ChatRecord('system', time.time(), None, message, channel=channel))
+    
+    def _render_tick(self):
+        """Render all queued messages in one batch, then reschedule."""
+        started = time.perf_counter()
+        try:
+            if self.emotes is not None:
+                self.emotes.process_ready()
+            if self.ingest is not None:
+                self._drain_ingest()
+            items, collapsed = self.render_queue.drain()
+            if items or collapsed:
+                self._render_batch(items, collapsed)
+                metrics.tick_seconds.observe(time.perf_counter() - started)
+            
+            dropped = self.render_queue.dropped
+            if dropped != self._shown_dropped:
+                self._shown_dropped = dropped
+                self.dropped_label.config(text=f"Dropped: {dropped}")
+        except Exception as e:
+            log.exception("Render error: %s", e)
+        self.root.after(max(1, int(1000 / self.render_fps)), self._render_tick)
+    
+    def _drain_ingest(self):
+        """Handle what the ingest process has written since the last tick, restarting it if it died."""
+        code = self.ingest.check()
+        if code is not None:
+            self.add_system_message(f"Chat connection process exited (code {code}), restarting")
+        for item in self.ingest.drain():
+            if isinstance(item, IrcMessage):
+                self.handle_irc_message(item)
+            elif item[0] == 'status':
+                self._on_pool_status(item[2])
+            else:
+                self.add_system_message(item[2], item[1])
+    
+    def _render_batch(self, items, collapsed):
+        """Route a batch of records to their channel views and render each once."""
+        batches = {channel: [] for channel in self.views}
+        now = time.time()
+        observe_latency = metrics.render_latency_seconds.observe
+        for record in items:
+            observe_latency(now - record.ts)
+        metrics.messages_rendered += len(items)
+        if collapsed:
+            skipped = ChatRecord('system', time.time(), None,
+                                 f"... {collapsed} messages skipped")
+            for batch in batches.values():
+                batch.append(skipped)
+        for record in items:
+            if record.channel is None:
+                for batch in batches.values():
+                    batch.append(record)
+                continue
+            batch = batches.get(record.channel)
+            if batch is None:
+                self._view_for(record.channel)
+                batch = batches[record.channel] = []
+            batch.append(record)
+        
+        for channel, batch in batches.items():
+            if batch:
+                self.views[channel].render(batch)
+    
+    def _update_metrics_readout(self):
+        """Show the last interval's throughput and latencies, then reschedule."""
+        try:
+            lines = metrics.lines_received
+            snapshots = {name: list(getattr(metrics, name).counts) for name, _ in Metrics.HISTOGRAMS}
+            last = self._metrics_snapshot
+            if last is not None:
+                rate = (lines - last['lines']) / METRICS_READOUT_INTERVAL
+                parse = metrics.parse_seconds.percentile(0.5, last['parse_seconds'])
+                latency = metrics.render_latency_seconds.percentile(0.9, last['render_latency_seconds'])
+                tick = metrics.tick_seconds.percentile(0.9, last['tick_seconds'])
+                self.metrics_label.config(
+                    text=f"{rate:,.0f} lines/s  parse {_format_seconds(parse)}  "
+                         f"lag {_format_seconds(latency)}  tick {_format_seconds(tick)}  "
+                         f"queue {len(self.render_queue)}")
+            snapshots['lines'] = lines
+            self._metrics_snapshot = snapshots
+        except Exception as e:
+            log.exception("Metrics readout error: %s", e)
+        self.root.after(int(METRICS_READOUT_INTERVAL * 1000), self._update_metrics_readout)
     
     def update_status(self, status):
         """Update the status indicator with text and orb color."""
         self.status_label.config(text=status)
         
-        if "Connected" in status:
-            self.status_orb.config(fg='#44ff44')
-        elif "Connecting" in status:
-            self.status_orb.config(fg='#ffaa00')
+        if "Connected" in status:
+            self.status_orb.config(fg='#44ff44')
+        elif "Connecting" in status or "Reconnecting" in status:
+            self.status_orb.config(fg='#ffaa00')
+        else:
+            self.status_orb.config(fg='#ff4444')
+    
+    def load_settings(self):
+        """Apply the settings read from the settings file.
+        
+        Runs before the UI exists; the widgets take their initial values
+        from the attributes set here.
+        """
+        try:
+            settings = dict(self.settings.data)
+            if settings:
+                if isinstance(settings.get('channel'), str):
+                    self.channel_text = settings['channel']
+                if isinstance(settings.get('username'), str) and settings['username'].strip():
+                    self.username = settings['username'].strip().lower()
+                if 'auto_connect' in settings:
+                    self.auto_connect = bool(settings['auto_connect'])
+                if 'sound_enabled' in settings:
+                    self.sound_enabled = bool(settings['sound_enabled'])
+                if 'token' in settings:
+                    global TOKEN
+                    saved_token = settings['token']
+                    if saved_token and saved_token != 'oauth:__CHANGEME__':
+                        TOKEN = saved_token
+                if isinstance(settings.get('filter_rules'), list):
+                    try:
+                        self.filter_rules = FilterRules(str(rule) for rule in settings['filter_rules'])
+                    except ValueError as e:
+                        log.warning("Ignoring invalid filter rules: %s", e)
+                elif isinstance(settings.get('ignore_usernames'), list):
+                    # Older settings files only had a plain list of names to silence
+                    self.filter_rules = FilterRules(str(u) for u in settings['ignore_usernames'])
+                if isinstance(settings.get('render_fps'), (int, float)) and settings['render_fps'] > 0:
+                    self.render_fps = settings['render_fps']
+                if isinstance(settings.get('render_queue_size'), int) and settings['render_queue_size'] > 0:
+                    self.render_queue_size = settings['render_queue_size']
+                if isinstance(settings.get('sound_interval'), (int, float)) and settings['sound_interval'] >= 0:
+                    sound_manager.min_interval = settings['sound_interval']
+                if settings.get('audio_backend') in AUDIO_BACKENDS:
+                    sound_manager.backend_name = settings['audio_backend']
+                if isinstance(settings.get('max_connections'), int) and settings['max_connections'] > 0:
+                    self.max_connections = settings['max_connections']
+                if isinstance(settings.get('ingest_process'), bool):
+                    self.ingest_process = settings['ingest_process']
+                self.endpoint.update(read_endpoint(settings))
+                if isinstance(settings.get('record_path'), str) and settings['record_path'].strip():
+                    self.record_path = settings['record_path'].strip()
+                if isinstance(settings.get('history_db'), str) and settings['history_db'].strip():
+                    self.history_path = settings['history_db'].strip()
+                if settings.get('overflow_policy') in OVERFLOW_POLICIES:
+                    self.overflow_policy = settings['overflow_policy']
+                if isinstance(settings.get('scrollback_lines'), int) and settings['scrollback_lines'] > 0:
+                    self.scrollback_lines = settings['scrollback_lines']
+                if settings.get('moderation_display') in MODERATION_DISPLAYS:
+                    self.moderation_display = settings['moderation_display']
+                if isinstance(settings.get('collapse_repeats'), bool):
+                    self.collapse_repeats = settings['collapse_repeats']
+                if isinstance(settings.get('repeat_window'), (int, float)) and settings['repeat_window'] > 0:
+                    self.repeat_window = settings['repeat_window']
+                if isinstance(settings.get('metrics_port'), int) and 0 < settings['metrics_port'] < 65536:
+                    self.metrics_port = settings['metrics_port']
+                if isinstance(settings.get('emotes'), bool):
+                    self.emotes_enabled = settings['emotes']
+                if isinstance(settings.get('emote_source'), str) and settings['emote_source'].strip():
+                    self.emote_source = settings['emote_source'].strip()
+                if isinstance(settings.get('emote_cache_dir'), str) and settings['emote_cache_dir'].strip():
+                    self.emote_cache_dir = settings['emote_cache_dir'].strip()
+                if isinstance(settings.get('overlay_port'), int) and 0 < settings['overlay_port'] < 65536:
+                    self.overlay_port = settings['overlay_port']
+        except Exception as e:
+            log.warning("Could not load settings: %s", e)
+    
+    def save_settings(self):
+        """Schedule the current settings to be saved.
+        
+        Keys not set here, like the token, are kept as they were read.
+        """
+        try:
+            self.sound_enabled = self.sound_enabled_var.get()
+            self.settings.update({
+                'channel': self.channel_var.get(),
+                'auto_connect': self.auto_connect_var.get(),
+                'sound_enabled': self.sound_enabled_var.get(),
+                'filter_rules': self.filter_rules.rules,
+                'sound_interval': sound_manager.min_interval,
+                'audio_backend': sound_manager.backend_name,
+                'render_fps': self.render_fps,
+                'render_queue_size': self.render_queue_size,
+                'overflow_policy': self.overflow_policy,
+                'scrollback_lines': self.scrollback_lines,
+                'collapse_repeats': self.collapse_repeats,
+                'repeat_window': self.repeat_window,
+                'moderation_display': self.moderation_display,
+                'emotes': self.emotes_enabled,
+                'max_connections': self.max_connections
+            }, remove=('ignore_usernames',))
+        except Exception as e:
+            log.error("Could not save settings: %s", e)
+    
+    def toggle_connection(self):
+        """Toggle between connect and disconnect states."""
+        if not self.connected:
+            self.connect()
+        else:
+            self.disconnect()
+    
+    def connect(self):
+        """Connect to Twitch chat and join every listed channel."""
+        try:
+            if not self._token_configured():
+                self.update_status("Please configure OAuth token first")
+                self.add_system_message("OAuth token not configured. Please add your token to chat_settings.json.")
+                return
+            
+            channels = parse_channel_list(self.channel_var.get())
+            
+            if not channels:
+                self.update_status("Please enter a channel")
+                return
+            
+            self.update_status("Connecting...")
+            self._sync_views(channels)
+            self._start_pool(channels)
+            self._show_connected()
+            
+        except Exception as e:
+            if self.pool:
+                self.pool.close()
+                self.pool = None
+            if self.ingest:
+                self.ingest.close()
+                self.ingest = None
+            self.update_status(f"Connection failed: {e}")
+    
+    @staticmethod
+    def _token_configured():
+        """Return whether an OAuth token has been set up."""
+        return TOKEN.strip().lower() != 'oauth:__changeme__'
+    
+    def _start_pool(self, channels):
+        """Open the connection pool for channels. Does not touch Tk.
+        
+        Until _release_early runs, messages and status changes are held in
+        _early instead of being handled. An IngestProcess needs no such
+        holding, since its ring is only drained by the render tick.
+        """
+        log.info("Attempting to connect to %s...", ', '.join(channels))
+        if self.ingest_process:
+            self.ingest = IngestProcess(TOKEN, channels, self.max_connections, self.username,
+                                        self.record_path, self.endpoint)
+            self.ingest.start()
+            self._early = None
+            self.connected = True
+            return
+        if self.loop_thread is None:
+            self.loop_thread = AsyncLoopThread()
+        if self.record_path and self.recorder is None:
+            self.recorder = TrafficRecorder(self.record_path)
+        self.pool = ConnectionPool(TOKEN, self._on_pool_message,
+                                   self._on_pool_status, self.loop_thread,
+                                   self.max_connections, self.recorder, self.username,
+                                   **self.endpoint)
+        self.pool.start(channels)
+        self.connected = True
+    
+    def _show_connected(self):
+        """Switch the connection controls to their connected state."""
+        self.connect_button.config(text="Disconnect", bg='#dc3545')
+        self.channel_entry.config(state='disabled')
+    
+    def _on_pool_message(self, msg):
+        """Handle a message, or hold it until the window is ready. Called on the event loop thread."""
+        if self._early is None:
+            self.handle_irc_message(msg)
+        elif len(self._early) < self.render_queue_size:
+            self._early.append((self.handle_irc_message, msg))
+        else:
+            self._early_dropped += 1
+    
+    def _release_early(self):
+        """Handle everything held in _early, then stop holding. Called on the event loop thread."""
+        early, self._early = self._early, None
+        for callback, arg in early:
+            callback(arg)
+        if self._early_dropped:
+            log.warning("Dropped %d messages that arrived before the window was ready",
+                        self._early_dropped)
+    
+    def disconnect(self):
+        """Disconnect from Twitch chat."""
+        try:
+            if self.pool:
+                self.pool.close()
+                self.pool = None
+            if self.ingest:
+                self.ingest.close()
+                self.ingest = None
+            
+            self.connected = False
+            self.connect_button.config(text="Connect", bg='#28a745')
+            self.channel_entry.config(state='normal')
+            self.update_status("Disconnected")
+            
+            self.add_system_message("Disconnected from chat")
+            
+        except Exception as e:
+            self.update_status(f"Disconnect error: {e}")
+    
+    def handle_irc_message(self, msg):
+        """Handle one parsed message.
+        
+        Called on the event loop thread, or on the Tk thread for messages
+        drained from an IngestProcess.
+        """
+        if msg.command == 'PRIVMSG' and msg.user and msg.text:
+            channel = msg.channel.lstrip('#') if msg.channel else None
+            username = msg.display_name
+            text = msg.text.rstrip()
+            message = text.replace('\uFFFD', '')
+            if self.history is not None:
+                self.history.add(time.time(), channel, msg.user, username, message, msg.msg_id)
+            self.stats.add(msg.user, time.monotonic())
+            flags = self.filter_rules.check(msg.user, username, message)
+            if flags & FilterRules.HIDE:
+                return
+            if self.overlay is not None:
+                self.overlay.publish(msg)
+            key, count = None, 1
+            if self.repeats is not None:
+                key = (channel, normalize_repeat(message))
+                count = self.repeats.hit(key, time.monotonic())
+            emotes = None
+            if self.emotes is not None and count == 1:
+                emotes = msg.emotes
+                if emotes and len(message) != len(text):
+                    emotes = remove_from_emote_ranges(text, emotes, '\uFFFD')
+                if emotes:
+                    # Loading starts now so most images are ready by the next render tick
+                    self.emotes.prefetch(emote_id for emote_id, _, _ in emotes)
+            self.add_message(username, message, msg.color, channel,
+                             bool(flags & FilterRules.HIGHLIGHT), key, count, msg.msg_id, msg.user,
+                             emotes)
+            if count == 1 and self.sound_enabled and not flags & FilterRules.SILENCE:
+                play_sound()
+        elif msg.command == 'CLEARMSG':
+            if self.overlay is not None:
+                self.overlay.publish(msg)
+            channel = msg.channel.lstrip('#') if msg.channel else None
+            target = msg.get_tag('target-msg-id')
+            if target:
+                self.render_queue.put(ChatRecord('clearmsg', time.time(), None, None,
+                                                 channel=channel, msg_id=target))
+        elif msg.command == 'CLEARCHAT':
+            if self.overlay is not None:
+                self.overlay.publish(msg)
+            channel = msg.channel.lstrip('#') if msg.channel else None
+            user = msg.text.strip().lower() if msg.text else None
+            self.render_queue.put(ChatRecord('clearchat', time.time(), None, None,
+                                             channel=channel, user=user))
+            duration = msg.get_tag('ban-duration')
+            if user is None:
+                self.add_system_message("Chat was cleared by a moderator", channel)
+            elif duration:
+                self.add_system_message(f"{user} was timed out for {duration}s", channel)
+            else:
+                self.add_system_message(f"{user} was banned", channel)
+        elif msg.command == 'USERNOTICE':
+            if self.overlay is not None:
+                self.overlay.publish(msg)
+            channel = msg.channel.lstrip('#') if msg.channel else None
+            notice = msg.get_tag('system-msg') or msg.get_tag('msg-id') or "Notice"
+            if msg.text:
+                name = msg.display_name or msg.get_tag('login') or ''
+                notice = f"{notice} {name}: {msg.text.rstrip()}"
+            self.render_queue.put(ChatRecord('notice', time.time(), None, notice, channel=channel))
+        elif msg.command == 'PRIVMSG':
+            channel = msg.channel.lstrip('#') if msg.channel else None
+            self.add_system_message(f"DEBUG: Could not parse PRIVMSG from {msg.prefix}", channel)
+    
+    def start_replay(self, path, speed=1.0):
+        """Feed a recorded traffic log into the window instead of a live connection.
+        
+        Args:
+            path: Traffic log written by TrafficRecorder, or raw IRC lines.
+            speed: Playback speed multiplier, or 0 for as fast as possible.
+        """
+        def _replay():
+            try:
+                count = replay_traffic_log(path, speed, self.handle_irc_message, self._replay_stop)
+                self.add_system_message(f"Replay finished: {count} messages")
+                self.root.after(0, self.update_status, "Replay finished")
+            except Exception as e:
+                self.root.after(0, self.update_status, f"Replay failed: {e}")
+        
+        self.update_status(f"Replaying {os.path.basename(path)}")
+        threading.Thread(target=_replay, name="replay", daemon=True).start()
+    
+    def _on_pool_status(self, status):
+        """Called on the event loop thread when the pool's status changes."""
+        if not self.connected:
+            return
+        if self._early is not None:
+            self._early.append((self._on_pool_status, status))
+            return
+        self.root.after(0, self.update_status, status)
+        if status == "Connected":
+            self.add_system_message("Connected to chat")
+        elif status.startswith("Reconnecting"):
+            self.add_system_message(status)
+    
+    def on_closing(self):
+        """Handle window close event - save settings and disconnect."""
+        try:
+            self.save_settings()
+            self.settings.close()
+            if self.connected:
+                self.disconnect()
+            if self.overlay:
+                self.loop_thread.submit(self.overlay.close()).result(timeout=2)
+            if self.loop_thread:
+                self.loop_thread.stop()
+            self._replay_stop.set()
+            if self.recorder:
+                self.recorder.close()
+            if self.history:
+                self.history.close()
+            if self.metrics_server:
+                self.metrics_server.close()
+            if self.emotes:
+                self.emotes.close()
+            self.root.destroy()
+        except Exception as e:
+            log.error("Error during shutdown: %s", e)
+            self.root.destroy()
+    
+    def run(self):
+        """Start the GUI event loop."""
+        self.root.mainloop()
+
+
+def play_sound():
+    """Play notification sound using the global sound manager."""
+    sound_manager.play_sound()
+
+
+@functools.lru_cache(maxsize=None)
+def _tls_context():
+    """Return the TLS context shared by every connection.
+    
+    Loading the system CA certificates takes tens of milliseconds, so it is
+    done once, on the event loop thread, when the first connection opens.
+    """
+    return ssl.create_default_context()
+
+
+async def connect_to_twitch(token, host=TWITCH_SERVER, port=TWITCH_TLS_PORT, use_tls=True, nick=None):
+    """Open an IRC connection to Twitch and request the tags capability for colors.
+    
+    Args:
+        token: OAuth token for authentication.
+        host: IRC server host name.
+        port: IRC server port.
+        use_tls: Whether to wrap the connection in TLS.
+        nick: Login name the token belongs to. Needed to send messages;
+            without it the connection can only read.
+    
+    Returns:
+        An (asyncio.StreamReader, asyncio.StreamWriter) pair.
+    """
+    context = _tls_context() if use_tls else None
+    reader, writer = await asyncio.open_connection(
+        host, port, ssl=context, server_hostname=host if use_tls else None)
+    
+    commands = [
+        f"PASS {token}",
+        f"NICK {nick or 'chatreader'}",
+        "CAP REQ :twitch.tv/membership twitch.tv/tags twitch.tv/commands",
+        "CAP END"
+    ]
+    writer.write("".join(f"{cmd}\r\n" for cmd in commands).encode('utf-8'))
+    await writer.drain()
+    return reader, writer
+
+
+def parse_channel_list(text):
+    """Split a comma or space separated channel list into unique lowercase names.
+    
+    Args:
+        text: Raw text from the channel box, e.g. '#foo, bar baz'.
+    
+    Returns:
+        List of channel names without '#', in the order given.
+    """
+    channels = []
+    for name in re.split(r'[\s,]+', text):
+        name = name.strip().lstrip('#').lower()
+        if name and name not in channels:
+            channels.append(name)
+    return channels
+
+
+class AsyncLoopThread:
+    """Runs an asyncio event loop on a daemon thread for use from the Tk thread."""
+    
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="asyncio", daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+    
+    def submit(self, coro):
+        """Schedule a coroutine on the loop and return a concurrent Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+    
+    def call(self, callback, *args):
+        """Call a plain function on the loop thread."""
+        self.loop.call_soon_threadsafe(callback, *args)
+    
+    def stop(self):
+        """Stop the loop; pending tasks are abandoned."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+class JoinRateLimiter:
+    """Sliding-window limiter for Twitch's per-account JOIN rate limit."""
+    
+    def __init__(self, limit=JOIN_RATE_LIMIT, window=JOIN_RATE_WINDOW):
+        self.limit = limit
+        self.window = window
+        self._times = deque()
+    
+    async def acquire(self):
+        """Wait until one more JOIN may be sent."""
+        while True:
+            now = time.monotonic()
+            while self._times and now - self._times[0] >= self.window:
+                self._times.popleft()
+            if len(self._times) < self.limit:
+                self._times.append(now)
+                return
+            await asyncio.sleep(self.window - (now - self._times[0]))
+
+
+class ChatRateLimiter:
+    """Token bucket for Twitch's per-account chat limits, shared by every connection.
+    
+    Twitch allows limit messages in any window seconds, or mod_limit in
+    channels where the account is a moderator or the broadcaster, and
+    locks out accounts that go over. A bucket refilled at a steady rate
+    can overshoot a sliding window, so here each token comes back exactly
+    window seconds (plus slack for network jitter) after it was spent.
+    """
+    
+    def __init__(self, limit=SEND_RATE_LIMIT, mod_limit=SEND_RATE_LIMIT_MOD,
+                 window=SEND_RATE_WINDOW, slack=SEND_RATE_SLACK):
+        self.limit = limit
+        self.mod_limit = mod_limit
+        self.window = window + slack
+        self._spent = deque()
+    
+    def delay(self, moderator=False):
+        """Return how many seconds until a message may be sent, 0 if it may be sent now."""
+        now = time.monotonic()
+        spent = self._spent
+        while spent and now - spent[0] >= self.window:
+            spent.popleft()
+        limit = self.mod_limit if moderator else self.limit
+        if len(spent) < limit:
+            return 0.0
+        return spent[len(spent) - limit] + self.window - now
+    
+    def spend(self):
+        """Take a token for a message being sent now."""
+        self._spent.append(time.monotonic())
+
+
+class SendQueue:
+    """Outgoing lines for one connection, highest priority first.
+    
+    CONTROL lines (PONG, PING, JOIN) go out as soon as the writer is free
+    and are not rate limited. COMMAND lines (chat commands such as
+    /timeout) go ahead of ordinary CHAT; both wait for the chat limiter.
+    Lines of equal priority keep their order. Only used on the loop thread.
+    """
+    
+    CONTROL = 0
+    COMMAND = 1
+    CHAT = 2
+    
+    def __init__(self, maxsize=SEND_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._heap = []
+        self._count = 0
+        self._added = None
+    
+    def __len__(self):
+        return len(self._heap)
+    
+    def put(self, priority, line, channel=None):
+        """Queue line; returns False if a chat line was dropped because the queue is full."""
+        if priority != self.CONTROL and len(self._heap) >= self.maxsize:
+            self.dropped += 1
+            return False
+        self._count += 1
+        heapq.heappush(self._heap, (priority, self._count, line, channel))
+        if self._added is not None:
+            self._added.set()
+        return True
+    
+    def peek(self):
+        """Return the next (priority, line, channel) without removing it."""
+        priority, _, line, channel = self._heap[0]
+        return priority, line, channel
+    
+    def pop(self):
+        """Remove the next line."""
+        heapq.heappop(self._heap)
+    
+    def discard_control(self):
+        """Drop queued CONTROL lines, which only make sense on the connection they were meant for."""
+        self._heap = [item for item in self._heap if item[0] != self.CONTROL]
+        heapq.heapify(self._heap)
+    
+    async def wait(self, timeout=None):
+        """Wait until a line is queued, or for at most timeout seconds."""
+        if self._added is None:
+            self._added = asyncio.Event()
+        self._added.clear()
+        try:
+            await asyncio.wait_for(self._added.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class IrcClient:
+    """One self-healing IRC connection that keeps a set of channels joined.
+    
+    The client sends its own PINGs to measure round-trip time and detect
+    dead connections, follows Twitch's RECONNECT command, and reconnects
+    with jittered exponential backoff, rejoining its channels each time.
+    Everything it sends goes through send_queue to a single writer task,
+    so the reader never waits on a write. Callbacks run on the event loop
+    thread.
+    """
+    
+    def __init__(self, token, on_message, on_state, limiter=None, recorder=None,
+                 host=TWITCH_SERVER, port=TWITCH_TLS_PORT, use_tls=True, nick=None,
+                 send_limiter=None):
+        self.token = token
+        self.nick = nick
+        self.send_limiter = send_limiter or ChatRateLimiter()
+        self.send_queue = SendQueue()
+        self.moderator_in = set()
+        self.on_message = on_message
+        self.on_state = on_state
+        self.limiter = limiter or JoinRateLimiter()
+        self.recorder = recorder
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.channels = []
+        self.state = 'connecting'
+        self.rtt = None
+        self.reconnects = 0
+        self.ping_interval = PING_INTERVAL
+        self.pong_timeout = PONG_TIMEOUT
+        self._writer = None
+        self._ping_sent = None
+        self._ping_timed_out = False
+        self._closing = False
+        self._task = None
+    
+    def start(self):
+        """Start the connection task. Must be called on the loop thread."""
+        self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def close(self):
+        """Stop reconnecting and close the connection."""
+        self._closing = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+    
+    def send(self, line, priority=SendQueue.CONTROL, channel=None):
+        """Queue one raw IRC line for the writer.
+        
+        Returns:
+            False if the line was dropped because the send queue is full.
+        """
+        return self.send_queue.put(priority, line, channel)
+    
+    def say(self, channel, text):
+        """Queue a chat message or command (starting with '/' or '.') for channel.
+        
+        Messages wait in the queue while disconnected and go out, within
+        the chat rate limits, once connected.
+        
+        Returns:
+            False if the message was dropped because the send queue is full.
+        """
+        priority = SendQueue.COMMAND if text.startswith(('/', '.')) else SendQueue.CHAT
+        return self.send(f"PRIVMSG #{channel} :{text}", priority, channel)
+    
+    async def join(self, channel):
+        """Join channel (without '#') now and on every reconnect."""
+        if channel not in self.channels:
+            self.channels.append(channel)
+        if self.state == 'connected':
+            await self.limiter.acquire()
+            self.send(f"JOIN #{channel}")
+    
+    def _set_state(self, state, detail=None):
+        self.state = state
+        self.on_state(self, state, detail)
+    
+    async def _run(self):
+        """Connect, read until the connection fails, back off and repeat.
+        
+        The first retry after a connection that stayed up for BACKOFF_RESET
+        seconds is immediate; consecutive failures then back off
+        exponentially with jitter.
+        """
+        attempt = 0
+        while not self._closing:
+            self._set_state('connecting')
+            immediate = False
+            sender = None
+            try:
+                reader, self._writer = await connect_to_twitch(
+                    self.token, self.host, self.port, self.use_tls, self.nick)
+                sender = asyncio.get_running_loop().create_task(self._send_loop(self._writer))
+                self._set_state('connected')
+                started = time.monotonic()
+                for channel in list(self.channels):
+                    await self.limiter.acquire()
+                    self.send(f"JOIN #{channel}")
+                immediate = await self._session(reader)
+                if time.monotonic() - started >= BACKOFF_RESET:
+                    attempt = 0
+                error = "PING timeout" if self._ping_timed_out else "Connection closed by server"
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = str(e) or type(e).__name__
+            finally:
+                if sender is not None:
+                    sender.cancel()
+                await self._close_writer()
+            
+            if self._closing or self.state == 'failed':
+                return
+            self.reconnects += 1
+            if immediate:
+                continue
+            if attempt == 0:
+                delay = 0
+            else:
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+            attempt += 1
+            self._set_state('reconnecting', f"{error}; retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    
+    async def _session(self, reader):
+        """Read and dispatch lines until the connection ends.
+        
+        Returns:
+            True if the server asked us to reconnect right away.
+        """
+        framer = IrcLineFramer()
+        keepalive = asyncio.get_running_loop().create_task(self._keepalive())
+        observe_parse = metrics.parse_seconds.observe
+        perf_counter = time.perf_counter
+        try:
+            while True:
+                data = await asyncio.wait_for(reader.read(RECV_BUFFER_SIZE),
+                                              self.ping_interval + self.pong_timeout)
+                if not data:
+                    return False
+                lines = framer.feed(data)
+                metrics.bytes_received += len(data)
+                metrics.lines_received += len(lines)
+                if self.recorder is not None:
+                    self.recorder.record(lines)
+                for line in lines:
+                    if not line:
+                        continue
+                    if line.startswith('PING'):
+                        self.send(f"PONG{line[4:]}")
+                        continue
+                    started = perf_counter()
+                    msg = parse_irc_line(line)
+                    observe_parse(perf_counter() - started)
+                    if msg is None:
+                        continue
+                    if msg.command == 'PONG':
+                        self._on_pong()
+                    elif msg.command == 'RECONNECT':
+                        return True
+                    elif msg.command == 'NOTICE' and msg.text and 'authentication failed' in msg.text.lower():
+                        self._set_state('failed', msg.text)
+                        return False
+                    else:
+                        if msg.command == 'USERSTATE' and msg.channel:
+                            self._on_userstate(msg)
+                        try:
+                            self.on_message(msg)
+                        except Exception as e:
+                            log.exception("Error handling message: %s", e)
+        finally:
+            keepalive.cancel()
+    
+    async def _keepalive(self):
+        """Send PINGs and drop the connection if a PONG does not come back."""
+        while True:
+            await asyncio.sleep(self.ping_interval)
+            self._ping_sent = time.monotonic()
+            self.send("PING :tmi.twitch.tv")
+            await asyncio.sleep(self.pong_timeout)
+            if self._ping_sent is not None and self._writer is not None:
+                # No PONG: treat the connection as dead and let _run reconnect
+                self._ping_timed_out = True
+                self._writer.transport.abort()
+                return
+    
+    async def _send_loop(self, writer):
+        """The connection's only writer: send queued lines in priority order within the chat limits."""
+        queue = self.send_queue
+        try:
+            while True:
+                if not queue:
+                    await queue.wait()
+                    continue
+                priority, line, channel = queue.peek()
+                if priority != SendQueue.CONTROL:
+                    delay = self.send_limiter.delay(channel in self.moderator_in)
+                    if delay > 0:
+                        # Wakes early for new lines, which may outrank this one
+                        await queue.wait(delay)
+                        continue
+                    self.send_limiter.spend()
+                queue.pop()
+                writer.write(f"{line}\r\n".encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass  # The reader notices the closed connection and reconnects
+    
+    def _on_userstate(self, msg):
+        """Track the channels where our account may send at the moderator rate."""
+        channel = msg.channel.lstrip('#')
+        if msg.get_tag('mod') == '1' or any(badge == 'broadcaster' for badge, _ in msg.badges):
+            self.moderator_in.add(channel)
+        else:
+            self.moderator_in.discard(channel)
+    
+    def _on_pong(self):
+        if self._ping_sent is not None:
+            self.rtt = time.monotonic() - self._ping_sent
+            self._ping_sent = None
+    
+    async def _close_writer(self):
+        writer, self._writer = self._writer, None
+        self.send_queue.discard_control()
+        self._ping_sent = None
+        self._ping_timed_out = False
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+
+class ConnectionPool:
+    """Spreads many channels over a small pool of IrcClients on one event loop.
+    
+    Channels are assigned round-robin and joined through a shared limiter
+    that respects Twitch's JOIN rate limit; messages sent on any connection
+    share one ChatRateLimiter, since Twitch counts them per account.
+    Connection state changes are summarized into a single status string
+    for on_status.
+    """
+    
+    def __init__(self, token, on_message, on_status, loop_thread,
+                 max_connections=MAX_CONNECTIONS, recorder=None, nick=None, **endpoint):
+        self.token = token
+        self.nick = nick
+        self.on_message = on_message
+        self.on_status = on_status
+        self.loop_thread = loop_thread
+        self.max_connections = max(1, max_connections)
+        self.recorder = recorder
+        self.endpoint = endpoint
+        self.clients = []
+        self.limiter = JoinRateLimiter()
+        self.send_limiter = ChatRateLimiter()
+    
+    def start(self, channels):
+        """Begin connecting and joining. Safe to call from any thread.
+        
+        Args:
+            channels: Channel names without '#'.
+        """
+        self.loop_thread.submit(self.open(list(channels)))
+    
+    async def open(self, channels):
+        """Create and start the clients. Must run on the pool's event loop."""
+        count = min(self.max_connections, len(channels))
+        for _ in range(count):
+            client = IrcClient(self.token, self.on_message, self._on_state,
+                               self.limiter, self.recorder, nick=self.nick,
+                               send_limiter=self.send_limiter, **self.endpoint)
+            self.clients.append(client)
+        for i, channel in enumerate(channels):
+            self.clients[i % count].channels.append(channel)
+        for client in self.clients:
+            client.start()
+    
+    def client_for(self, channel):
+        """Return the client channel was assigned to, or None."""
+        for client in self.clients:
+            if channel in client.channels:
+                return client
+        return None
+    
+    def say(self, channel, text):
+        """Queue a message for channel. Safe to call from any thread.
+        
+        Returns:
+            A concurrent Future that resolves to False if the message was
+            dropped (no connection has the channel, or its queue is full).
+        """
+        return self.loop_thread.submit(self._say(channel, text))
+    
+    async def _say(self, channel, text):
+        client = self.client_for(channel)
+        return client is not None and client.say(channel, text)
+    
+    def _on_state(self, client, state, detail):
+        """Summarize the state of every client for the status bar."""
+        if state == 'failed':
+            self.on_status(f"Connection failed: {detail}")
+            return
+        if detail:
+            log.info("Connection %s: %s", state, detail)
+        connected = sum(1 for c in self.clients if c.state == 'connected')
+        if connected == len(self.clients):
+            self.on_status("Connected")
+        elif any(c.state == 'reconnecting' for c in self.clients):
+            self.on_status(f"Reconnecting... ({connected}/{len(self.clients)} connected)")
         else:
-            self.status_orb.config(fg='#ff4444')
+            self.on_status("Connecting...")
     
-    def load_settings(self):
-        """Load settings from the settings file."""
+    def close(self):
+        """Close every client. Safe to call from any thread."""
+        return self.loop_thread.submit(self.close_async())
+    
+    async def close_async(self):
+        """Close every client. Must run on the pool's event loop."""
+        await asyncio.gather(*(client.close() for client in self.clients))
+
+
+_TAG_ESCAPE_RE = re.compile(r'\\(.?)', re.DOTALL)
+_TAG_ESCAPES = {':': ';', 's': ' ', '\\': '\\', 'r': '\r', 'n': '\n'}
+
+
+def _unescape_tag_value(value):
+    """Undo IRCv3 tag value escaping (\\:, \\s, \\\\, \\r, \\n)."""
+    if '\\' not in value:
+        return value
+    return _TAG_ESCAPE_RE.sub(lambda m: _TAG_ESCAPES.get(m.group(1), m.group(1)), value)
+
+
+def _parse_tags(raw_tags):
+    """Split a raw IRCv3 tag string into a dict of unescaped values."""
+    tags = {}
+    if not raw_tags:
+        return tags
+    for item in raw_tags.split(';'):
+        key, sep, value = item.partition('=')
+        if key:
+            tags[key] = _unescape_tag_value(value) if sep else ''
+    return tags
+
+
+def _find_tag(raw_tags, key):
+    """Return one unescaped tag value from a raw tag string without splitting it all."""
+    needle = key + '='
+    if raw_tags.startswith(needle):
+        start = len(needle)
+    else:
+        start = raw_tags.find(';' + needle)
+        if start < 0:
+            # A tag without '=' is present with an empty value, as in _parse_tags
+            if (raw_tags == key or raw_tags.startswith(key + ';') or raw_tags.endswith(';' + key)
+                    or f';{key};' in raw_tags):
+                return ''
+            return None
+        start += len(needle) + 1
+    end = raw_tags.find(';', start)
+    return _unescape_tag_value(raw_tags[start:] if end < 0 else raw_tags[start:end])
+
+
+def remove_from_emote_ranges(text, emotes, removed):
+    """Shift emote ranges to match text with every removed character taken out.
+    
+    Args:
+        text: The text the ranges were given for.
+        emotes: (emote_id, start, end) ranges sorted by start, as from IrcMessage.emotes.
+        removed: The character being removed from text.
+    
+    Returns:
+        The ranges for the shortened text; ranges that covered a removed
+        character are dropped.
+    """
+    positions = [i for i, char in enumerate(text) if char == removed]
+    ranges = []
+    for emote_id, start, end in emotes:
+        before = bisect.bisect_left(positions, start)
+        if before < len(positions) and positions[before] <= end:
+            continue
+        ranges.append((emote_id, start - before, end - before))
+    return ranges
+
+
+class IrcMessage:
+    """Compact record for one parsed IRC line.
+    
+    Command, channel, user and text are extracted eagerly. Single tags are
+    looked up directly in the raw tag string; the full tag dict is only
+    built when ``tags`` is accessed, so the hot fields stay cheap.
+    """
+    
+    __slots__ = ('raw_tags', 'prefix', 'command', 'params', 'channel', 'user',
+                 'text', '_tags')
+    
+    def __init__(self, raw_tags, prefix, command, params, channel, user, text):
+        self.raw_tags = raw_tags
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+        self.channel = channel
+        self.user = user
+        self.text = text
+        self._tags = None
+    
+    def __repr__(self):
+        return (f"IrcMessage(command={self.command!r}, channel={self.channel!r}, "
+                f"user={self.user!r}, text={self.text!r})")
+    
+    def to_dict(self):
+        """Return the message as a JSON-serializable dict."""
+        return {
+            'command': self.command,
+            'channel': self.channel.lstrip('#') if self.channel else None,
+            'user': self.user,
+            'display_name': self.display_name,
+            'text': self.text,
+            'color': self.color,
+            'id': self.msg_id,
+            'tmi_sent_ts': self.sent_ts,
+            'badges': self.badges,
+            'emotes': self.emotes,
+        }
+    
+    @property
+    def tags(self):
+        """All IRCv3 tags as a dict, parsed on first access."""
+        if self._tags is None:
+            self._tags = _parse_tags(self.raw_tags)
+        return self._tags
+    
+    def get_tag(self, key, default=None):
+        """Return a single tag value, or default if the tag is absent."""
+        if self._tags is not None:
+            return self._tags.get(key, default)
+        value = _find_tag(self.raw_tags, key)
+        return default if value is None else value
+    
+    @property
+    def display_name(self):
+        """The sender's display name, falling back to the login name."""
+        return self.get_tag('display-name') or self.user
+    
+    @property
+    def color(self):
+        """The sender's name color as '#RRGGBB', or None if unset."""
+        value = self.get_tag('color')
+        if not value:
+            return None
+        return value if value.startswith('#') else f'#{value}'
+    
+    @property
+    def msg_id(self):
+        """The unique message id (the 'id' tag), or None."""
+        return self.get_tag('id') or None
+    
+    @property
+    def sent_ts(self):
+        """The server send time in milliseconds since the epoch, or None."""
+        value = self.get_tag('tmi-sent-ts')
+        return int(value) if value and value.isdigit() else None
+    
+    @property
+    def badges(self):
+        """List of (badge, version) tuples from the 'badges' tag."""
+        value = self.get_tag('badges')
+        if not value:
+            return []
+        return [tuple(badge.partition('/')[::2]) for badge in value.split(',') if badge]
+    
+    @property
+    def emotes(self):
+        """List of (emote_id, start, end) ranges sorted by start index.
+        
+        Indices are inclusive character offsets into the message text.
+        """
+        value = self.get_tag('emotes')
+        if not value:
+            return []
+        ranges = []
+        for emote in value.split('/'):
+            emote_id, _, positions = emote.partition(':')
+            for position in positions.split(','):
+                start, _, stop = position.partition('-')
+                if start.isdigit() and stop.isdigit():
+                    ranges.append((emote_id, int(start), int(stop)))
+        ranges.sort(key=lambda item: item[1])
+        return ranges
+
+
+def parse_irc_line(line):
+    """Parse one raw IRC line in a single pass.
+    
+    Handles the full IRCv3 message grammar:
+    ``[@tags ][:prefix ]COMMAND[ params][ :trailing]``.
+    
+    Args:
+        line: Raw IRC line without the trailing CRLF.
+    
+    Returns:
+        An IrcMessage, or None if the line is malformed.
+    """
+    pos = 0
+    raw_tags = ''
+    if line.startswith('@'):
+        pos = line.find(' ')
+        if pos < 0:
+            return None
+        raw_tags = line[1:pos]
+        pos += 1
+    
+    prefix = ''
+    if line.startswith(':', pos):
+        end = line.find(' ', pos)
+        if end < 0:
+            return None
+        prefix = line[pos + 1:end]
+        pos = end + 1
+    
+    trailing_at = line.find(' :', pos)
+    if trailing_at < 0:
+        params = line[pos:].split()
+        text = None
+    else:
+        params = line[pos:trailing_at].split()
+        text = line[trailing_at + 2:]
+    
+    if not params:
+        return None
+    command = params[0]
+    params = params[1:]
+    if text is not None:
+        params.append(text)
+    
+    channel = params[0] if params and params[0].startswith('#') else None
+    user = prefix.partition('!')[0] if '!' in prefix else None
+    return IrcMessage(raw_tags, prefix, command, params, channel, user, text)
+
+
+def parse_message(irc_message):
+    """Parse a raw IRC message and extract username, message text, and color.
+    
+    Args:
+        irc_message: Raw IRC message string.
+    
+    Returns:
+        Tuple of (username, message, color) if a user message, else (None, None, None).
+    """
+    msg = parse_irc_line(irc_message)
+    if msg is None or msg.command != 'PRIVMSG' or not msg.user or msg.text is None:
+        return None, None, None
+    return msg.display_name, msg.text, msg.color
+
+
+def signal_handler(signum, frame):
+    """Handle termination signals to save settings and close open logs before exit."""
+    log.info("Saving settings before exit...")
+    try:
+        if hasattr(signal_handler, 'chat_window') and signal_handler.chat_window:
+            signal_handler.chat_window.save_settings()
+            signal_handler.chat_window.settings.close()
+            if signal_handler.chat_window.connected:
+                signal_handler.chat_window.disconnect()
+            if signal_handler.chat_window.recorder:
+                signal_handler.chat_window.recorder.close()
+            if signal_handler.chat_window.history:
+                signal_handler.chat_window.history.close()
+    except Exception as e:
+        log.error("Error saving settings during shutdown: %s", e)
+    sys.exit(0)
+
+
+OVERLAY_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>BetterTwitchChat overlay</title>
+<style>
+  body { margin: 0; background: transparent; color: #fff; overflow: hidden;
+         font: 600 18px/1.35 Arial, sans-serif; text-shadow: 0 0 3px #000, 0 0 3px #000; }
+  #chat { position: absolute; bottom: 0; left: 0; right: 0; padding: 8px; }
+  .line { margin: 2px 0; word-wrap: break-word; }
+  .notice { color: #b98cff; }
+</style>
+</head>
+<body>
+<div id="chat"></div>
+<script>
+const chat = document.getElementById('chat');
+const byId = {};
+const source = new EventSource('events' + location.search);
+function add(line, id, user) {
+  line.dataset.user = user || '';
+  if (id) byId[id] = line;
+  chat.appendChild(line);
+  while (chat.children.length > 50) {
+    const old = chat.firstChild;
+    delete byId[old.dataset.id];
+    old.remove();
+  }
+  if (id) line.dataset.id = id;
+}
+source.onmessage = (event) => {
+  const msg = JSON.parse(event.data);
+  if (msg.command === 'PRIVMSG') {
+    const line = document.createElement('div');
+    const name = document.createElement('span');
+    name.textContent = msg.display_name + ': ';
+    name.style.color = msg.color || '#9146ff';
+    line.className = 'line';
+    line.appendChild(name);
+    line.appendChild(document.createTextNode(msg.text));
+    add(line, msg.id, msg.user);
+  } else if (msg.command === 'USERNOTICE' && msg.system_msg) {
+    const line = document.createElement('div');
+    line.className = 'line notice';
+    line.textContent = msg.system_msg + (msg.text ? ' ' + msg.text : '');
+    add(line, msg.id, null);
+  } else if (msg.command === 'CLEARMSG' && byId[msg.target_id]) {
+    byId[msg.target_id].remove();
+  } else if (msg.command === 'CLEARCHAT') {
+    for (const line of [...chat.children]) {
+      if (!msg.text || line.dataset.user === msg.text) line.remove();
+    }
+  }
+};
+</script>
+</body>
+</html>
+"""
+
+
+class OverlayClient:
+    """One connected event stream and how far it has read."""
+    
+    __slots__ = ('channel', 'cursor', 'dropped', 'closed')
+    
+    def __init__(self, cursor, channel=None):
+        self.channel = channel
+        self.cursor = cursor
+        self.dropped = 0
+        self.closed = False
+
+
+class OverlayServer:
+    """Streams parsed chat to browser sources over HTTP on localhost.
+    
+    GET / serves a ready-made transparent chat overlay page, and
+    GET /events streams every archived message as a JSON Server-Sent
+    Event; '?channel=name' limits either to one channel.
+    
+    Each message is serialized once into a ring of the last buffer_size
+    messages, and each client's task sends what lies between its own
+    cursor and the newest message. publish() is O(1) however many
+    clients are connected and never waits on a socket, so one stuck
+    browser tab can't slow down the IRC reader. A client that falls more
+    than buffer_size messages behind skips the oldest ones (counted in
+    dropped), and one whose socket accepts nothing for drain_timeout
+    seconds is disconnected.
+    """
+    
+    def __init__(self, port=OVERLAY_PORT, host='127.0.0.1', buffer_size=OVERLAY_CLIENT_BUFFER,
+                 drain_timeout=OVERLAY_DRAIN_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.buffer_size = buffer_size
+        self.drain_timeout = drain_timeout
+        self.clients = set()
+        self.published = 0
+        self.dropped = 0
+        self._ring = [None] * buffer_size
+        self._wake = None
+        self._notify_pending = False
+        self._server = None
+        self._loop = None
+        self._loop_thread_id = None
+        self._dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    
+    async def start(self):
+        """Start listening; must be awaited on the loop that will serve clients."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        metrics.gauge('overlay_clients', "Connected overlay clients", lambda: len(self.clients))
+        metrics.gauge('overlay_dropped_total', "Messages skipped for overlay clients that fell behind",
+                      lambda: self.dropped, 'counter')
+        log.info("Serving chat overlay on http://%s:%d/", self.host, self.port)
+    
+    async def close(self):
+        """Stop listening and disconnect every client."""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for client in self.clients:
+            client.closed = True
+        self._notify()
+    
+    def publish(self, msg):
+        """Send one IrcMessage to every client. Safe to call from any thread."""
+        record = msg.to_dict()
+        record['received'] = round(time.time(), 3)
+        if msg.command == 'CLEARMSG':
+            record['target_id'] = msg.get_tag('target-msg-id')
+        elif msg.command == 'USERNOTICE':
+            record['system_msg'] = msg.get_tag('system-msg')
+        entry = (record['channel'], b'data: ' + self._dumps(record).encode('utf-8') + b'\n\n')
+        if threading.get_ident() == self._loop_thread_id:
+            self._append(entry)
+        elif self._loop is not None:
+            self._loop.call_soon_threadsafe(self._append, entry)
+    
+    def _append(self, entry):
+        self._ring[self.published % self.buffer_size] = entry
+        self.published += 1
+        if self._wake is not None and not self._notify_pending:
+            # Waking every client costs O(clients), so it is done once per
+            # loop iteration rather than once per message
+            self._notify_pending = True
+            self._loop.call_soon(self._notify)
+    
+    def _notify(self):
+        """Wake every client task waiting for new messages."""
+        self._notify_pending = False
+        if self._wake is not None:
+            self._wake.set()
+            self._wake = None
+    
+    async def _wait(self, timeout):
+        if self._wake is None:
+            self._wake = asyncio.Event()
+        await asyncio.wait_for(self._wake.wait(), timeout)
+    
+    def _take(self, client):
+        """Return the bytes client hasn't been sent yet and advance its cursor."""
+        oldest = self.published - self.buffer_size
+        if client.cursor < oldest:
+            client.dropped += oldest - client.cursor
+            self.dropped += oldest - client.cursor
+            client.cursor = oldest
+        ring = self._ring
+        size = self.buffer_size
+        channel = client.channel
+        chunks = []
+        for seq in range(client.cursor, self.published):
+            entry_channel, payload = ring[seq % size]
+            if channel is None or entry_channel == channel:
+                chunks.append(payload)
+        client.cursor = self.published
+        return b''.join(chunks)
+    
+    async def _handle(self, reader, writer):
         try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            settings_path = os.path.join(script_dir, SETTINGS_FILE)
-            
-            if os.path.exists(settings_path):
-                with open(settings_path, 'r') as f:
-                    settings = json.load(f)
-                
-                if 'channel' in settings:
-                    self.channel_var.set(settings['channel'])
-                if 'auto_connect' in settings:
-                    self.auto_connect_var.set(settings['auto_connect'])
-                if 'sound_enabled' in settings:
-                    self.sound_enabled_var.set(settings['sound_enabled'])
-                if 'token' in settings:
-                    global TOKEN
-                    saved_token = settings['token']
-                    if saved_token and saved_token != 'oauth:__CHANGEME__':
-                        TOKEN = saved_token
-                if 'ignore_usernames' in settings and isinstance(settings['ignore_usernames'], list):
-                    self.ignored_usernames = set([str(u).lower() for u in settings['ignore_usernames'] if str(u).strip()])
-        except Exception as e:
-            print(f"Could not load settings: {e}")
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            method, target = request.split(b' ', 2)[:2]
+            path, _, query = target.decode('latin-1').partition('?')
+            channel = None
+            for pair in query.split('&'):
+                key, _, value = pair.partition('=')
+                if key == 'channel' and value:
+                    channel = value.lower().lstrip('#')
+            if method != b'GET':
+                await self._respond(writer, '405 Method Not Allowed', 'text/plain', b'')
+            elif path == '/':
+                await self._respond(writer, '200 OK', 'text/html; charset=utf-8',
+                                    OVERLAY_PAGE.encode('utf-8'))
+            elif path == '/events':
+                await self._stream(writer, channel)
+            else:
+                await self._respond(writer, '404 Not Found', 'text/plain', b'Not found\n')
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError,
+                ValueError, OSError):
+            pass
+        finally:
+            writer.close()
     
-    def save_settings(self):
-        """Save current settings to the settings file."""
+    async def _respond(self, writer, status, content_type, body):
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body)
+        await writer.drain()
+    
+    async def _stream(self, writer, channel):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                     b"Cache-Control: no-cache\r\nAccess-Control-Allow-Origin: *\r\n\r\n"
+                     b"retry: 2000\n\n")
+        client = OverlayClient(self.published, channel)
+        self.clients.add(client)
         try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            settings_path = os.path.join(script_dir, SETTINGS_FILE)
-            
-            # Load existing settings to preserve token
-            settings = {}
-            if os.path.exists(settings_path):
-                with open(settings_path, 'r') as f:
-                    settings = json.load(f)
-            
-            # Update with current settings
-            settings.update({
-                'channel': self.channel_var.get(),
-                'auto_connect': self.auto_connect_var.get(),
-                'sound_enabled': self.sound_enabled_var.get(),
-                'ignore_usernames': sorted(list(self.ignored_usernames))
-            })
-            
-            with open(settings_path, 'w') as f:
-                json.dump(settings, f, indent=2)
-        except Exception as e:
-            print(f"Could not save settings: {e}")
+            while not client.closed:
+                if client.cursor == self.published:
+                    try:
+                        await self._wait(OVERLAY_KEEPALIVE)
+                    except asyncio.TimeoutError:
+                        # A comment line keeps proxies from closing an idle stream
+                        writer.write(b': keepalive\n\n')
+                    continue
+                data = self._take(client)
+                if data:
+                    writer.write(data)
+                    await asyncio.wait_for(writer.drain(), self.drain_timeout)
+        finally:
+            self.clients.discard(client)
+
+
+class JsonlWriter:
+    """Writes parsed messages as JSON lines through a large write buffer.
     
-    def toggle_connection(self):
-        """Toggle between connect and disconnect states."""
-        if not self.connected:
-            self.connect()
+    The buffer is flushed at most once per flush_interval seconds (and on
+    close), so a reader tailing the file still sees messages promptly.
+    """
+    
+    def __init__(self, path='-', flush_interval=JSONL_FLUSH_INTERVAL):
+        if path == '-':
+            self._file = open(sys.stdout.fileno(), 'w', encoding='utf-8',
+                              buffering=JSONL_BUFFER_SIZE, closefd=False)
         else:
-            self.disconnect()
+            self._file = open(path, 'a', encoding='utf-8', buffering=JSONL_BUFFER_SIZE)
+        self.flush_interval = flush_interval
+        self.count = 0
+        self._last_flush = time.monotonic()
+        self._dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
     
-    def connect(self):
-        """Connect to Twitch chat."""
-        try:
-            # Check if token is properly configured
-            if TOKEN.strip().lower() == 'oauth:__changeme__':
-                self.update_status("Please configure OAuth token first")
-                self.add_system_message("OAuth token not configured. Please add your token to chat_settings.json.")
-                return
-            
-            channel = self.channel_var.get().strip()
-            
-            if not channel:
-                self.update_status("Please enter a channel")
-                return
-            
-            if not channel.startswith('#'):
-                channel = '#' + channel
-            
-            print(f"Attempting to connect to {channel}...")
-            self.update_status("Connecting...")
-            
-            self.sock = connect_to_twitch_ssl(TOKEN, channel.lstrip('#'))
-            
-            self.chat_thread = threading.Thread(target=self.chat_listener, daemon=True)
-            self.chat_thread.start()
-            
-            self.connected = True
-            self.connect_button.config(text="Disconnect", bg='#dc3545')
-            self.channel_entry.config(state='disabled')
-            self.update_status("Connected")
-            
-            self.add_system_message(f"Connected to {channel.lstrip('#')}")
-            
-        except Exception as e:
-            self.update_status(f"Connection failed: {e}")
+    def write(self, msg):
+        """Append one IrcMessage as a JSON line."""
+        record = msg.to_dict()
+        record['received'] = round(time.time(), 3)
+        self._file.write(self._dumps(record) + '\n')
+        self.count += 1
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self._file.flush()
+            self._last_flush = now
     
-    def disconnect(self):
-        """Disconnect from Twitch chat."""
+    def close(self):
+        """Flush and close the output."""
+        self._file.flush()
+        self._file.close()
+
+
+async def run_headless(token, channels, output='-', max_connections=MAX_CONNECTIONS,
+                       recorder=None, history=None, overlay=None, **endpoint):
+    """Run the connection and parsing pipeline without a GUI, writing JSONL.
+    
+    Args:
+        token: OAuth token for authentication.
+        channels: Channel names without '#'.
+        output: Output file path, or '-' for stdout.
+        max_connections: Size of the connection pool.
+        recorder: Optional TrafficRecorder for the raw received lines.
+        history: Optional HistoryStore that chat messages are also saved to.
+        overlay: Optional OverlayServer, started here, that messages are streamed to.
+        **endpoint: Optional host, port and use_tls for the IRC server.
+    
+    Returns:
+        The number of messages written.
+    """
+    writer = JsonlWriter(output)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, stop.set)
+    except (NotImplementedError, RuntimeError):
+        pass  # Not supported on Windows; Ctrl+C still works
+    
+    def on_message(msg):
+        if msg.command in ARCHIVED_COMMANDS:
+            writer.write(msg)
+            if overlay is not None:
+                overlay.publish(msg)
+            if history is not None and msg.command == 'PRIVMSG' and msg.text:
+                history.add(time.time(), msg.channel.lstrip('#'), msg.user,
+                            msg.display_name, msg.text, msg.msg_id)
+    
+    def on_status(status):
+        log.info(status)
+    
+    pool = ConnectionPool(token, on_message, on_status, None, max_connections, recorder, **endpoint)
+    try:
+        if overlay is not None:
+            await overlay.start()
+        await pool.open(channels)
+        await stop.wait()
+    finally:
+        await pool.close_async()
+        if overlay is not None:
+            await overlay.close()
+        writer.close()
+    return writer.count
+
+
+class IngestRing:
+    """Single-producer, single-consumer ring of fixed-size message records in shared memory.
+    
+    The ring header holds the written, read and dropped counters. Each
+    slot holds one record: a sequence number, the receive time, a kind
+    (an index into INGEST_KINDS) and the lengths of the channel, login,
+    tag and text fields, followed by those fields as UTF-8. Text that does
+    not fit in a slot is cut short. The producer writes a slot's sequence
+    number last, so the consumer never reads a half-written record, and
+    drops records rather than overwrite ones not yet read.
+    """
+    
+    HEADER = struct.Struct('<QQQ')
+    HEADER_SIZE = 64
+    SEQ = struct.Struct('<Q')
+    RECORD = struct.Struct('<dBHHHH')
+    
+    def __init__(self, memory, slots=INGEST_RING_SLOTS, slot_size=INGEST_SLOT_SIZE):
+        self.memory = memory
+        self.name = memory.name
+        self.slots = slots
+        self.slot_size = slot_size
+        self._buf = memory.buf
+        self._written, self._read, self.dropped = self.HEADER.unpack_from(self._buf, 0)
+    
+    @classmethod
+    def create(cls, slots=INGEST_RING_SLOTS, slot_size=INGEST_SLOT_SIZE):
+        """Allocate a new, empty ring."""
+        from multiprocessing import shared_memory
+        memory = shared_memory.SharedMemory(create=True, size=cls.HEADER_SIZE + slots * slot_size)
+        memory.buf[:cls.HEADER_SIZE] = bytes(cls.HEADER_SIZE)
+        return cls(memory, slots, slot_size)
+    
+    @classmethod
+    def attach(cls, name, slots=INGEST_RING_SLOTS, slot_size=INGEST_SLOT_SIZE):
+        """Open a ring created by another process."""
+        from multiprocessing import shared_memory
+        return cls(shared_memory.SharedMemory(name=name), slots, slot_size)
+    
+    def __len__(self):
+        written, read, _ = self.HEADER.unpack_from(self._buf, 0)
+        return written - read
+    
+    def put(self, kind, channel, user, tags, text, ts):
+        """Append one record (producer side). Returns False if the ring was full."""
+        buf = self._buf
+        written = self._written
+        read = self.SEQ.unpack_from(buf, 8)[0]
+        if written - read >= self.slots:
+            self.dropped += 1
+            self.SEQ.pack_into(buf, 16, self.dropped)
+            return False
+        fields = [channel.encode('utf-8'), user.encode('utf-8'), tags.encode('utf-8'),
+                  text.encode('utf-8')]
+        room = self.slot_size - self.SEQ.size - self.RECORD.size
+        over = sum(map(len, fields)) - room
+        if over > 0:
+            # Cut the text first; a partial character at the end is dropped on reading
+            fields[3] = fields[3][:max(0, len(fields[3]) - over)]
+            over = sum(map(len, fields)) - room
+            if over > 0:
+                fields[2] = fields[2][:max(0, len(fields[2]) - over)]
+        offset = self.HEADER_SIZE + (written % self.slots) * self.slot_size
+        body = self.SEQ.size + self.RECORD.size
+        self.RECORD.pack_into(buf, offset + self.SEQ.size, ts, kind, *map(len, fields))
+        data = b''.join(fields)
+        buf[offset + body:offset + body + len(data)] = data
+        self.SEQ.pack_into(buf, offset, written + 1)
+        self._written = written + 1
+        self.SEQ.pack_into(buf, 0, self._written)
+        return True
+    
+    def drain(self, limit=INGEST_MAX_BATCH):
+        """Take up to limit records (consumer side).
+        
+        Returns:
+            A list of (ts, kind, channel, user, tags, text) tuples, oldest first.
+        """
+        buf = self._buf
+        written = self.SEQ.unpack_from(buf, 0)[0]
+        read = self._read
+        records = []
+        body = self.SEQ.size + self.RECORD.size
+        while read < written and len(records) < limit:
+            offset = self.HEADER_SIZE + (read % self.slots) * self.slot_size
+            if self.SEQ.unpack_from(buf, offset)[0] != read + 1:
+                break
+            ts, kind, *lengths = self.RECORD.unpack_from(buf, offset + self.SEQ.size)
+            start = offset + body
+            fields = []
+            for length in lengths:
+                fields.append(bytes(buf[start:start + length]).decode('utf-8', errors='ignore'))
+                start += length
+            records.append((ts, kind, *fields))
+            read += 1
+        if read != self._read:
+            self._read = read
+            self.SEQ.pack_into(buf, 8, read)
+        self.dropped = self.SEQ.unpack_from(buf, 16)[0]
+        return records
+    
+    def close(self):
+        """Detach from the shared memory."""
+        self._buf = None
+        self.memory.close()
+
+
+def _filter_tags(raw_tags):
+    """Keep only the INGEST_TAGS of a raw tag string, still escaped."""
+    if not raw_tags:
+        return ''
+    return ';'.join(item for item in raw_tags.split(';') if item.partition('=')[0] in INGEST_TAGS)
+
+
+def _ingest_main(ring_name, slots, token, channels, max_connections, nick, record_path,
+                 endpoint, outgoing):
+    """Child process body for IngestProcess: connect, parse and fill the ring.
+    
+    Runs until None arrives on outgoing, SIGTERM is received or the parent
+    process is gone, then closes the connections and the traffic recorder.
+    """
+    import multiprocessing.connection
+    # A fork inherits the window's handlers; Ctrl+C is for the window, which stops us
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    ring = IngestRing.attach(ring_name, slots)
+    recorder = TrafficRecorder(record_path) if record_path else None
+    kinds = {kind: index for index, kind in enumerate(INGEST_KINDS)
+             if kind not in ('status', 'system')}
+    parent = multiprocessing.parent_process()
+    
+    def on_message(msg):
+        kind = kinds.get(msg.command)
+        if kind is not None:
+            ring.put(kind, msg.channel or '', msg.user or '', _filter_tags(msg.raw_tags),
+                     msg.text or '', time.time())
+    
+    def on_status(status):
+        ring.put(0, '', '', '', status, time.time())
+    
+    def on_system(channel, text):
+        ring.put(1, channel, '', '', text, time.time())
+    
+    async def main():
+        loop = asyncio.get_running_loop()
+        stop = asyncio.Event()
         try:
-            if self.sock:
-                self.sock.close()
-            
-            self.connected = False
-            self.connect_button.config(text="Connect", bg='#28a745')
-            self.channel_entry.config(state='normal')
-            self.update_status("Disconnected")
-            
-            self.add_system_message("Disconnected from chat")
-            
-        except Exception as e:
-            self.update_status(f"Disconnect error: {e}")
+            loop.add_signal_handler(signal.SIGTERM, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Not supported on Windows; the parent's None still stops the child
+        pool = ConnectionPool(token, on_message, on_status, None, max_connections, recorder, nick,
+                              **endpoint)
+        await pool.open(channels)
+        
+        def say(channel, text):
+            client = pool.client_for(channel)
+            if client is None or not client.say(channel, text):
+                on_system(channel, "Message not sent: too many messages are waiting")
+        
+        def relay():
+            while True:
+                item = outgoing.get()
+                if item is None:
+                    loop.call_soon_threadsafe(stop.set)
+                    return
+                loop.call_soon_threadsafe(say, *item)
+        
+        def watch_parent():
+            # Do not outlive the window if it is killed without closing us
+            multiprocessing.connection.wait([parent.sentinel])
+            loop.call_soon_threadsafe(stop.set)
+        threading.Thread(target=relay, name="outgoing", daemon=True).start()
+        threading.Thread(target=watch_parent, name="parent-watch", daemon=True).start()
+        await stop.wait()
+        await pool.close_async()
+    try:
+        asyncio.run(main())
+    finally:
+        if recorder:
+            recorder.close()
+        ring.close()
+
+
+class IngestProcess:
+    """Owns the IRC connections and parsing in a child process.
+    
+    The child writes each message into an IngestRing as a compact record;
+    the UI drains it on its render tick and rebuilds IrcMessages without
+    parsing anything, so socket reads and parsing never compete with Tk
+    for the GIL. If the child dies, check() starts a new one on the same
+    ring, at most once per INGEST_RESTART_DELAY seconds.
+    """
+    
+    def __init__(self, token, channels, max_connections=MAX_CONNECTIONS, nick=None,
+                 record_path=None, endpoint=None, slots=INGEST_RING_SLOTS):
+        import multiprocessing
+        self.ring = IngestRing.create(slots)
+        self.restarts = 0
+        self.process = None
+        self._args = (self.ring.name, slots, token, list(channels), max_connections, nick,
+                      record_path, dict(endpoint or {}))
+        self._outgoing = multiprocessing.Queue()
+        self._last_start = 0.0
+    
+    def start(self):
+        """Start the child process."""
+        import multiprocessing
+        self.process = multiprocessing.Process(target=_ingest_main, name="ingest",
+                                               args=self._args + (self._outgoing,), daemon=True)
+        self.process.start()
+        self._last_start = time.monotonic()
+    
+    def check(self):
+        """Restart the child if it has died.
+        
+        Returns:
+            The dead child's exit code when it was restarted, else None.
+        """
+        process = self.process
+        if process is None or process.is_alive():
+            return None
+        if time.monotonic() - self._last_start < INGEST_RESTART_DELAY:
+            return None
+        code = process.exitcode
+        log.warning("Ingest process exited with code %s; restarting", code)
+        self.restarts += 1
+        self.start()
+        return code
+    
+    def drain(self, limit=INGEST_MAX_BATCH):
+        """Take up to limit waiting records.
+        
+        Returns:
+            A list of IrcMessages for chat records and (kind, channel, text)
+            tuples for 'status' and 'system' records, oldest first.
+        """
+        items = []
+        for ts, kind, channel, user, tags, text in self.ring.drain(limit):
+            if kind < 2:
+                items.append((INGEST_KINDS[kind], channel or None, text))
+            else:
+                command = INGEST_KINDS[kind]
+                params = [channel] if channel else []
+                if text or command == 'PRIVMSG':
+                    params.append(text)
+                items.append(IrcMessage(tags, f"{user}!{user}@{user}.tmi.twitch.tv" if user else '',
+                                        command, params, channel or None, user or None,
+                                        params[-1] if len(params) > bool(channel) else None))
+        return items
+    
+    def say(self, channel, text):
+        """Queue a chat message for the child to send. Safe to call from any thread."""
+        self._outgoing.put((channel, text))
+    
+    def close(self):
+        """Stop the child and free the ring.
+        
+        The child is asked to close its connections and traffic log first,
+        and only terminated if it has not exited within a few seconds.
+        """
+        if self.process is not None:
+            if self.process.is_alive():
+                self._outgoing.put(None)
+                self.process.join(timeout=3)
+            if self.process.is_alive():
+                self.process.terminate()
+                self.process.join(timeout=2)
+            self.process = None
+        self.ring.close()
+        self.ring.memory.unlink()
+
+
+_FAKE_WORDS = ('Kappa', 'PogChamp', 'LUL', 'KEKW', 'gg', 'hello', 'wow', 'hype', 'raid',
+               'lol', 'clip', 'it', 'that', 'chat', '😀', '🔥🔥🔥', '❤️', '🎉', '👀',
+               'ñandú', '中文', 'Ⓣⓦⓘⓣⓒⓗ')
+_FAKE_EMOTES = {'Kappa': '25', 'PogChamp': '305954156', 'LUL': '425618'}
+_FAKE_COLORS = ('#FF0000', '#0000FF', '#008000', '#B22222', '#FF7F50', '#9ACD32',
+                '#FF4500', '#2E8B57', '#DAA520', '#D2691E', '#5F9EA0', '#1E90FF',
+                '#FF69B4', '#8A2BE2', '#00FF7F', '')
+
+
+class SyntheticTraffic:
+    """Generates realistic raw Twitch lines: tagged PRIVMSGs, emotes, emoji and USERNOTICEs."""
+    
+    def __init__(self, seed=0, chatters=5000):
+        self._rng = random.Random(seed)
+        self.chatters = chatters
+        self._count = 0
+    
+    def next_line(self, channel, ts_ms):
+        """Return the next raw line (without CRLF) for channel, sent at ts_ms."""
+        rng = self._rng
+        self._count += 1
+        user_number = int(rng.paretovariate(1.2)) % self.chatters
+        user = f"viewer{user_number}"
+        color = _FAKE_COLORS[user_number % len(_FAKE_COLORS)]
+        msg_id = f"{self._count:08x}-{user_number:04x}-4000-8000-{ts_ms:012x}"
+        
+        if self._count % 50 == 0:
+            months = rng.randint(1, 48)
+            system_msg = f"{user}\\ssubscribed\\sat\\sTier\\s1.\\sThey've\\ssubscribed\\sfor\\s{months}\\smonths!"
+            return (f"@badge-info=subscriber/{months};badges=subscriber/{months};color={color};"
+                    f"display-name={user};emotes=;id={msg_id};login={user};mod=0;msg-id=resub;"
+                    f"msg-param-cumulative-months={months};room-id=1;system-msg={system_msg};"
+                    f"tmi-sent-ts={ts_ms};user-id={user_number} "
+                    f":tmi.twitch.tv USERNOTICE #{channel} :{rng.choice(_FAKE_WORDS)} hype")
+        
+        words = [rng.choice(_FAKE_WORDS) for _ in range(rng.randint(1, 12))]
+        emotes = {}
+        position = 0
+        for word in words:
+            emote_id = _FAKE_EMOTES.get(word)
+            if emote_id:
+                emotes.setdefault(emote_id, []).append(f"{position}-{position + len(word) - 1}")
+            position += len(word) + 1
+        emote_tag = '/'.join(f"{emote_id}:{','.join(ranges)}" for emote_id, ranges in emotes.items())
+        return (f"@badge-info=;badges={'subscriber/12' if user_number % 3 else ''};color={color};"
+                f"display-name={user};emotes={emote_tag};first-msg=0;flags=;id={msg_id};mod=0;"
+                f"room-id=1;subscriber={int(bool(user_number % 3))};tmi-sent-ts={ts_ms};turbo=0;"
+                f"user-id={user_number};user-type= :{user}!{user}@{user}.tmi.twitch.tv "
+                f"PRIVMSG #{channel} :{' '.join(words)}")
+
+
+class RecordedTraffic:
+    """Loops over raw IRC lines from a file, restamping tmi-sent-ts and channel.
+    
+    The file may be plain raw lines or a TrafficRecorder log.
+    """
+    
+    _TS_RE = re.compile(r'(?<=tmi-sent-ts=)\d+')
+    _CHANNEL_RE = re.compile(r' (PRIVMSG|USERNOTICE|CLEARCHAT|CLEARMSG) #[^ ]+')
+    
+    def __init__(self, path):
+        self._lines = [line for _, line in read_traffic_log(path) if not line.startswith('PING')]
+        if not self._lines:
+            raise ValueError(f"No lines in {path}")
+        self._index = 0
     
-    def chat_listener(self):
-        """Listen for chat messages in background thread."""
-        print("Chat listener thread started")
+    def next_line(self, channel, ts_ms):
+        """Return the next recorded line, retargeted to channel and sent at ts_ms."""
+        line = self._lines[self._index]
+        self._index = (self._index + 1) % len(self._lines)
+        line = self._TS_RE.sub(str(ts_ms), line, count=1)
+        return self._CHANNEL_RE.sub(lambda m: f" {m.group(1)} #{channel}", line, count=1)
+
+
+class FakeTwitchServer:
+    """Local stand-in for Twitch IRC that plays back traffic at a fixed rate.
+    
+    Each client gets its own playback of traffic (SyntheticTraffic or
+    RecordedTraffic) spread over the channels it has joined, paced in
+    FAKE_SERVER_TICK slices. The server also answers PINGs, sends its own
+    PING now and then, and can stop after a fixed number of messages.
+    With replay set, each client instead gets that traffic log played back
+    with its recorded timing (scaled by speed), channels unchanged.
+    
+    PRIVMSGs from clients are checked against Twitch's chat limits per
+    nick (the moderator limit if moderator is set, which is also announced
+    in USERSTATE). Messages over the limit are refused with Twitch's
+    msg_ratelimit NOTICE and counted in rate_violations; accepted ones
+    are kept in chat_received. The delay of every PONG to the server's
+    PINGs is kept in pong_delays.
+    
+    For testing reconnects, the times of every connection and JOIN are
+    kept in connect_times and joins, and the server can be told to drop
+    or RECONNECT its clients, ignore their PINGs, or close new
+    connections at once (refuse).
+    """
+    
+    def __init__(self, host='127.0.0.1', port=FAKE_SERVER_PORT, rate=100,
+                 traffic=None, limit=None, ping_every=1000, replay=None, speed=1.0,
+                 moderator=False, send_window=SEND_RATE_WINDOW):
+        self.host = host
+        self.port = port
+        self.rate = rate
+        self.traffic = traffic or SyntheticTraffic()
+        self.replay = replay
+        self.speed = speed
+        self.limit = limit
+        self.ping_every = ping_every
+        self.moderator = moderator
+        self.send_limit = SEND_RATE_LIMIT_MOD if moderator else SEND_RATE_LIMIT
+        self.send_window = send_window
+        self.sent = 0
+        self.clients = []
+        self.chat_received = []
+        self.rate_violations = 0
+        self.pong_delays = []
+        self.connect_times = []
+        self.joins = []
+        self.answer_pings = True
+        self.refuse = False
+        self._chat_times = {}
+        self._server = None
+    
+    async def start(self):
+        """Start listening; self.port is updated if port 0 was requested."""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+    
+    async def serve_forever(self):
+        """Start (if needed) and serve until cancelled."""
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+    
+    async def close(self):
+        """Stop accepting clients and drop the connected ones."""
+        if self._server:
+            self._server.close()
+        for writer in list(self.clients):
+            writer.close()
+    
+    def drop_clients(self):
+        """Cut every client's connection without a goodbye, like a network failure."""
+        for writer in list(self.clients):
+            writer.transport.abort()
+    
+    async def send_reconnect(self):
+        """Send Twitch's RECONNECT command to every client."""
+        for writer in list(self.clients):
+            writer.write(b":tmi.twitch.tv RECONNECT\r\n")
+            await writer.drain()
+    
+    async def _handle(self, reader, writer):
+        """Run one client session: registration, JOINs, PING/PONG, chat and playback."""
+        self.connect_times.append(time.monotonic())
+        if self.refuse:
+            writer.close()
+            return
+        self.clients.append(writer)
+        channels = []
+        pings = deque()
+        nick = 'chatreader'
+        playback = None
         try:
-            while self.connected:
-                if not self.sock:
-                    print("Socket is None, breaking")
+            while True:
+                line = await reader.readline()
+                if not line:
                     break
-                
-                print("Waiting for data from Twitch...")
-                resp = self.sock.recv(2048).decode('utf-8')
-                print(f"Received {len(resp)} characters from Twitch")
-                
-                if not resp:
-                    print("No response received from Twitch")
-                    break
-                
-                if resp.startswith('PING'):
-                    print("PING received, sending PONG")
-                    self.sock.send("PONG :tmi.twitch.tv\r\n".encode('utf-8'))
-                else:
-                    for line in resp.split('\r\n'):
-                        if not line:
-                            continue
-                        username, message, color = parse_message(line)
-                        if username and message:
-                            message = message.rstrip().replace('\uFFFD', '')
-                            self.root.after(0, self.add_message, username, message, color)
-                            if self.sound_enabled_var.get():
-                                try:
-                                    if username.lower() not in self.ignored_usernames:
-                                        play_sound()
-                                except Exception:
-                                    # Fallback to playing if any unexpected issue occurs
-                                    play_sound()
-                        elif 'PRIVMSG' in line:
-                            self.root.after(0, self.add_system_message,
-                                          f"DEBUG: Could not parse: {line[:50]}...")
-        except Exception as e:
-            print(f"Connection error: {e}")
-            if self.connected:
-                self.root.after(0, self.update_status, f"Connection error: {e}")
-                self.root.after(0, self.disconnect)
+                command, _, rest = line.decode('utf-8', 'replace').strip().partition(' ')
+                if command == 'NICK':
+                    nick = rest
+                    writer.write(f":tmi.twitch.tv 001 {rest} :Welcome, GLHF!\r\n".encode())
+                elif command == 'PING':
+                    if self.answer_pings:
+                        writer.write(f":tmi.twitch.tv PONG tmi.twitch.tv {rest}\r\n".encode())
+                elif command == 'PONG':
+                    if pings:
+                        self.pong_delays.append(time.monotonic() - pings.popleft())
+                elif command == 'JOIN':
+                    for channel in rest.split(','):
+                        channels.append(channel.lstrip('#'))
+                        self.joins.append((time.monotonic(), channel.lstrip('#')))
+                        writer.write(f":{nick}!{nick}@{nick}.tmi.twitch.tv JOIN {channel}\r\n"
+                                     f"@badges=;color=;display-name={nick};mod={int(self.moderator)} "
+                                     f":tmi.twitch.tv USERSTATE {channel}\r\n".encode())
+                    if playback is None:
+                        playback = asyncio.get_running_loop().create_task(
+                            self._replay(writer) if self.replay else self._playback(writer, channels, pings))
+                elif command == 'PRIVMSG':
+                    channel, _, text = rest.partition(' :')
+                    self._on_chat(writer, nick, channel, text)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if playback:
+                playback.cancel()
+            self.clients.remove(writer)
+            writer.close()
     
-    def on_closing(self):
-        """Handle window close event - save settings and disconnect."""
-        try:
-            self.save_settings()
-            if self.connected:
-                self.disconnect()
-            self.root.destroy()
-        except Exception as e:
-            print(f"Error during shutdown: {e}")
-            self.root.destroy()
+    def _on_chat(self, writer, nick, channel, text):
+        """Accept a client's PRIVMSG, or refuse it if it breaks the chat rate limit."""
+        now = time.monotonic()
+        times = self._chat_times.setdefault(nick, deque())
+        while times and now - times[0] >= self.send_window:
+            times.popleft()
+        if len(times) >= self.send_limit:
+            self.rate_violations += 1
+            log.warning("fake server: %s sent more than %d messages in %gs",
+                        nick, self.send_limit, self.send_window)
+            writer.write(f"@msg-id=msg_ratelimit :tmi.twitch.tv NOTICE {channel} :Your message was "
+                         f"not sent because you are sending messages too quickly.\r\n".encode())
+            return
+        times.append(now)
+        self.chat_received.append((now, channel.lstrip('#'), text))
     
-    def run(self):
-        """Start the GUI event loop."""
-        self.root.mainloop()
+    async def _playback(self, writer, channels, pings):
+        """Send traffic at self.rate messages per second until the limit."""
+        started = time.monotonic()
+        sent = 0
+        while self.limit is None or sent < self.limit:
+            due = int((time.monotonic() - started) * self.rate) + 1
+            if self.limit is not None:
+                due = min(due, self.limit)
+            ts_ms = int(time.time() * 1000)
+            lines = []
+            for i in range(sent, due):
+                lines.append(self.traffic.next_line(channels[i % len(channels)], ts_ms))
+                if self.ping_every and i % self.ping_every == self.ping_every - 1:
+                    lines.append("PING :tmi.twitch.tv")
+                    pings.append(time.monotonic())
+            if lines:
+                writer.write(("\r\n".join(lines) + "\r\n").encode('utf-8'))
+                self.sent += due - sent
+                sent = due
+                await writer.drain()
+            await asyncio.sleep(FAKE_SERVER_TICK)
+    
+    async def _replay(self, writer):
+        """Send a traffic log to one client with its recorded timing."""
+        started = time.monotonic()
+        pending = []
+        
+        async def flush():
+            writer.write(("\r\n".join(pending) + "\r\n").encode('utf-8'))
+            self.sent += len(pending)
+            pending.clear()
+            await writer.drain()
+        
+        for due, line in paced_replay(self.replay, self.speed):
+            delay = started + due - time.monotonic()
+            if delay > 0:
+                if pending:
+                    await flush()
+                await asyncio.sleep(delay)
+            pending.append(line)
+            if len(pending) >= 1000:
+                await flush()
+        if pending:
+            await flush()
 
 
-def play_sound():
-    """Play notification sound using the global sound manager."""
-    sound_manager.play_sound()
+def _run_fake_server(port, rate, limit, traffic_path, ready):
+    """Process entry point for a FakeTwitchServer (used by the bench suite)."""
+    async def serve():
+        traffic = RecordedTraffic(traffic_path) if traffic_path else SyntheticTraffic()
+        server = FakeTwitchServer(port=port, rate=rate, traffic=traffic, limit=limit)
+        await server.start()
+        ready.put(server.port)
+        await server.serve_forever()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+def _rss_bytes():
+    """Current resident set size in bytes, or None where it cannot be read."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return float('nan')
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
 
+def _bench_lines(lines, traffic_path=None):
+    """Return lines raw IRC lines of synthetic traffic, or the first lines of a traffic log."""
+    if traffic_path:
+        raw = []
+        for _, line in read_traffic_log(traffic_path):
+            raw.append(line)
+            if len(raw) >= lines:
+                break
+        return raw
+    traffic = SyntheticTraffic(seed=1)
+    ts_ms = int(time.time() * 1000)
+    return [traffic.next_line('bench', ts_ms) for _ in range(lines)]
 
-def connect_to_twitch_ssl(token, channel):
-    """Connect to Twitch IRC with SSL and tags capability for colors.
+
+def bench_framing(lines=200000, traffic_path=None):
+    """Benchmark IrcLineFramer against the receive loop it replaced, over a socketpair.
     
-    Args:
-        token: OAuth token for authentication.
-        channel: Channel to join (without leading '#').
+    The old loop decoded each recv(2048) on its own and split it on CRLF,
+    so lines and multibyte characters that straddle two reads came out
+    broken (strict decoding raised; here those reads are decoded with
+    replacement so the run can continue and the damage is counted).
     
     Returns:
-        A connected SSL socket object.
+        Dict per reader ('old', 'framer') with lines yielded, lines
+        intact, reads that failed to decode, and lines per second.
     """
-    context = ssl.create_default_context()
+    raw = _bench_lines(lines, traffic_path)
+    expected = set(raw)
+    payload = ("\r\n".join(raw) + "\r\n").encode('utf-8')
     
-    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    sock = context.wrap_socket(sock, server_hostname='irc.chat.twitch.tv')
-    sock.connect(('irc.chat.twitch.tv', 6697))
+    def old_lines(sock, counts):
+        while True:
+            data = sock.recv(2048)
+            if not data:
+                return
+            try:
+                text = data.decode('utf-8')
+            except UnicodeDecodeError:
+                counts['decode_errors'] += 1
+                text = data.decode('utf-8', errors='replace')
+            for line in text.split('\r\n'):
+                if line:
+                    yield line
     
-    commands = [
-        f"PASS {token}",
-        "NICK chatreader",
-        "CAP REQ :twitch.tv/membership twitch.tv/tags twitch.tv/commands",
-        "CAP END",
-        f"JOIN #{channel}"
-    ]
+    def framer_lines(sock, counts):
+        return IrcLineFramer().read_lines(sock)
     
-    for cmd in commands:
-        sock.send(f"{cmd}\r\n".encode('utf-8'))
+    def send(sock):
+        sock.sendall(payload)
+        sock.close()
     
-    return sock
+    results = {}
+    for name, reader in (('old', old_lines), ('framer', framer_lines)):
+        receiver, sender = socket.socketpair()
+        writer = threading.Thread(target=send, args=(sender,), daemon=True)
+        counts = {'lines': 0, 'intact': 0, 'decode_errors': 0}
+        started = time.perf_counter()
+        writer.start()
+        for line in reader(receiver, counts):
+            counts['lines'] += 1
+            if line in expected:
+                counts['intact'] += 1
+        elapsed = time.perf_counter() - started
+        writer.join()
+        receiver.close()
+        counts['lines_per_sec'] = counts['lines'] / elapsed
+        results[name] = counts
+    results['sent'] = len(raw)
+    return results
 
 
-def parse_message(irc_message):
-    """Parse a raw IRC message and extract username, message text, and color.
-    
-    Args:
-        irc_message: Raw IRC message string.
+def _old_parse_message(irc_message):
+    """The regex parser parse_irc_line replaced, kept as bench_parse's baseline.
     
-    Returns:
-        Tuple of (username, message, color) if a user message, else (None, None, None).
+    Returns (display name, text, color) for a PRIVMSG, else (None, None, None).
     """
-    # Parse PRIVMSG with color information (with @tags)
     match = re.match(r'^@([^ ]+) :([^!]+)!.* PRIVMSG #[^ ]+ :(.*)', irc_message)
     if match:
         tags = match.group(1)
@@ -574,7 +4966,6 @@ def parse_message(irc_message):
         
         return display_name, message, color
     
-    # Parse PRIVMSG without @tags (fallback)
     match = re.match(r'^:([^!]+)!.* PRIVMSG #[^ ]+ :(.*)', irc_message)
     if match:
         username = match.group(1)
@@ -584,28 +4975,1432 @@ def parse_message(irc_message):
     return None, None, None
 
 
-def signal_handler(signum, frame):
-    """Handle termination signals to save settings before exit."""
-    print("\nSaving settings before exit...")
+def bench_parse(lines=200000, traffic_path=None):
+    """Benchmark framing plus parsing, and parsing alone against the old parse_message.
+    
+    Returns:
+        Dict with the line count, lines and MB per second through framer
+        and parser, and lines per second through parse_irc_line alone
+        (reading display name and color) and through the old regex parser.
+    """
+    raw = _bench_lines(lines, traffic_path)
+    payload = ("\r\n".join(raw) + "\r\n").encode()
+    chunks = [payload[i:i + RECV_BUFFER_SIZE] for i in range(0, len(payload), RECV_BUFFER_SIZE)]
+    
+    framer = IrcLineFramer()
+    parsed = 0
+    started = time.perf_counter()
+    for chunk in chunks:
+        for line in framer.feed(chunk):
+            msg = parse_irc_line(line) if line else None
+            if msg is not None:
+                msg.display_name, msg.color
+                parsed += 1
+    elapsed = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    for line in raw:
+        msg = parse_irc_line(line)
+        if msg is not None:
+            msg.display_name, msg.text, msg.color
+    parse_elapsed = time.perf_counter() - started
+    started = time.perf_counter()
+    for line in raw:
+        _old_parse_message(line)
+    old_elapsed = time.perf_counter() - started
+    return {'lines': parsed, 'lines_per_sec': parsed / elapsed, 'mb_per_sec': len(payload) / elapsed / 1e6,
+            'parse_lines_per_sec': len(raw) / parse_elapsed, 'old_lines_per_sec': len(raw) / old_elapsed}
+
+
+def bench_pipeline(rate=1000, duration=10.0, gui=False, traffic_path=None,
+                   queue_size=RENDER_QUEUE_SIZE, fps=RENDER_FPS):
+    """Benchmark the full pipeline against a FakeTwitchServer in a child process.
+    
+    Messages flow server -> IrcClient -> RenderQueue -> render tick. With gui
+    the tick renders into a real ChatView; otherwise it formats each record
+    the way ChatView does, without Tk.
+    
+    Returns:
+        Dict with sent/rendered/dropped counts, ingest-to-display latency
+        percentiles in milliseconds, and RSS growth in bytes.
+    """
+    import multiprocessing
+    limit = int(rate * duration)
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_run_fake_server,
+                                     args=(0, rate, limit, traffic_path, ready), daemon=True)
+    server.start()
+    port = ready.get(timeout=30)
+    
+    queue = RenderQueue(queue_size)
+    latencies = []
+    done = threading.Event()
+    
+    def on_message(msg):
+        if msg.command in ('PRIVMSG', 'USERNOTICE'):
+            queue.put(ChatRecord('chat', time.time(), msg.display_name, msg.text or '', msg.color))
+    
+    loop_thread = AsyncLoopThread()
+    client = IrcClient('oauth:bench', on_message, lambda *args: None,
+                       host='127.0.0.1', port=port, use_tls=False)
+    client.channels.append('bench')
+    loop_thread.call(client.start)
+    
+    if gui:
+        _import_tk()
+        root = tk.Tk()
+        view = ChatView(root)
+        view.widget.frame.pack(fill=tk.BOTH, expand=True)
+        render = view.render
+    else:
+        root = None
+        
+        def render(records):
+            "".join(f"[{datetime.fromtimestamp(record.ts).strftime('%H:%M:%S')}] "
+                    f"{record.username}: {record.text}\n" for record in records)
+    
+    rss_before = _rss_bytes()
+    deadline = time.monotonic() + duration + 3.0
+    interval = 1.0 / fps
+    while time.monotonic() < deadline and not done.is_set():
+        tick_started = time.monotonic()
+        records, _ = queue.drain()
+        if records:
+            render(records)
+            now = time.time()
+            latencies.extend(now - record.ts for record in records)
+        if root is not None:
+            root.update()
+        if len(latencies) + queue.dropped >= limit:
+            done.set()
+        time.sleep(max(0.0, interval - (time.monotonic() - tick_started)))
+    rss_after = _rss_bytes()
+    
+    loop_thread.submit(client.close()).result(timeout=5)
+    loop_thread.stop()
+    server.terminate()
+    if root is not None:
+        root.destroy()
+    
+    latencies.sort()
+    return {
+        'sent': limit,
+        'rendered': len(latencies),
+        'dropped': limit - len(latencies),
+        'queue_dropped': queue.dropped,
+        'latency_ms': {name: _percentile(latencies, fraction) * 1000
+                       for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))},
+        'rss_growth': (rss_after - rss_before) if rss_before is not None else None,
+    }
+
+
+def bench_ingest(rate=1000, duration=10.0, gui=False, fps=RENDER_FPS):
+    """Compare UI frame times with ingestion on a thread and in an IngestProcess.
+    
+    Both modes read a FakeTwitchServer flood and render at fps on the main
+    thread, which stands in for the Tk thread. In 'thread' mode a
+    ConnectionPool reads and parses on an AsyncLoopThread that shares the
+    GIL with the frames; in 'process' mode each frame drains the ring of
+    an IngestProcess. With gui the frames render into a real ChatView.
+    
+    Returns:
+        Dict of results per mode: frames, frame work and frame interval
+        percentiles in milliseconds, and messages delivered and dropped.
+    """
+    import multiprocessing
+    limit = int(rate * duration)
+    interval = 1.0 / fps
+    
+    if gui:
+        _import_tk()
+        root = tk.Tk()
+    else:
+        root = None
+    
+    def run(mode):
+        ready = multiprocessing.Queue()
+        server = multiprocessing.Process(target=_run_fake_server,
+                                         args=(0, rate, limit, None, ready), daemon=True)
+        server.start()
+        port = ready.get(timeout=30)
+        endpoint = {'host': '127.0.0.1', 'port': port, 'use_tls': False}
+        queue = RenderQueue()
+        
+        def on_message(msg):
+            if msg.command in ('PRIVMSG', 'USERNOTICE'):
+                queue.put(ChatRecord('chat', time.time(), msg.display_name, msg.text or '', msg.color))
+        
+        if mode == 'thread':
+            loop_thread = AsyncLoopThread()
+            ingest = None
+            pool = ConnectionPool('oauth:bench', on_message, lambda status: None, loop_thread,
+                                  **endpoint)
+            pool.start(['bench'])
+        else:
+            ingest = IngestProcess('oauth:bench', ['bench'], endpoint=endpoint)
+            ingest.start()
+        
+        if root is not None:
+            view = ChatView(root)
+            view.widget.frame.pack(fill=tk.BOTH, expand=True)
+            render = view.render
+        else:
+            view = None
+            
+            def render(records):
+                "".join(f"[{datetime.fromtimestamp(record.ts).strftime('%H:%M:%S')}] "
+                        f"{record.username}: {record.text}\n" for record in records)
+        
+        work, gaps = [], []
+        delivered = 0
+        last = None
+        deadline = time.monotonic() + duration + 5.0
+        while time.monotonic() < deadline and delivered + queue.dropped < limit:
+            started = time.monotonic()
+            if last is not None:
+                gaps.append(started - last)
+            last = started
+            if ingest is not None:
+                for item in ingest.drain():
+                    if isinstance(item, IrcMessage):
+                        on_message(item)
+            records, _ = queue.drain()
+            if records:
+                render(records)
+                delivered += len(records)
+            if root is not None:
+                root.update()
+            work.append(time.monotonic() - started)
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+        
+        if ingest is not None:
+            ring_dropped = ingest.ring.dropped
+            ingest.close()
+        else:
+            ring_dropped = 0
+            loop_thread.submit(pool.close_async()).result(timeout=5)
+            loop_thread.stop()
+        server.terminate()
+        if view is not None:
+            view.widget.frame.destroy()
+        work.sort()
+        gaps.sort()
+        return {
+            'frames': len(work),
+            'work_ms': {name: _percentile(work, fraction) * 1000
+                        for name, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1.0))},
+            'interval_ms': {name: _percentile(gaps, fraction) * 1000
+                            for name, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1.0))},
+            'delivered': delivered,
+            'dropped': queue.dropped + ring_dropped,
+        }
+    
     try:
-        if hasattr(signal_handler, 'chat_window') and signal_handler.chat_window:
-            signal_handler.chat_window.save_settings()
-            if signal_handler.chat_window.connected:
-                signal_handler.chat_window.disconnect()
-    except Exception as e:
-        print(f"Error saving settings during shutdown: {e}")
-    sys.exit(0)
+        return {mode: run(mode) for mode in ('thread', 'process')}
+    finally:
+        if root is not None:
+            root.destroy()
+
+
+def _startup_probe(port, settings_path, gui, deferred):
+    """Child process body for bench_startup: start up and exit on the first message.
+    
+    Prints a JSON line of time.perf_counter() stamps, which share one clock
+    across processes, for when the window was built (GUI only) and when
+    the first chat message was received (headless) or drawn (GUI).
+    """
+    stamps = {}
+    
+    def report():
+        print(json.dumps(stamps), flush=True)
+        os._exit(0)
+    
+    if not gui:
+        loop_thread = AsyncLoopThread()
+        
+        def on_message(msg):
+            if msg.command == 'PRIVMSG':
+                stamps['first_message'] = time.perf_counter()
+                report()
+        pool = ConnectionPool('oauth:bench', on_message, lambda status: None, loop_thread,
+                              host='127.0.0.1', port=port, use_tls=False)
+        pool.start(['bench'])
+        threading.Event().wait()
+    
+    window = ChatWindow({'host': '127.0.0.1', 'port': port, 'use_tls': False},
+                        settings_path=settings_path)
+    stamps['window'] = time.perf_counter()
+    if deferred:
+        window.root.after(1000, window.connect)
+    
+    def poll():
+        if metrics.messages_rendered:
+            window.root.update_idletasks()
+            stamps['first_message'] = time.perf_counter()
+            report()
+        window.root.after(1, poll)
+    poll()
+    window.run()
+
+
+def bench_startup(runs=5, gui=False):
+    """Measure cold start: time from launching the app to its first chat message.
+    
+    Each run starts a fresh interpreter that imports the app and connects to
+    a FakeTwitchServer (plain TCP, so without a TLS handshake). Headless
+    runs stop when the first message is received. GUI runs stop when it
+    has been drawn, once as the app starts now and once 'deferred', the
+    way it used to: build the whole window, then connect a second later.
+    
+    Returns:
+        Dict mapping each mode to median milliseconds from launch until
+        the module was imported, the window was built and the first
+        message arrived.
+    """
+    import multiprocessing
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_run_fake_server,
+                                     args=(0, 100, None, None, ready), daemon=True)
+    server.start()
+    port = ready.get(timeout=30)
+    
+    directory = tempfile.mkdtemp(prefix='startup-')
+    settings_file = os.path.join(directory, SETTINGS_FILE)
+    modes = [('headless', False, False)]
+    if gui:
+        modes += [('gui', True, False), ('gui deferred', True, True)]
+    results = {}
+    try:
+        for name, mode_gui, deferred in modes:
+            with open(settings_file, 'w') as f:
+                json.dump({'channel': 'bench', 'token': 'oauth:bench', 'auto_connect': not deferred,
+                           'sound_enabled': False, 'emotes': False}, f)
+            code = ("import sys, time; "
+                    f"sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r}); "
+                    "import BetterTwitchChat as app; print(time.perf_counter(), flush=True); "
+                    f"app._startup_probe({port}, {settings_file!r}, {mode_gui}, {deferred})")
+            timings = {'imported': [], 'window': [], 'first_message': []}
+            for _ in range(runs):
+                started = time.perf_counter()
+                child = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                                       text=True, timeout=60)
+                lines = child.stdout.split('\n')
+                if child.returncode != 0 or len(lines) < 2:
+                    raise RuntimeError(f"startup probe failed: {child.stderr.strip()[-500:]}")
+                stamps = json.loads(lines[1])
+                stamps['imported'] = float(lines[0])
+                for key, stamp in stamps.items():
+                    timings[key].append((stamp - started) * 1000)
+            results[name] = {key: sorted(values)[len(values) // 2] if values else None
+                             for key, values in timings.items()}
+    finally:
+        server.terminate()
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def _run_overlay_clients(port, clients, stuck, ready, stop, results):
+    """Process entry point: hold overlay event streams open and report what arrived.
+    
+    Stuck clients send their request and then never read, with a tiny
+    receive buffer so the server sees them back up almost at once.
+    """
+    received_re = re.compile(rb'"received":([0-9.]+)}')
+    counts = [0] * clients
+    latencies = []
+    
+    async def open_stream(small_buffer):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if small_buffer:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+        sock.setblocking(False)
+        await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+        reader, writer = await asyncio.open_connection(sock=sock)
+        writer.write(b"GET /events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        await writer.drain()
+        return reader, writer
+    
+    async def healthy(index, reader):
+        await reader.readuntil(b'\r\n\r\n')
+        while True:
+            chunk = await reader.read(65536)
+            if not chunk:
+                return
+            counts[index] += chunk.count(b'data: ')
+            last = received_re.findall(chunk)
+            if last:
+                latencies.append(time.time() - float(last[-1]))
+    
+    async def main():
+        tasks = []
+        writers = []
+        for index in range(clients):
+            reader, writer = await open_stream(index < stuck)
+            writers.append(writer)
+            if index >= stuck:
+                tasks.append(asyncio.get_running_loop().create_task(healthy(index, reader)))
+        ready.set()
+        while not stop.is_set():
+            await asyncio.sleep(0.1)
+        for task in tasks:
+            task.cancel()
+        for writer in writers:
+            writer.close()
+    
+    asyncio.run(main())
+    results.put({'counts': counts[stuck:], 'latencies': latencies})
+
+
+def bench_overlay(clients=300, stuck=30, rate=200, duration=5.0):
+    """Load test the OverlayServer with many clients, some of them stuck.
+    
+    The server runs on this process's event loop and publishes synthetic
+    messages in 10 ms batches, as the IRC reader would; the clients run in
+    a child process.
+    
+    Returns:
+        Dict with the number published, the share each reading client
+        received (min and mean), their delivery latency percentiles in
+        milliseconds, how many messages the furthest-behind stuck client
+        is missing (it will get at most the newest buffer_size), messages
+        skipped so far, publish() cost per message in microseconds and the
+        publisher's worst tick lag.
+    """
+    import multiprocessing
+    traffic = SyntheticTraffic(seed=7)
+    messages = [parse_irc_line(traffic.next_line('bench', 0)) for _ in range(1000)]
+    ready = multiprocessing.Event()
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    
+    async def run():
+        server = OverlayServer(0)
+        await server.start()
+        # Small send buffers, inherited by accepted sockets, make stuck clients
+        # back up within the run instead of disappearing into kernel buffers
+        server._server.sockets[0].setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 16384)
+        child = multiprocessing.Process(target=_run_overlay_clients,
+                                        args=(server.port, clients, stuck, ready, stop, results),
+                                        daemon=True)
+        child.start()
+        loop = asyncio.get_running_loop()
+        while not ready.is_set():
+            await asyncio.sleep(0.05)
+        while len(server.clients) < clients:
+            await asyncio.sleep(0.05)
+        
+        tick = 0.01
+        publish_time = 0.0
+        published = 0
+        worst_lag = 0.0
+        started = loop.time()
+        next_tick = started
+        while next_tick - started < duration:
+            worst_lag = max(worst_lag, loop.time() - next_tick)
+            due = int((next_tick - started + tick) * rate) - published
+            # CPU time, so the client process running on the same cores doesn't count
+            publish_started = time.thread_time()
+            for _ in range(due):
+                server.publish(messages[published % len(messages)])
+                published += 1
+            publish_time += time.thread_time() - publish_started
+            next_tick += tick
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+        await asyncio.sleep(1.0)
+        stop.set()
+        # Stuck clients are still blocked in drain(), so they haven't
+        # noticed yet that they fell behind; count what they are missing
+        behind = [server.published - client.cursor for client in server.clients]
+        report = await loop.run_in_executor(None, results.get, True, 30)
+        child.join(5)
+        await server.close()
+        report['stuck_behind'] = max(behind, default=0)
+        return server, published, publish_time, worst_lag, report
+    
+    server, published, publish_time, worst_lag, report = asyncio.run(run())
+    shares = [count / published for count in report['counts']] or [0.0]
+    latencies = sorted(report['latencies'])
+    return {
+        'published': published,
+        'clients': clients,
+        'stuck': stuck,
+        'min_share': min(shares),
+        'mean_share': sum(shares) / len(shares),
+        'latency_ms': {name: _percentile(latencies, fraction) * 1000
+                       for name, fraction in (('p50', 0.5), ('p99', 0.99), ('max', 1.0))},
+        'stuck_behind': report['stuck_behind'],
+        'dropped': server.dropped,
+        'publish_us': publish_time / max(1, published) * 1e6,
+        'worst_lag_ms': worst_lag * 1000,
+    }
+
+
+def bench_filters(rule_counts=(0, 10, 100, 1000), messages=20000):
+    """Benchmark per-message FilterRules cost as the rule list grows.
+    
+    Each rule list mixes user names, wildcards, regexes and keywords of
+    every kind. For comparison, the same rules are also checked one by
+    one with a regex each, the way a naive filter would.
+    
+    Returns:
+        List of dicts with the rule count and the compiled and per-rule
+        cost in microseconds per message.
+    """
+    traffic = SyntheticTraffic(seed=4)
+    samples = []
+    for _ in range(messages):
+        msg = parse_irc_line(traffic.next_line('bench', 0))
+        samples.append((msg.user or msg.get_tag('login'), msg.display_name, msg.text or ''))
+    rng = random.Random(5)
+    kinds = ('{}', 'hide:{}', 'word:{}', 'hideword:{}', 'highlight:{}')
+    results = []
+    for count in rule_counts:
+        rules = []
+        for i in range(count):
+            word = ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 10)))
+            if i % 10 == 8:
+                word = word[:3] + '*'
+            elif i % 10 == 9:
+                word = f'/{word[:4]}\\d+/'
+            rules.append(kinds[i % len(kinds)].format(word))
+        compiled = FilterRules(rules)
+        check = compiled.check
+        started = time.perf_counter()
+        for login, display_name, text in samples:
+            check(login, display_name, text)
+        compiled_us = (time.perf_counter() - started) / messages * 1e6
+        
+        naive = []
+        for rule in compiled.rules:
+            single = FilterRules([rule])
+            naive.append(single.check)
+        started = time.perf_counter()
+        for login, display_name, text in samples:
+            for rule_check in naive:
+                if rule_check(login, display_name, text) & FilterRules.HIDE:
+                    break
+        naive_us = (time.perf_counter() - started) / messages * 1e6
+        results.append({'rules': count, 'compiled_us': compiled_us, 'per_rule_us': naive_us})
+    return results
+
+
+class _TagCountingWidget:
+    """Stands in for a Text widget in bench_colors: keeps tag configuration, draws nothing."""
+    
+    def __init__(self):
+        self.tags = {}
+    
+    def tag_configure(self, tag, **options):
+        self.tags.setdefault(tag, {}).update(options)
+    
+    def tag_names(self):
+        return tuple(self.tags)
+    
+    def config(self, **options):
+        pass
+    
+    def insert(self, index, *args):
+        pass
+    
+    def see(self, index):
+        pass
+
+
+def bench_colors(chatter_counts=(100, 1000, 10000, 100000), messages=200000, gui=False):
+    """Benchmark name coloring by number of distinct chatters, against one tag per username.
+    
+    Every chatter has their own random color. The baseline is the old
+    add_message: tag_configure a 'user_<name>' tag on every message. With
+    gui both render into a real Tk view, the new path through ChatView;
+    otherwise both run against a widget stub that only keeps the tags.
+    
+    Returns:
+        List of dicts with the chatter count, microseconds per message and
+        tags created for the pooled tags and for the old per-user tags.
+    """
+    rng = random.Random(5)
+    if gui:
+        _import_tk()
+        root = tk.Tk()
+        messages = min(messages, 20000)
+    else:
+        root = None
+    results = []
+    try:
+        for chatters in chatter_counts:
+            users = [(f"viewer{i}", f"#{rng.randrange(1 << 24):06X}") for i in range(chatters)]
+            picks = [users[rng.randrange(chatters)] for _ in range(messages)]
+            records = [ChatRecord('chat', time.time(), name, "hello chat", color)
+                       for name, color in picks]
+            result = {'chatters': chatters}
+            
+            if gui:
+                view = ChatView(root, scrollback_lines=messages)
+                started = time.perf_counter()
+                for i in range(0, messages, 100):
+                    view.render(records[i:i + 100])
+                root.update()
+                result['pooled_us'] = (time.perf_counter() - started) / messages * 1e6
+                result['pooled_tags'] = len(view.color_tags)
+                view.widget.frame.destroy()
+                widget = scrolledtext.ScrolledText(root)
+            else:
+                pool = ColorTagPool(_TagCountingWidget())
+                tag_for = pool.tag_for
+                started = time.perf_counter()
+                for record in records:
+                    tag_for(record.color)
+                result['pooled_us'] = (time.perf_counter() - started) / messages * 1e6
+                result['pooled_tags'] = len(pool)
+                widget = _TagCountingWidget()
+            
+            started = time.perf_counter()
+            for i in range(0, messages, 100):
+                widget.config(state='normal')
+                for record in records[i:i + 100]:
+                    tag_name = f"user_{record.username}"
+                    widget.tag_configure(tag_name, foreground=record.color, font=("Consolas", 10, "bold"))
+                    widget.insert('end', f"{record.username}: ", tag_name, f"{record.text}\n", "message")
+                widget.config(state='disabled')
+                widget.see('end')
+            if gui:
+                root.update()
+            result['per_user_us'] = (time.perf_counter() - started) / messages * 1e6
+            result['per_user_tags'] = len([tag for tag in widget.tag_names() if tag.startswith('user_')])
+            if gui:
+                widget.frame.destroy()
+            results.append(result)
+    finally:
+        if root is not None:
+            root.destroy()
+    return results
+
+
+def bench_scrollback(messages=1000000, scrollback=SCROLLBACK_LINES, batch=100, gui=False):
+    """Soak the scrollback: render messages in batches and watch memory and insert time.
+    
+    With gui the records go through a real ChatView. Otherwise they go
+    through the view's bookkeeping without Tk: the LineIndex, plus a deque
+    of formatted lines standing in for the Text widget, trimmed by the same
+    10% overshoot rule.
+    
+    Returns:
+        Dict with the scrollback size and a list of ten samples, each with
+        the messages rendered so far, mean and worst per-message insert
+        time in microseconds over the batches since the previous sample,
+        and RSS in bytes (None where it cannot be read).
+    """
+    rng = random.Random(4)
+    chatters = [(f"viewer{i}", f"#{rng.randrange(1 << 24):06X}") for i in range(5000)]
+    texts = [" ".join(rng.choice(_FAKE_WORDS) for _ in range(rng.randint(3, 12))) for _ in range(1000)]
+    if gui:
+        _import_tk()
+        root = tk.Tk()
+        view = ChatView(root, scrollback_lines=scrollback)
+        view.widget.frame.pack(fill=tk.BOTH, expand=True)
+        render = view.render
+    else:
+        root = None
+        lines = deque()
+        index = LineIndex()
+        added = 0
+        
+        def render(records):
+            nonlocal added
+            for record in records:
+                added += 1
+                lines.append(f"[{datetime.fromtimestamp(record.ts).strftime('%H:%M:%S')}] "
+                             f"{record.username}: {record.text}\n")
+                index.add(added, record.msg_id, record.user)
+            excess = len(lines) - scrollback
+            if excess > max(100, scrollback // 10):
+                for _ in range(excess):
+                    lines.popleft()
+                index.prune(added - len(lines) + 1)
+    
+    samples = []
+    every = max(batch, messages // 10)
+    times = []
+    now = time.time()
+    try:
+        for start in range(0, messages, batch):
+            records = []
+            for i in range(start, min(messages, start + batch)):
+                user, color = chatters[i % len(chatters)]
+                records.append(ChatRecord('chat', now, user, texts[i % len(texts)], color,
+                                          msg_id=f"{i:08x}-4000-8000", user=user))
+            started = time.perf_counter()
+            render(records)
+            if root is not None:
+                root.update()
+            times.append((time.perf_counter() - started) / len(records))
+            done = start + len(records)
+            if done % every == 0 or done == messages:
+                samples.append({'messages': done, 'insert_us': sum(times) / len(times) * 1e6,
+                                'worst_us': max(times) * 1e6, 'rss': _rss_bytes()})
+                times = []
+    finally:
+        if root is not None:
+            root.destroy()
+    return {'scrollback': scrollback, 'samples': samples}
+
+
+def bench_moderation(scrollbacks=(5000, 50000, 500000), events=20000, chatters=5000):
+    """Benchmark finding the lines a CLEARMSG or CLEARCHAT applies to.
+    
+    Fills a LineIndex as a view with each scrollback size would, then
+    times message-id and per-user lookups plus pruning, against a scan of
+    the scrollback for the same message id.
+    
+    Returns:
+        List of dicts with the scrollback size and microseconds per
+        CLEARMSG lookup, per CLEARCHAT lookup (including walking the
+        user's lines, user_lines on average), per pruned line, and per
+        scanning lookup.
+    """
+    rng = random.Random(6)
+    results = []
+    for scrollback in scrollbacks:
+        index = LineIndex()
+        store = deque(maxlen=scrollback)
+        for line in range(1, scrollback + 1):
+            user = f"viewer{int(rng.paretovariate(1.2)) % chatters}"
+            msg_id = f"{line:08x}-4000-8000"
+            index.add(line, msg_id, user)
+            store.append(ChatRecord('chat', 0, user, '', msg_id=msg_id, user=user))
+        ids = [f"{rng.randint(1, scrollback):08x}-4000-8000" for _ in range(events)]
+        # Heavy chatters own a large share of the scrollback, so bans walk far more lines
+        users = [f"viewer{int(rng.paretovariate(1.2)) % chatters}" for _ in range(events // 20)]
+        
+        started = time.perf_counter()
+        for msg_id in ids:
+            index.line_for(msg_id)
+        clearmsg_us = (time.perf_counter() - started) / events * 1e6
+        user_lines = 0
+        started = time.perf_counter()
+        for user in users:
+            for line in index.lines_for(user):
+                user_lines += 1
+        clearchat_us = (time.perf_counter() - started) / len(users) * 1e6
+        
+        scans = max(1, min(events, 2000000 // scrollback))
+        started = time.perf_counter()
+        for msg_id in ids[:scans]:
+            for record in store:
+                if record.msg_id == msg_id:
+                    break
+        scan_us = (time.perf_counter() - started) / scans * 1e6
+        
+        started = time.perf_counter()
+        index.prune(scrollback // 2)
+        prune_us = (time.perf_counter() - started) / max(1, scrollback // 2) * 1e6
+        results.append({'scrollback': scrollback, 'clearmsg_us': clearmsg_us,
+                        'clearchat_us': clearchat_us, 'user_lines': user_lines / len(users),
+                        'prune_us': prune_us, 'scan_us': scan_us})
+    return results
+
+
+def bench_stats(messages=300000, chatters=100000):
+    """Benchmark ChatStats against exact counting on a skewed synthetic stream.
+    
+    Returns:
+        Dict with the per-message add() cost in microseconds, memory of the
+        sketches and of exact dicts after the whole stream, the error of the
+        distinct-chatter estimate, and how many of the true top 10 chatters
+        the sketch ranks in its top 10 with their exact counts.
+    """
+    import tracemalloc
+    rng = random.Random(9)
+    users = [f"user{int(rng.paretovariate(1.2)) % chatters}" if rng.random() < 0.5
+             else f"user{rng.randrange(chatters)}" for _ in range(messages)]
+    
+    stats = ChatStats()
+    started = time.perf_counter()
+    for i, user in enumerate(users):
+        stats.add(user, i * 0.001)
+    add_us = (time.perf_counter() - started) / messages * 1e6
+    snapshot = stats.snapshot(messages * 0.001)
+    
+    exact = {}
+    for user in users:
+        exact[user] = exact.get(user, 0) + 1
+    true_top = sorted(exact.items(), key=lambda item: item[1], reverse=True)[:STATS_TOP_SHOWN]
+    sketch_top = {login: count for login, count, error in snapshot['top'] if error == 0}
+    
+    def traced(build):
+        tracemalloc.start()
+        built = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del built
+        return size
+    
+    def build_sketch():
+        sketch = ChatStats()
+        for i, user in enumerate(users):
+            sketch.add(user, i * 0.001)
+        return sketch
+    
+    def build_exact():
+        counts = {}
+        seen = set()
+        for user in users:
+            counts[user] = counts.get(user, 0) + 1
+            seen.add(user)
+        return counts, seen
+    
+    return {
+        'messages': messages,
+        'distinct': len(exact),
+        'add_us': add_us,
+        'estimate_error': snapshot['chatters'] / len(exact) - 1,
+        'top_exact': sum(1 for login, count in true_top if sketch_top.get(login) == count),
+        'sketch_bytes': traced(build_sketch),
+        'exact_bytes': traced(build_exact),
+    }
+
+
+def _make_png(width, height, rgb):
+    """Encode a solid-color RGB PNG, for synthetic emotes."""
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    raw = b''.join(b'\x00' + bytes(rgb) * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def bench_emotes(distinct=5000, messages=2000, gui=False):
+    """Benchmark emote loading, memory use and, with gui, rendering.
+    
+    Serves `distinct` synthetic 28x28 PNG emotes from a temporary
+    directory through an EmoteCache with a temporary disk cache: first
+    cold (fetch and store), then warm from disk. With gui, the same
+    messages are also rendered into a real ChatView with and without
+    emotes; otherwise images are kept as their base64 data.
+    
+    Returns:
+        Dict with cold and warm load rates in emotes/s, images held in
+        memory, RSS growth in bytes and, with gui, render cost in
+        microseconds per message with and without emotes.
+    """
+    rng = random.Random(8)
+    source = tempfile.mkdtemp(prefix='emotes-src-')
+    cache_dir = tempfile.mkdtemp(prefix='emotes-cache-')
+    root = None
+    try:
+        ids = [f"emotesv2_{i:06x}" for i in range(distinct)]
+        for emote_id in ids:
+            with open(os.path.join(source, f"{emote_id}.png"), 'wb') as f:
+                f.write(_make_png(28, 28, (rng.randrange(256), rng.randrange(256), rng.randrange(256))))
+        if gui:
+            _import_tk()
+            root = tk.Tk()
+            make_image = None
+        else:
+            make_image = lambda data: data
+        rss_before = _rss_bytes()
+        
+        def load_all(cache):
+            started = time.perf_counter()
+            cache.prefetch(ids)
+            loaded = 0
+            while loaded < distinct and time.perf_counter() - started < 120:
+                loaded += cache.process_ready()
+                time.sleep(0.001)
+            return distinct / (time.perf_counter() - started)
+        
+        cold_cache = EmoteCache(DirectoryEmoteFetcher(source), EmoteDiskCache(cache_dir),
+                                capacity=distinct, make_image=make_image)
+        cold_rate = load_all(cold_cache)
+        cold_cache.close()
+        warm_cache = EmoteCache(DirectoryEmoteFetcher(os.devnull), EmoteDiskCache(cache_dir),
+                                capacity=distinct, make_image=make_image)
+        warm_rate = load_all(warm_cache)
+        warm_cache.close()
+        rss_after = _rss_bytes()
+        
+        result = {'distinct': distinct, 'cold_per_sec': cold_rate, 'warm_per_sec': warm_rate,
+                  'in_memory': len(warm_cache), 'disk_hits': warm_cache.disk_hits,
+                  'rss_growth': (rss_after - rss_before) if rss_before is not None else None,
+                  'render_us': None, 'render_text_us': None}
+        if gui:
+            records = []
+            for i in range(messages):
+                chosen = rng.sample(ids, 3)
+                text = ' '.join(f"{emote_id} hype" for emote_id in chosen)
+                emotes, position = [], 0
+                for emote_id in chosen:
+                    emotes.append((emote_id, position, position + len(emote_id) - 1))
+                    position += len(emote_id) + 6
+                records.append(ChatRecord('chat', time.time(), f"viewer{i}", text, '#FF7F50',
+                                          emotes=emotes))
+            timings = {}
+            for name, cache in (('render_us', warm_cache), ('render_text_us', None)):
+                view = ChatView(root, scrollback_lines=messages, emotes=cache)
+                started = time.perf_counter()
+                for i in range(0, messages, 50):
+                    view.render(records[i:i + 50])
+                root.update()
+                timings[name] = (time.perf_counter() - started) / messages * 1e6
+                view.widget.frame.destroy()
+            result.update(timings)
+        return result
+    finally:
+        if root is not None:
+            root.destroy()
+        shutil.rmtree(source, ignore_errors=True)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def bench_analyze(lines=300000, jobs=None):
+    """Benchmark analyze_logs on a generated log against reading it line by line.
+    
+    The baseline is the straightforward loop in one process: read_traffic_log()
+    line by line, with the same aggregation applied to each line.
+    
+    Returns:
+        Dict with the corpus size in bytes, the baseline's throughput and,
+        for each process count from 1 up to jobs (default: one per CPU),
+        its MB/s and speedup over one process.
+    """
+    jobs = jobs or os.cpu_count() or 1
+    traffic = SyntheticTraffic(seed=10, chatters=50000)
+    handle, path = tempfile.mkstemp(suffix='.log')
+    try:
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            ts = 1700000000.0
+            for _ in range(lines):
+                ts += 0.01
+                f.write(f"{ts:.6f}\t{traffic.next_line('bench', int(ts * 1000))}\n")
+        size = os.path.getsize(path)
+        
+        started = time.perf_counter()
+        stats = LogStats(('hype',))
+        for _, line in read_traffic_log(path):
+            stats.add_lines(line)
+        baseline = size / (time.perf_counter() - started) / 1e6
+        
+        counts = sorted({1, jobs} | {n for n in (2, 4, 8, 16) if n < jobs})
+        results = []
+        for count in counts:
+            started = time.perf_counter()
+            stats = analyze_logs([path], keywords=('hype',), jobs=count)
+            elapsed = time.perf_counter() - started
+            results.append({'jobs': count, 'mb_per_sec': size / elapsed / 1e6,
+                            'messages': stats.messages})
+        for result in results:
+            result['speedup'] = result['mb_per_sec'] / results[0]['mb_per_sec']
+        return {'bytes': size, 'baseline_mb_per_sec': baseline, 'results': results}
+    finally:
+        os.remove(path)
+
+
+def bench_send(messages=60, commands=5, window=2.0):
+    """Check the send path against a FakeTwitchServer that enforces the chat limits.
+    
+    The window is shortened from Twitch's 30 seconds to keep the run
+    short. A backlog of chat messages is queued at once; half a window
+    later a few moderation commands are queued behind it, while the
+    server keeps streaming chat and PINGs. Runs once as a normal user and
+    once as a moderator.
+    
+    Returns:
+        List of dicts, one per role, with messages accepted, limit
+        violations seen by the server, seconds until all arrived, the
+        positions at which the commands arrived, and the number of PONGs
+        and the worst PONG delay in milliseconds while the backlog was
+        waiting.
+    """
+    async def run(moderator):
+        server = FakeTwitchServer(port=0, rate=200, ping_every=40, moderator=moderator,
+                                  send_window=window)
+        await server.start()
+        serving = asyncio.get_running_loop().create_task(server.serve_forever())
+        client = IrcClient('oauth:bench', lambda msg: None, lambda *args: None, nick='benchbot',
+                           send_limiter=ChatRateLimiter(window=window, slack=0.05),
+                           host='127.0.0.1', port=server.port, use_tls=False)
+        client.channels.append('bench')
+        client.start()
+        while moderator and 'bench' not in client.moderator_in or not server.pong_delays:
+            await asyncio.sleep(0.01)
+        server.pong_delays.clear()
+        
+        started = time.monotonic()
+        for i in range(messages):
+            client.say('bench', f"chat message {i}")
+        await asyncio.sleep(window / 2)
+        for i in range(commands):
+            client.say('bench', f"/timeout viewer{i} 10")
+        total = messages + commands
+        deadline = started + window * (total / SEND_RATE_LIMIT + 3)
+        while len(server.chat_received) < total and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        elapsed = time.monotonic() - started
+        
+        await client.close()
+        await server.close()
+        serving.cancel()
+        return {
+            'role': 'moderator' if moderator else 'user',
+            'accepted': len(server.chat_received),
+            'violations': server.rate_violations,
+            'elapsed': elapsed,
+            'command_positions': [i for i, (_, _, text) in enumerate(server.chat_received)
+                                  if text.startswith('/')],
+            'pongs': len(server.pong_delays),
+            'pong_max_ms': max(server.pong_delays, default=0.0) * 1000,
+        }
+    
+    return [asyncio.run(run(moderator)) for moderator in (False, True)]
+
+
+def bench_reconnect(rate=1000, ping_timeout=0.5):
+    """Measure how long chat stops when the connection is lost.
+    
+    An IrcClient reads from a FakeTwitchServer streaming at rate messages
+    per second, and the connection is lost three ways: the server drops
+    it, sends RECONNECT, or stops answering PINGs (with the client's PING
+    interval and PONG timeout shortened to ping_timeout).
+    
+    Returns:
+        List of dicts, one per way, with milliseconds from the loss until
+        the channel was joined again and until the next message arrived,
+        and the longest gap between messages around it.
+    """
+    async def run(event):
+        server = FakeTwitchServer(port=0, rate=rate)
+        await server.start()
+        serving = asyncio.get_running_loop().create_task(server.serve_forever())
+        arrivals = []
+        
+        def on_message(msg):
+            if msg.command == 'PRIVMSG':
+                arrivals.append(time.monotonic())
+        
+        client = IrcClient('oauth:bench', on_message, lambda *args: None, nick='benchbot',
+                           host='127.0.0.1', port=server.port, use_tls=False)
+        if event == 'ping timeout':
+            client.ping_interval = client.pong_timeout = ping_timeout
+        client.channels.append('bench')
+        client.start()
+        while len(arrivals) < rate // 2:
+            await asyncio.sleep(0.01)
+        
+        lost = time.monotonic()
+        if event == 'drop':
+            server.drop_clients()
+        elif event == 'reconnect':
+            await server.send_reconnect()
+        else:
+            server.answer_pings = False
+        while len(server.joins) < 2:
+            await asyncio.sleep(0.01)
+        server.answer_pings = True
+        rejoined = server.joins[1][0]
+        while not arrivals or arrivals[-1] <= rejoined:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.5)
+        
+        await client.close()
+        await server.close()
+        serving.cancel()
+        resumed = next(t for t in arrivals if t > rejoined)
+        return {
+            'event': event,
+            'rejoin_ms': (rejoined - lost) * 1000,
+            'resume_ms': (resumed - lost) * 1000,
+            'gap_ms': max(b - a for a, b in zip(arrivals, arrivals[1:])) * 1000,
+            'reconnects': client.reconnects,
+        }
+    
+    return [asyncio.run(run(event)) for event in ('drop', 'reconnect', 'ping timeout')]
+
+
+def bench_history(rows=1000000, path=None, queries=20):
+    """Benchmark HistoryStore batched writes and search latency on a large database.
+    
+    Args:
+        rows: Number of synthetic messages to write.
+        path: Database file; a temporary file is used and removed if None.
+        queries: Number of timed queries per query type.
+    
+    Returns:
+        Dict with write throughput, database size and per-query-type latency
+        percentiles in milliseconds.
+    """
+    temporary = path is None
+    if temporary:
+        handle, path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        os.remove(path)
+    try:
+        store = HistoryStore(path, batch_size=5000)
+        traffic = SyntheticTraffic(seed=2, chatters=200000)
+        channels = [f"channel{i}" for i in range(20)]
+        started = time.perf_counter()
+        base_ts = time.time() - rows
+        for i in range(rows):
+            msg = parse_irc_line(traffic.next_line(channels[i % len(channels)], 0))
+            store.add(base_ts + i, channels[i % len(channels)], msg.user or msg.get_tag('login'),
+                      msg.display_name, msg.text, msg.msg_id)
+        store.close()
+        write_rate = rows / (time.perf_counter() - started)
+        
+        store = HistoryStore(path)
+        rng = random.Random(3)
+        kinds = {
+            'word': lambda: (rng.choice(_FAKE_WORDS[:14]), None, None),
+            'two words': lambda: (f"{rng.choice(_FAKE_WORDS[:14])} {rng.choice(_FAKE_WORDS[:14])}", None, None),
+            'word in channel': lambda: (rng.choice(_FAKE_WORDS[:14]), rng.choice(channels), None),
+            'from user': lambda: ('', None, f"viewer{rng.randint(1, 50)}"),
+            'latest in channel': lambda: ('', rng.choice(channels), None),
+        }
+        latency = {}
+        for kind, make in kinds.items():
+            timings = []
+            for _ in range(queries):
+                text, channel, user = make()
+                query_started = time.perf_counter()
+                store.search(text, channel, user)
+                timings.append((time.perf_counter() - query_started) * 1000)
+            timings.sort()
+            latency[kind] = {'p50': _percentile(timings, 0.5), 'max': timings[-1]}
+        store.close()
+        return {'rows': rows, 'write_rate': write_rate,
+                'db_bytes': os.path.getsize(path), 'latency_ms': latency}
+    finally:
+        if temporary:
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+
+
+def run_bench(args):
+    """Run the benchmark suite from parsed command line arguments and print a report."""
+    print("BetterTwitchChat benchmark")
+    framing = bench_framing(args.lines, args.traffic)
+    print(f"  framing:  {framing['sent']} lines over a socketpair (old: decode and split each recv(2048))")
+    for name in ('old', 'framer'):
+        result = framing[name]
+        print(f"    {name:6s} {result['lines_per_sec']:,.0f} lines/s, {result['intact']} intact of "
+              f"{result['lines']} yielded, {result['decode_errors']} reads failed to decode")
+    parse = bench_parse(args.lines, args.traffic)
+    print(f"  parse:    {parse['lines']} lines, {parse['lines_per_sec']:,.0f} lines/s, "
+          f"{parse['mb_per_sec']:.1f} MB/s framed and parsed")
+    print(f"    parser alone {parse['parse_lines_per_sec']:,.0f} lines/s, "
+          f"old parse_message {parse['old_lines_per_sec']:,.0f} lines/s")
+    
+    print("  filters:  per-message cost by rule count (compiled vs one check per rule)")
+    for result in bench_filters():
+        print(f"    {result['rules']:5d} rules: {result['compiled_us']:6.2f} us compiled, "
+              f"{result['per_rule_us']:8.2f} us per-rule")
+    
+    print(f"  colors:   name tags by distinct chatters, pooled vs one tag per user "
+          f"({'Tk' if args.gui else 'widget stub'})")
+    for result in bench_colors(gui=args.gui):
+        print(f"    {result['chatters']:7d} chatters: pooled {result['pooled_us']:.2f} us/msg, "
+              f"{result['pooled_tags']} tags; per user {result['per_user_us']:.2f} us/msg, "
+              f"{result['per_user_tags']} tags")
+    
+    soak = bench_scrollback(args.scrollback_messages, gui=args.gui)
+    print(f"  scrollback: {soak['samples'][-1]['messages']:,} messages into a {soak['scrollback']}-line view "
+          f"({'Tk' if args.gui else 'view bookkeeping without Tk'})")
+    for sample in soak['samples']:
+        rss = f", RSS {sample['rss'] / 1e6:.1f} MB" if sample['rss'] is not None else ""
+        print(f"    {sample['messages']:9,d}: {sample['insert_us']:.2f} us/message "
+              f"(worst batch {sample['worst_us']:.2f}){rss}")
+    
+    print("  moderation: line lookups per event by scrollback (indexed vs scanning the scrollback)")
+    for result in bench_moderation():
+        print(f"    {result['scrollback']:7d} lines: CLEARMSG {result['clearmsg_us']:.2f} us, "
+              f"CLEARCHAT {result['clearchat_us']:.2f} us ({result['user_lines']:.0f} lines), prune {result['prune_us']:.2f} us/line, "
+              f"scan {result['scan_us']:,.0f} us")
+    
+    stats = bench_stats()
+    print(f"  stats:    {stats['messages']:,} messages from {stats['distinct']:,} chatters, "
+          f"{stats['add_us']:.2f} us/message, {stats['sketch_bytes'] / 1e6:.2f} MB "
+          f"(exact dicts {stats['exact_bytes'] / 1e6:.1f} MB)")
+    print(f"    unique chatters off by {stats['estimate_error']:+.1%}, "
+          f"top {STATS_TOP_SHOWN} exact for {stats['top_exact']} of {STATS_TOP_SHOWN}")
+    
+    emotes = bench_emotes(args.emotes, gui=args.gui)
+    print(f"  emotes:   {emotes['distinct']} distinct, cold {emotes['cold_per_sec']:,.0f}/s, "
+          f"from disk cache {emotes['warm_per_sec']:,.0f}/s, {emotes['in_memory']} held in memory"
+          + (f", {emotes['rss_growth'] / 1e6:.1f} MB" if emotes['rss_growth'] is not None else ""))
+    if emotes['render_us'] is not None:
+        print(f"    render: {emotes['render_us']:.0f} us/message with 3 emotes, "
+              f"{emotes['render_text_us']:.0f} us/message as text")
+    
+    overlay = bench_overlay(args.overlay_clients)
+    latency = overlay['latency_ms']
+    print(f"  overlay:  {overlay['clients']} clients ({overlay['stuck']} stuck), "
+          f"{overlay['published']} messages, publish {overlay['publish_us']:.1f} us/msg, "
+          f"worst publisher lag {overlay['worst_lag_ms']:.1f} ms")
+    print(f"    reading clients got {overlay['min_share']:.1%} (min) / {overlay['mean_share']:.1%} (mean), "
+          f"latency p50 {latency['p50']:.1f} ms, p99 {latency['p99']:.1f} ms; "
+          f"stuck clients {overlay['stuck_behind']} messages behind")
+    
+    print(f"  startup:  median of {args.startup_runs} cold starts, ms from launch "
+          f"(gui deferred is the old order: build the window, then connect 1 s later)")
+    for mode, timing in bench_startup(args.startup_runs, args.gui).items():
+        window = f", window built {timing['window']:.0f}" if timing['window'] is not None else ""
+        print(f"    {mode:12s} imported {timing['imported']:.0f}{window}, "
+              f"first message {'on screen' if mode != 'headless' else 'received'} "
+              f"{timing['first_message']:.0f}")
+    
+    analysis = bench_analyze(args.analyze_lines)
+    print(f"  analyze:  {analysis['bytes'] / 1e6:.0f} MB log, read line by line "
+          f"{analysis['baseline_mb_per_sec']:.1f} MB/s")
+    for result in analysis['results']:
+        print(f"    {result['jobs']:2d} processes: {result['mb_per_sec']:.1f} MB/s "
+              f"({result['speedup']:.2f}x)")
+    
+    print("  send:     chat limits enforced by the fake server, 2 s window instead of 30 s")
+    for result in bench_send():
+        print(f"    {result['role']:9s} {result['accepted']} accepted in {result['elapsed']:.1f}s, "
+              f"{result['violations']} limit violations, commands arrived at "
+              f"{result['command_positions']}, worst PONG delay {result['pong_max_ms']:.1f} ms")
+    
+    print(f"  reconnect: chat lost and resumed at {args.rate} msg/s")
+    for result in bench_reconnect(args.rate):
+        print(f"    {result['event']:12s} rejoined after {result['rejoin_ms']:.0f} ms, next message "
+              f"{result['resume_ms']:.0f} ms, longest gap {result['gap_ms']:.0f} ms")
+    
+    print(f"  ingest:   UI frames at {RENDER_FPS} fps under {args.rate} msg/s for {args.duration:g}s, "
+          f"ingesting on a thread vs in a child process ({'Tk' if args.gui else 'headless'} render)")
+    for mode, result in bench_ingest(args.rate, args.duration, args.gui).items():
+        work, gaps = result['work_ms'], result['interval_ms']
+        print(f"    {mode:7s} frame work p50 {work['p50']:.2f} ms, p99 {work['p99']:.2f} ms, "
+              f"max {work['max']:.1f} ms; frame interval p99 {gaps['p99']:.1f} ms, "
+              f"max {gaps['max']:.1f} ms; {result['delivered']} delivered, {result['dropped']} dropped")
+    
+    pipe = bench_pipeline(args.rate, args.duration, args.gui, args.traffic)
+    latency = pipe['latency_ms']
+    print(f"  pipeline: {args.rate} msg/s for {args.duration:g}s "
+          f"({'Tk' if args.gui else 'headless'} render)")
+    print(f"    sent {pipe['sent']}, rendered {pipe['rendered']}, dropped {pipe['dropped']} "
+          f"(queue overflow {pipe['queue_dropped']})")
+    print(f"    ingest-to-display latency: p50 {latency['p50']:.1f} ms, p90 {latency['p90']:.1f} ms, "
+          f"p99 {latency['p99']:.1f} ms, max {latency['max']:.1f} ms")
+    if pipe['rss_growth'] is not None:
+        print(f"    memory growth: {pipe['rss_growth'] / 1e6:.1f} MB")
+    else:
+        print("    memory growth: n/a on this platform")
+    
+    if args.history_rows:
+        history = bench_history(args.history_rows)
+        print(f"  history:  {history['rows']} messages written at {history['write_rate']:,.0f} msg/s, "
+              f"{history['db_bytes'] / 1e6:.0f} MB on disk")
+        for kind, timing in history['latency_ms'].items():
+            print(f"    {kind:18s} p50 {timing['p50']:.1f} ms, max {timing['max']:.1f} ms")
+
+
+def run_analyze(args):
+    """Analyze chat logs from parsed command line arguments and write the report."""
+    fmt = args.format or ('csv' if args.output.lower().endswith('.csv') else 'json')
+    jobs = args.jobs or os.cpu_count() or 1
+    started = time.perf_counter()
+    try:
+        stats = analyze_logs(args.logs, args.keyword, jobs)
+    except OSError as e:
+        sys.exit(f"Could not read log: {e}")
+    elapsed = time.perf_counter() - started
+    report = stats.to_report()
+    report['files'] = args.logs
+    write_analysis(report, args.output, fmt)
+    size = sum(os.path.getsize(path) for path in args.logs)
+    print(f"Analyzed {stats.lines} lines ({size / 1e6:.1f} MB) in {elapsed:.1f}s "
+          f"with {jobs} process{'es' if jobs != 1 else ''}", file=sys.stderr)
+
+
+def run_fake_server(args):
+    """Run a FakeTwitchServer in the foreground from parsed command line arguments."""
+    traffic = RecordedTraffic(args.traffic) if args.traffic else SyntheticTraffic()
+    server = FakeTwitchServer(args.host, args.port, args.rate, traffic,
+                              replay=args.replay, speed=args.speed, moderator=args.mod,
+                              send_window=args.send_window)
+    
+    async def serve():
+        await server.start()
+        source = f"replaying {args.replay}" if args.replay else f"at {args.rate} msg/s"
+        print(f"Fake Twitch IRC server on {args.host}:{server.port} {source} "
+              f"(connect with --server {args.host}:{server.port} --no-tls)")
+        await server.serve_forever()
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print(f"\nSent {server.sent} messages")
 
 
-def main():
-    """Main function to start the GUI application."""
+def main(argv=None):
+    """Main function to start the GUI application, or one of the tools."""
+    parser = argparse.ArgumentParser(description="Twitch chat reader with a GUI interface.")
+    parser.add_argument('--headless', action='store_true',
+                        help="run without a GUI and write messages as JSON lines")
+    parser.add_argument('--channels',
+                        help="channels to join in headless mode (default: from settings)")
+    parser.add_argument('-o', '--output', default='-',
+                        help="JSONL output file in headless mode (default: stdout)")
+    parser.add_argument('--server', type=parse_endpoint,
+                        help="IRC server as host[:port] (default: from settings, else Twitch)")
+    parser.add_argument('--no-tls', dest='use_tls', action='store_false', default=None,
+                        help="connect without TLS, e.g. to a local fake server")
+    parser.add_argument('--record', metavar='FILE',
+                        help="append every received raw line to a gzip traffic log")
+    parser.add_argument('--replay', metavar='FILE',
+                        help="play a traffic log into the app instead of connecting")
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                        help="replay speed: 1 for real time, N for N times faster, or 'max'")
+    parser.add_argument('--history', metavar='FILE',
+                        help="save chat history to this SQLite database")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="serve Prometheus metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument('--overlay-port', type=int, metavar='PORT',
+                        help="stream chat to browser sources at http://127.0.0.1:PORT/")
+    parser.add_argument('--ingest-process', action='store_true', default=None,
+                        help="read and parse chat in a separate process")
+    parser.add_argument('--log-level', default='INFO',
+                        choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'),
+                        help="console log level (default: INFO)")
+    subparsers = parser.add_subparsers(dest='command')
+    
+    fake = subparsers.add_parser('fake-server', help="run a local fake Twitch IRC server")
+    fake.add_argument('--host', default='127.0.0.1')
+    fake.add_argument('--port', type=int, default=FAKE_SERVER_PORT)
+    fake.add_argument('--rate', type=float, default=100, help="messages per second per client")
+    fake.add_argument('--traffic', help="play back raw IRC lines from this file instead of synthetic traffic")
+    fake.add_argument('--replay', metavar='FILE',
+                      help="replay a traffic log with its recorded timing instead")
+    fake.add_argument('--speed', type=parse_speed, default=1.0,
+                      help="replay speed: 1 for real time, N for N times faster, or 'max'")
+    fake.add_argument('--mod', action='store_true',
+                      help="treat clients as moderators (100 instead of 20 messages per window)")
+    fake.add_argument('--send-window', type=float, default=SEND_RATE_WINDOW,
+                      help="seconds over which sent chat messages are counted (default: 30)")
+    
+    analyze = subparsers.add_parser('analyze', help="aggregate chat logs into a JSON or CSV report")
+    analyze.add_argument('logs', nargs='+', metavar='LOG',
+                         help="raw IRC line logs or traffic logs (gzip logs are read by one process each)")
+    analyze.add_argument('-o', '--output', default='-', help="report file (default: stdout)")
+    analyze.add_argument('--format', choices=('json', 'csv'),
+                         help="report format (default: csv for a .csv output file, else json)")
+    analyze.add_argument('-k', '--keyword', action='append', default=[],
+                         help="count messages containing this word; repeat for more")
+    analyze.add_argument('-j', '--jobs', type=int, help="worker processes (default: one per CPU)")
+    
+    bench = subparsers.add_parser('bench', help="run the benchmark suite against a local fake server")
+    bench.add_argument('--rate', type=int, default=1000, help="messages per second")
+    bench.add_argument('--duration', type=float, default=10.0, help="seconds of traffic")
+    bench.add_argument('--lines', type=int, default=200000, help="lines for the parse benchmark")
+    bench.add_argument('--traffic', help="play back raw IRC lines from this file instead of synthetic traffic")
+    bench.add_argument('--gui', action='store_true', help="render into a real Tk chat view")
+    bench.add_argument('--emotes', type=int, default=5000,
+                       help="distinct emotes for the emote cache benchmark")
+    bench.add_argument('--analyze-lines', type=int, default=300000,
+                       help="lines in the generated log for the analyze benchmark")
+    bench.add_argument('--scrollback-messages', type=int, default=1000000,
+                       help="messages for the scrollback soak test")
+    bench.add_argument('--startup-runs', type=int, default=5,
+                       help="cold starts to time for the startup benchmark")
+    bench.add_argument('--overlay-clients', type=int, default=300,
+                       help="simulated browser sources for the overlay load test")
+    bench.add_argument('--history-rows', type=int, default=0,
+                       help="also benchmark chat history search on a database of this many messages")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=args.log_level, stream=sys.stderr,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    
+    endpoint = dict(args.server or {})
+    if args.use_tls is not None:
+        endpoint['use_tls'] = args.use_tls
+    args.endpoint = endpoint
+    
+    if args.command == 'fake-server':
+        run_fake_server(args)
+        return
+    if args.command == 'analyze':
+        run_analyze(args)
+        return
+    if args.command == 'bench':
+        run_bench(args)
+        return
+    if args.headless:
+        main_headless(args)
+        return
+    
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     
-    chat_window = ChatWindow()
+    replay = (args.replay, args.speed) if args.replay else None
+    chat_window = ChatWindow(endpoint, args.record, replay, args.history, args.metrics_port,
+                             args.overlay_port, ingest_process=args.ingest_process)
     signal_handler.chat_window = chat_window
     chat_window.run()
 
 
+def main_headless(args):
+    """Run headless mode from parsed command line arguments.
+    
+    Diagnostics go to stderr through logging, so stdout carries only JSONL.
+    """
+    if args.replay:
+        writer = JsonlWriter(args.output)
+        
+        def on_message(msg):
+            if msg.command in ARCHIVED_COMMANDS:
+                writer.write(msg)
+        try:
+            replay_traffic_log(args.replay, args.speed, on_message)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            writer.close()
+        print(f"Wrote {writer.count} messages", file=sys.stderr)
+        return
+    
+    try:
+        settings = read_settings()
+    except Exception as e:
+        log.warning("Could not load settings: %s", e)
+        settings = {}
+    token = settings.get('token') or TOKEN
+    if token.strip().lower() == 'oauth:__changeme__':
+        sys.exit("OAuth token not configured. Please add your token to chat_settings.json.")
+    channels = parse_channel_list(args.channels if args.channels else settings.get('channel', ''))
+    if not channels:
+        sys.exit("No channels given. Use --channels or set 'channel' in chat_settings.json.")
+    
+    max_connections = settings.get('max_connections', MAX_CONNECTIONS)
+    endpoint = read_endpoint(settings)
+    endpoint.update(args.endpoint)
+    record_path = args.record or settings.get('record_path')
+    recorder = TrafficRecorder(record_path) if record_path else None
+    history_path = args.history or settings.get('history_db')
+    history = HistoryStore(history_path) if history_path else None
+    metrics_port = args.metrics_port or settings.get('metrics_port')
+    metrics_server = MetricsServer(metrics, metrics_port) if metrics_port else None
+    overlay_port = args.overlay_port or settings.get('overlay_port')
+    overlay = OverlayServer(overlay_port) if overlay_port else None
+    # Stop on SIGTERM like on Ctrl+C, so the logs below are closed cleanly
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        count = asyncio.run(run_headless(token, channels, args.output, max_connections,
+                                         recorder, history, overlay, **endpoint))
+    except KeyboardInterrupt:
+        count = None
+    finally:
+        if recorder:
+            recorder.close()
+        if history:
+            history.close()
+        if metrics_server:
+            metrics_server.close()
+    if count is not None:
+        print(f"Wrote {count} messages", file=sys.stderr)
+
+
 if __name__ == '__main__':
     main()
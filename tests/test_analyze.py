@@ -0,0 +1,12 @@
+from BetterTwitchChat import analyze_logs, read_traffic_log
+
+LINE = "@id={i} :alice!alice@alice.tmi.twitch.tv PRIVMSG #chan :before\u2028after \x85 \x1c pog"
+
+
+def test_line_separators_inside_messages(tmp_path):
+    path = tmp_path / 'raw.log'
+    path.write_text(''.join(LINE.format(i=i) + '\r\n' for i in range(3)), encoding='utf-8')
+    stats = analyze_logs([str(path)], ['after', 'pog'], jobs=1)
+    assert stats.lines == 3 == len(list(read_traffic_log(str(path))))
+    assert stats.messages == 3
+    assert stats.keyword_hits == {'after': 3, 'pog': 3}
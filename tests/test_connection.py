@@ -0,0 +1,158 @@
+import asyncio
+import time
+
+from BetterTwitchChat import (BACKOFF_BASE, ConnectionPool, FakeTwitchServer, IrcClient,
+                              JoinRateLimiter)
+
+
+def run_with_server(test, **server_args):
+    """Run test(server) on a fresh event loop against a FakeTwitchServer."""
+    async def run():
+        server = FakeTwitchServer(port=0, **server_args)
+        await server.start()
+        serving = asyncio.get_running_loop().create_task(server.serve_forever())
+        try:
+            return await test(server)
+        finally:
+            await server.close()
+            serving.cancel()
+    return asyncio.run(run())
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def make_client(server, received):
+    client = IrcClient('oauth:test', lambda msg: received.append((time.monotonic(), msg)),
+                       lambda *args: None, nick='testbot',
+                       host='127.0.0.1', port=server.port, use_tls=False)
+    client.channels.append('test')
+    return client
+
+
+def privmsgs_after(received, since):
+    return [msg for t, msg in received if t > since and msg.command == 'PRIVMSG']
+
+
+def channels_seen(messages):
+    return {msg.channel.lstrip('#') for msg in messages if msg.command == 'PRIVMSG'}
+
+
+def test_pool_routes_every_channel_over_its_connections():
+    channels = [f"channel{i}" for i in range(8)]
+
+    async def test(server):
+        received = []
+        pool = ConnectionPool('oauth:test', received.append, lambda status: None, None,
+                              max_connections=3, nick='testbot',
+                              host='127.0.0.1', port=server.port, use_tls=False)
+        await pool.open(channels)
+        await wait_for(lambda: channels_seen(received) >= set(channels))
+        await pool.close_async()
+        return pool, received
+
+    pool, received = run_with_server(test, rate=400)
+    assert len(pool.clients) == 3
+    # Every channel was given to exactly one connection...
+    assigned = [channel for client in pool.clients for channel in client.channels]
+    assert sorted(assigned) == sorted(channels)
+    for channel in channels:
+        assert channel in pool.client_for(channel).channels
+    # ...and its messages reached on_message with the right channel
+    assert channels_seen(received) == set(channels)
+
+
+def test_pool_joins_respect_the_shared_rate_limit():
+    limit, window, channels = 3, 0.5, [f"channel{i}" for i in range(10)]
+
+    async def test(server):
+        pool = ConnectionPool('oauth:test', lambda msg: None, lambda status: None, None,
+                              max_connections=2, nick='testbot',
+                              host='127.0.0.1', port=server.port, use_tls=False)
+        pool.limiter = JoinRateLimiter(limit, window)
+        await pool.open(channels)
+        await wait_for(lambda: len(server.joins) == len(channels))
+        await pool.close_async()
+        return [t for t, _ in server.joins]
+
+    times = run_with_server(test, rate=10)
+    # Both connections share one limiter, so no window ever holds more than
+    # limit JOINs, and ten of them take at least three windows
+    for first, last in zip(times, times[limit:]):
+        assert last - first >= window - 0.05
+    assert times[-1] - times[0] >= window * 3 - 0.05
+
+
+def test_client_resumes_after_the_connection_drops():
+    async def test(server):
+        received = []
+        client = make_client(server, received)
+        client.start()
+        await wait_for(lambda: privmsgs_after(received, 0))
+        dropped = time.monotonic()
+        server.drop_clients()
+        await wait_for(lambda: privmsgs_after(received, dropped + 0.1))
+        await client.close()
+        return client
+
+    client = run_with_server(test, rate=100)
+    assert client.reconnects == 1
+
+
+def test_client_follows_reconnect():
+    async def test(server):
+        received = []
+        client = make_client(server, received)
+        client.start()
+        await wait_for(lambda: privmsgs_after(received, 0))
+        asked = time.monotonic()
+        await server.send_reconnect()
+        await wait_for(lambda: len(server.joins) == 2)
+        await wait_for(lambda: privmsgs_after(received, server.joins[1][0]))
+        await client.close()
+        return client, server.joins[1][0] - asked
+
+    client, rejoined_after = run_with_server(test, rate=100)
+    assert client.reconnects == 1
+    # RECONNECT is followed right away, without backing off
+    assert rejoined_after < 0.5
+
+
+def test_client_reconnects_when_pings_go_unanswered():
+    async def test(server):
+        received = []
+        client = make_client(server, received)
+        client.ping_interval = client.pong_timeout = 0.2
+        server.answer_pings = False
+        client.start()
+        await wait_for(lambda: len(server.connect_times) >= 2)
+        server.answer_pings = True
+        reconnected = time.monotonic()
+        await wait_for(lambda: privmsgs_after(received, reconnected))
+        await client.close()
+        return client, server.connect_times[1] - server.connect_times[0]
+
+    client, detected_after = run_with_server(test, rate=100)
+    assert client.reconnects >= 1
+    assert 0.4 <= detected_after < 1.0
+
+
+def test_client_backs_off_between_failed_connections():
+    async def test(server):
+        server.refuse = True
+        client = make_client(server, [])
+        client.start()
+        await wait_for(lambda: len(server.connect_times) >= 4, timeout=10.0)
+        await client.close()
+        return server.connect_times
+
+    times = run_with_server(test, rate=100)
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    # The first retry is immediate, then each delay doubles with jitter
+    assert gaps[0] < BACKOFF_BASE * 0.25
+    assert BACKOFF_BASE * 0.5 <= gaps[1] < BACKOFF_BASE + 0.25
+    assert BACKOFF_BASE <= gaps[2] < BACKOFF_BASE * 2 + 0.25
@@ -0,0 +1,15 @@
+from BetterTwitchChat import parse_irc_line, remove_from_emote_ranges
+
+
+def test_ranges_follow_removed_replacement_characters():
+    msg = parse_irc_line("@emotes=25:7-11,19-23;id=1 :a!a@a.tmi.twitch.tv PRIVMSG #chan :\uFFFDhi \uFFFD\uFFFD Kappa and \uFFFD Kappa")
+    text = msg.text
+    cleaned = text.replace('\uFFFD', '')
+    assert [text[start:end + 1] for _, start, end in msg.emotes] == ['Kappa', 'Kappa']
+    ranges = remove_from_emote_ranges(text, msg.emotes, '\uFFFD')
+    assert [cleaned[start:end + 1] for _, start, end in ranges] == ['Kappa', 'Kappa']
+
+
+def test_range_covering_a_removed_character_is_dropped():
+    assert remove_from_emote_ranges("ab\uFFFDcd", [('1', 1, 3)], '\uFFFD') == []
+    assert remove_from_emote_ranges("abcd", [('1', 1, 3)], '\uFFFD') == [('1', 1, 3)]
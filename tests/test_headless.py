@@ -0,0 +1,25 @@
+import json
+import os
+import subprocess
+import sys
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'BetterTwitchChat.py')
+
+LINES = [
+    "@display-name=Alice;color=#FF0000;id=1 :alice!alice@alice.tmi.twitch.tv PRIVMSG #chan :hello",
+    ":tmi.twitch.tv PONG tmi.twitch.tv",
+    "@display-name=Bob;id=2 :bob!bob@bob.tmi.twitch.tv PRIVMSG #chan :hi there",
+]
+
+
+def test_replay_writes_jsonl_to_stdout(tmp_path):
+    log_path = tmp_path / 'raw.log'
+    log_path.write_text('\n'.join(LINES) + '\n', encoding='utf-8')
+    result = subprocess.run([sys.executable, APP, '--headless', '--replay', str(log_path),
+                             '--speed', 'max'],
+                            capture_output=True, text=True, timeout=60, cwd=str(tmp_path))
+    assert result.returncode == 0, result.stderr
+    records = [json.loads(line) for line in result.stdout.splitlines()]
+    assert [(r['user'], r['text']) for r in records] == [('alice', 'hello'), ('bob', 'hi there')]
+    assert records[0]['channel'] == 'chan'
+    assert '{' not in result.stderr
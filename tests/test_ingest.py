@@ -0,0 +1,74 @@
+import gzip
+import multiprocessing
+import os
+import signal
+import time
+
+import pytest
+
+from BetterTwitchChat import IngestProcess, IngestRing, IrcMessage, _run_fake_server
+
+
+@pytest.fixture
+def fake_server():
+    ready = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_run_fake_server, args=(0, 200, 100000, None, ready),
+                                     daemon=True)
+    server.start()
+    yield {'host': '127.0.0.1', 'port': ready.get(timeout=30), 'use_tls': False}
+    server.terminate()
+    server.join()
+
+
+def drain_for(ingest, seconds):
+    items = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        ingest.check()
+        items.extend(ingest.drain())
+        time.sleep(0.02)
+    return items
+
+
+def test_ring_round_trip_and_truncation():
+    ring = IngestRing.create(slots=4)
+    try:
+        assert ring.put(2, '#chan', 'alice', 'color=#FF0000;id=1', 'hé' * 2000, 1.5)
+        for i in range(3):
+            assert ring.put(2, '#chan', 'bob', '', str(i), 2.0)
+        assert not ring.put(2, '#chan', 'bob', '', 'full', 3.0)
+        records = ring.drain()
+        assert [record[5] for record in records[1:]] == ['0', '1', '2']
+        ts, kind, channel, user, tags, text = records[0]
+        assert (ts, kind, channel, user, tags) == (1.5, 2, '#chan', 'alice', 'color=#FF0000;id=1')
+        assert 0 < len(text.encode('utf-8')) <= ring.slot_size and set(text) == {'h', 'é'}
+        assert ring.dropped == 1
+    finally:
+        ring.close()
+        ring.memory.unlink()
+
+
+def test_restart_after_crash_and_clean_recording(tmp_path, fake_server):
+    record_path = str(tmp_path / 'traffic.log.gz')
+    ingest = IngestProcess('oauth:test', ['chan'], record_path=record_path, endpoint=fake_server)
+    ingest.start()
+    try:
+        before = drain_for(ingest, 1.5)
+        assert any(isinstance(item, IrcMessage) and item.command == 'PRIVMSG' for item in before)
+        os.kill(ingest.process.pid, signal.SIGKILL)
+        deadline = time.monotonic() + 5
+        while ingest.restarts == 0 and time.monotonic() < deadline:
+            drain_for(ingest, 0.1)
+        assert ingest.restarts == 1
+        # Chat read by the restarted child is delivered again
+        after = drain_for(ingest, 2.0)
+        assert any(isinstance(item, IrcMessage) and item.command == 'PRIVMSG' for item in after)
+    finally:
+        ingest.close()
+    
+    # The restarted child closed its recording on the way out, so the last
+    # session ends with a complete gzip member
+    with open(record_path, 'rb') as f:
+        data = f.read()
+    last_member = data[data.rfind(b'\x1f\x8b\x08'):]
+    assert gzip.decompress(last_member).endswith(b'\n')
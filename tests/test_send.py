@@ -0,0 +1,18 @@
+from BetterTwitchChat import SEND_RATE_LIMIT, bench_send
+
+
+def test_send_queue_respects_the_fake_servers_limits():
+    messages, commands, window = 30, 3, 1.0
+    user, moderator = bench_send(messages, commands, window)
+    
+    for result in (user, moderator):
+        assert result['violations'] == 0
+        assert result['accepted'] == messages + commands
+    
+    # The commands were queued after the first window's worth of chat went
+    # out, and overtook the chat still waiting for the next window
+    positions = user['command_positions']
+    assert positions == list(range(SEND_RATE_LIMIT, SEND_RATE_LIMIT + commands))
+    # PONGs were answered while the backlog waited for the window to pass
+    assert user['pongs'] > 0
+    assert user['pong_max_ms'] < window * 1000 / 2
@@ -0,0 +1,36 @@
+import json
+import os
+import time
+
+from BetterTwitchChat import SettingsStore
+
+
+def test_typing_a_channel_name_writes_once(tmp_path, monkeypatch):
+    path = tmp_path / 'chat_settings.json'
+    path.write_text(json.dumps({'token': 'oauth:secret'}))
+    replaced = []
+    real_replace = os.replace
+    
+    def counting_replace(src, dst):
+        replaced.append(dst)
+        real_replace(src, dst)
+    monkeypatch.setattr(os, 'replace', counting_replace)
+    
+    store = SettingsStore(str(path), debounce=0.3)
+    name = 'averyveryverylongchannelname30'
+    assert len(name) == 30
+    for i in range(1, len(name) + 1):
+        store.update({'channel': name[:i]})
+        time.sleep(0.002)
+    
+    deadline = time.monotonic() + 5
+    while store.writes == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.5)
+    assert replaced == [str(path)]
+    assert store.writes == 1
+    assert json.loads(path.read_text()) == {'token': 'oauth:secret', 'channel': name}
+    assert os.listdir(tmp_path) == ['chat_settings.json']
+    
+    store.close()
+    assert store.writes == 1
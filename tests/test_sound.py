@@ -0,0 +1,28 @@
+import threading
+import time
+
+from BetterTwitchChat import NullAudioBackend, SoundManager
+
+
+def test_burst_is_coalesced_on_one_thread():
+    backend = NullAudioBackend()
+    manager = SoundManager(backend, min_interval=0.05)
+    calls = 1000
+    duration = 0.5
+    
+    manager.play_sound()
+    threads = threading.active_count()
+    started = time.monotonic()
+    for i in range(1, calls):
+        manager.play_sound()
+        assert threading.active_count() == threads
+        time.sleep(duration / calls)
+    elapsed = time.monotonic() - started
+    
+    deadline = time.monotonic() + 2
+    while manager.played + manager.suppressed < calls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert manager.played + manager.suppressed == calls
+    assert backend.plays == manager.played
+    assert manager.played <= elapsed / manager.min_interval + 2
+    assert threading.active_count() == threads
@@ -0,0 +1,99 @@
+import gzip
+import os
+import subprocess
+import sys
+import textwrap
+import zlib
+
+from BetterTwitchChat import TrafficRecorder, analyze_logs, read_traffic_log
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def chat_line(i):
+    return f"@id={i} :viewer{i % 50}!viewer{i % 50}@tmi.twitch.tv PRIVMSG #chan :message number {i}"
+
+
+def record_and_crash(path, first, count):
+    """Record lines in a child process that dies without closing the recorder."""
+    code = textwrap.dedent(f"""
+        import os, sys
+        sys.path.insert(0, {ROOT!r})
+        from BetterTwitchChat import TrafficRecorder
+        recorder = TrafficRecorder({str(path)!r}, flush_interval=3600)
+        for i in range({first}, {first + count}, 100):
+            recorder.record([f"@id={{j}} :viewer{{j % 50}}!viewer{{j % 50}}@tmi.twitch.tv "
+                             f"PRIVMSG #chan :message number {{j}}" for j in range(i, i + 100)])
+        os._exit(0)
+    """)
+    subprocess.run([sys.executable, '-c', code], check=True, timeout=60)
+
+
+def record(path, first, count):
+    recorder = TrafficRecorder(path)
+    recorder.record([chat_line(i) for i in range(first, first + count)])
+    recorder.close()
+
+
+def read_ids(path):
+    return [int(line.partition(' ')[0][4:]) for _, line in read_traffic_log(path)]
+
+
+def test_crashed_last_session_keeps_what_was_written(tmp_path):
+    path = tmp_path / 'traffic.log.gz'
+    record(path, 0, 1000)
+    record_and_crash(path, 1000, 50000)
+    with open(path, 'rb') as f:
+        data = f.read()
+    try:
+        gzip.decompress(data)
+    except EOFError:
+        pass
+    else:
+        raise AssertionError("the crashed session should leave an unfinished gzip member")
+    
+    ids = read_ids(path)
+    assert ids[:1000] == list(range(1000))
+    assert 1000 < len(ids) <= 51000
+    assert ids == list(range(len(ids)))
+
+
+def test_sessions_after_a_crash_are_still_read(tmp_path):
+    path = tmp_path / 'traffic.log.gz'
+    record(path, 0, 1000)
+    record_and_crash(path, 1000, 50000)
+    record(path, 100000, 1000)
+    
+    ids = read_ids(path)
+    assert ids[:1000] == list(range(1000))
+    assert ids[-1000:] == list(range(100000, 101000))
+    stats = analyze_logs([str(path)], jobs=1)
+    assert stats.lines == len(ids)
+
+
+def test_members_after_a_cut_anywhere_are_read(tmp_path):
+    path = tmp_path / 'traffic.log.gz'
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    cut = compressor.compress("".join(f"0\t{chat_line(i)}\n" for i in range(1000, 6000)).encode())
+    cut += compressor.flush(zlib.Z_SYNC_FLUSH)
+    first = gzip.compress("".join(f"0\t{chat_line(i)}\n" for i in range(100)).encode())
+    last = gzip.compress("".join(f"0\t{chat_line(i)}\n" for i in range(100000, 100100)).encode())
+    for end in range(20, len(cut), len(cut) // 50):
+        path.write_bytes(first + cut[:end] + last)
+        ids = read_ids(path)
+        # Whatever was decoded of the cut member is real, never the next header read as more of it
+        middle = ids[100:-100]
+        assert ids[:100] == list(range(100))
+        assert middle == list(range(1000, 1000 + len(middle)))
+        assert ids[-100:] == list(range(100000, 100100))
+
+
+def test_recorder_closes_members_as_it_goes(tmp_path):
+    path = tmp_path / 'traffic.log.gz'
+    recorder = TrafficRecorder(path, flush_interval=0)
+    for i in range(5):
+        recorder.record([chat_line(i)])
+    # Everything recorded so far is readable before the recorder is closed
+    assert read_ids(path) == list(range(5))
+    recorder.close()
+    assert read_ids(path) == list(range(5))